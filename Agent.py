@@ -1,40 +1,226 @@
 import numpy as np
 import pygame
 
-MAX_ACC_DELTA = 10
+MAX_JERK = 1000  # m/s^3, which lets the acceleration change by 10 m/s^2 in a 0.01 s step
 
-class Agent:
 
-    def __init__(self, screen=None):
+def clamp_norm(vectors, max_norm):
+    """Scale down the rows of an (N, 2) array in place so that none is longer than max_norm. None means no limit"""
+    if max_norm is None:
+        return vectors
+    norms = np.sqrt(np.sum(vectors * vectors, axis=1))
+    too_long = norms > max_norm
+    vectors[too_long] *= (max_norm / norms[too_long])[:, np.newaxis]
+    return vectors
+
+
+def limit_acceleration_change(current, requested, max_jerk, dt):
+    """Get the accelerations closest to requested that differ from current by at most max_jerk * dt, for (N, 2) arrays"""
+    delta = np.array(requested, dtype=float) - current
+    return current + clamp_norm(delta.reshape(-1, 2), None if max_jerk is None else max_jerk * dt).reshape(delta.shape)
+
 
-        self._pos = np.array([0,0])
-        self._vel = np.array([0,0])
-        self._acc = np.array([0,0])
+def integrate(positions, velocities, accelerations, dt, max_vel, pos_limit):
+    """
+    Advance (N, 2) position and velocity arrays in place by one time step
+    Velocities are clamped to max_vel, and positions to pos_limit meters from the origin along each axis. An agent stopped
+    by the position limit loses its velocity along that axis
+    """
+    velocities += accelerations * dt
+    clamp_norm(velocities, max_vel)
+    positions += velocities * dt
+    if pos_limit is not None:
+        outside = np.abs(positions) > pos_limit
+        np.clip(positions, -pos_limit, pos_limit, out=positions)
+        velocities[outside] = 0
+
+
+class Agent:
+
+    def __init__(self, screen=None, max_vel=None, max_jerk=MAX_JERK, pos_limit=None):
+        """
+        Create an agent at the origin
+        :param screen: pygame screen to draw on
+        :param max_vel: speed limit in meters/second, None for no limit
+        :param max_jerk: fastest change of acceleration in meters/second^3, so a step of dt seconds moves the acceleration at
+                         most max_jerk * dt towards the commanded one. None for no limit
+        :param pos_limit: distance from the origin along each axis in meters that the agent cannot move past, None for no limit
+        """
+        self.swarm = None
+        self.swarm_index = None
+        self.max_vel = max_vel
+        self.max_jerk = max_jerk
+        self.pos_limit = pos_limit
+        self._pos = np.array([0.0, 0.0])
+        self._vel = np.array([0.0, 0.0])
+        self._acc = np.array([0.0, 0.0])
+        self._acc_command = np.array([0.0, 0.0])
 
         if screen:
             self.screen = screen
 
+    @property
+    def pos(self):
+        """Position of the agent. While the agent is in an AgentSwarm this is a view of its row in the swarm"""
+        if self.swarm is None:
+            return self._pos
+        return self.swarm.positions[self.swarm_index]
+
+    @property
+    def vel(self):
+        if self.swarm is None:
+            return self._vel
+        return self.swarm.velocities[self.swarm_index]
+
+    @property
+    def acc(self):
+        """Acceleration applied in the last step"""
+        if self.swarm is None:
+            return self._acc
+        return self.swarm.accelerations[self.swarm_index]
+
+    @property
+    def acc_command(self):
+        """Acceleration last commanded with set_acc, which the applied acceleration moves towards"""
+        if self.swarm is None:
+            return self._acc_command
+        return self.swarm.acc_commands[self.swarm_index]
+
     def get_pos(self):
-        return self._pos
+        return self.pos
 
     def get_vel(self):
-        return self._vel
+        return self.vel
 
     def get_acc(self):
-        return self._acc
+        return self.acc
 
     def set_acc(self, acc):
-        #da = np.abs(acc - self.get_acc())
-        #TODO: Add jerk lims
-        self._acc = acc
+        """Command an acceleration. The next steps move the applied acceleration towards it within max_jerk (the swarm's limit while in a swarm)"""
+        if self.swarm is not None:
+            self.swarm.set_accelerations(np.reshape(acc, (1, 2)), [self.swarm_index])
+        else:
+            self._acc_command = np.array(acc, dtype=float).reshape(2)
 
     def step(self, dt):
-        self._vel = self._vel + self._acc * dt
-        #TODO: Add vel lims
-        self._pos = self._pos + self._vel * dt
-        #TODO: Add pos lims
+        """Integrate this agent alone. Agents in a swarm are normally stepped together with AgentSwarm.step"""
+        if self.swarm is not None:
+            self.swarm.step(dt, [self.swarm_index])
+        else:
+            positions = np.array(self._pos, dtype=float).reshape(1, 2)
+            velocities = np.array(self._vel, dtype=float).reshape(1, 2)
+            self._acc = limit_acceleration_change(self._acc, self._acc_command, self.max_jerk, dt)
+            integrate(positions, velocities, self._acc.reshape(1, 2), dt, self.max_vel, self.pos_limit)
+            self._pos = positions[0]
+            self._vel = velocities[0]
 
     def draw(self):
         pass
 
-#TODO: Consider splitting agent into discrete and continous agent children
\ No newline at end of file
+#TODO: Consider splitting agent into discrete and continous agent children
+
+
+class AgentSwarm:
+    """Structure of arrays storage for many agents so they can all be integrated with one vectorized step
+    Agents added to the swarm keep working as normal objects, but their state becomes views into the swarm arrays and they
+    use the swarm's limits"""
+
+    def __init__(self, agents=(), capacity=16, max_vel=None, max_jerk=MAX_JERK, pos_limit=None):
+        """
+        Create an agent swarm
+        :param agents: iterable of agents to add to the swarm
+        :param capacity: initial number of rows to allocate, the arrays grow as needed
+        :param max_vel: speed limit in meters/second for every agent, None for no limit
+        :param max_jerk: fastest change of acceleration in meters/second^3 for every agent, None for no limit
+        :param pos_limit: distance from the origin along each axis in meters that agents cannot move past, None for no limit
+        """
+        self.count = 0
+        self.agents = []
+        self.max_vel = max_vel
+        self.max_jerk = max_jerk
+        self.pos_limit = pos_limit
+        self._positions = np.zeros((capacity, 2))
+        self._velocities = np.zeros((capacity, 2))
+        self._accelerations = np.zeros((capacity, 2))
+        self._acc_commands = np.zeros((capacity, 2))
+        self.add_agents(agents)
+
+    @property
+    def positions(self):
+        return self._positions[:self.count]
+
+    @property
+    def velocities(self):
+        return self._velocities[:self.count]
+
+    @property
+    def accelerations(self):
+        return self._accelerations[:self.count]
+
+    @property
+    def acc_commands(self):
+        return self._acc_commands[:self.count]
+
+    def __len__(self):
+        return self.count
+
+    def reserve(self, capacity):
+        """Grow the swarm arrays so they can hold at least capacity agents"""
+        if capacity <= self._positions.shape[0]:
+            return
+        new_capacity = max(capacity, 2 * self._positions.shape[0])
+        for name in ('_positions', '_velocities', '_accelerations', '_acc_commands'):
+            old = getattr(self, name)
+            new = np.zeros((new_capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def add_agent(self, agent):
+        self.add_agents([agent])
+
+    def add_agents(self, agents):
+        """Copy the state of each agent into the swarm and turn its state into views of the swarm"""
+        agents = list(agents)
+        self.reserve(self.count + len(agents))
+        for agent in agents:
+            index = self.count
+            self._positions[index] = agent.pos
+            self._velocities[index] = agent.vel
+            self._accelerations[index] = agent.acc
+            self._acc_commands[index] = agent.acc_command
+            agent.swarm = self
+            agent.swarm_index = index
+            self.agents.append(agent)
+            self.count += 1
+
+    def create_agents(self, positions):
+        """Create and add one Agent at rest at each row of an (N, 2) array of positions, returning the new agents"""
+        agents = [Agent() for _ in range(len(positions))]
+        start = self.count
+        self.add_agents(agents)
+        self._positions[start:self.count] = positions
+        return agents
+
+    def set_accelerations(self, accelerations, indices=None):
+        """
+        Command accelerations. The next steps move each agent's applied acceleration towards its command within max_jerk
+        :param accelerations: (N, 2) array with one row per selected agent
+        :param indices: swarm indices of the agents to command, all agents if None
+        """
+        if indices is None:
+            indices = slice(None)
+        self.acc_commands[indices] = accelerations
+
+    def step(self, dt, indices=None):
+        """Integrate every agent, or only the agents at the given swarm indices, by dt with the velocity and position limits applied"""
+        if indices is None:
+            self.accelerations[:] = limit_acceleration_change(self.accelerations, self.acc_commands, self.max_jerk, dt)
+            integrate(self.positions, self.velocities, self.accelerations, dt, self.max_vel, self.pos_limit)
+            return
+        positions = self.positions[indices]
+        velocities = self.velocities[indices]
+        self.accelerations[indices] = limit_acceleration_change(self.accelerations[indices], self.acc_commands[indices],
+                                                                self.max_jerk, dt)
+        integrate(positions, velocities, self.accelerations[indices], dt, self.max_vel, self.pos_limit)
+        self.positions[indices] = positions
+        self.velocities[indices] = velocities
@@ -0,0 +1,318 @@
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+import numpy as np
+import World
+import Planner
+import Agent
+import Sweep
+
+QUICK_SETTINGS = {'grid_resolutions': [2, 1, 0.5],
+                  'grid_entity_counts': [10, 100, 1000],
+                  'object_step_entity_counts': [10, 1000],
+                  'store_step_entity_counts': [10, 1000, 10000],
+                  'moving_grid_entity_counts': [100, 1000],
+                  'astar_grid_sizes': [64, 256],
+                  'mdp_grid_sizes': [64, 128],
+                  'potential_field_agent_counts': [10, 100],
+                  'agent_step_counts': [100, 10000],
+                  'repeats': 5}
+FULL_SETTINGS = {'grid_resolutions': [2, 1, 0.5, 0.25],
+                 'grid_entity_counts': [10, 100, 1000, 10000],
+                 'object_step_entity_counts': [10, 1000, 10000, 100000],
+                 'store_step_entity_counts': [10, 1000, 10000, 100000],
+                 'moving_grid_entity_counts': [100, 1000, 4000],
+                 'astar_grid_sizes': [64, 256, 1024, 4096],
+                 'mdp_grid_sizes': [64, 256, 1024],
+                 'potential_field_agent_counts': [10, 100, 1000],
+                 'agent_step_counts': [100, 10000, 100000],
+                 'repeats': 10}
+SEED = 1234
+
+
+class BenchmarkCase:
+    """A named piece of work to time. setup() builds fresh state for each repeat and run(state) is the part that is timed.
+    If given, instrumented_run(state) repeats the work once with planner statistics turned on and returns them as a dict"""
+
+    def __init__(self, name, setup, run, instrumented_run=None):
+        self.name = name
+        self.setup = setup
+        self.run = run
+        self.instrumented_run = instrumented_run
+
+
+def measure(case, repeats):
+    """
+    Time a benchmark case
+    :return: dict with median and p95 run time in seconds, the peak traced memory of one run in bytes and planner statistics if the case has them
+    """
+    timings = []
+    for _ in range(repeats):
+        state = case.setup()
+        gc.collect()
+        start = time.perf_counter()
+        case.run(state)
+        timings.append(time.perf_counter() - start)
+
+    # Memory is traced in a separate run so tracing overhead does not affect the timings
+    state = case.setup()
+    gc.collect()
+    tracemalloc.start()
+    case.run(state)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {'median': float(np.median(timings)),
+              'p95': float(np.percentile(timings, 95)),
+              'peak_memory': int(peak_memory),
+              'repeats': repeats}
+
+    # Statistics come from their own run so the timed runs use the planner with instrumentation off
+    if case.instrumented_run is not None:
+        result['planner_stats'] = case.instrumented_run(case.setup())
+    return result
+
+
+def make_world(n_entities, physics_limit, use_entity_store=False, moving_fraction=0.5):
+    """Create a headless world with a fixed seed mix of static and moving obstacles"""
+    scenario = next(Sweep.random_scenarios(1, seed=SEED, n_obstacles=(n_entities, n_entities), moving_fraction=moving_fraction,
+                                           physics_limit=physics_limit))
+    return World.World(scenario['world'], physics_limit=physics_limit, use_entity_store=use_entity_store)
+
+
+def make_open_grid(size):
+    return np.zeros((size, size), dtype=bool)
+
+
+def make_cluttered_grid(size, density=0.25):
+    """Block random cells, then clear a random staircase of down and right steps so the corners are always connected"""
+    rng = np.random.default_rng(SEED)
+    grid = rng.random((size, size)) < density
+    steps = np.zeros(2 * (size - 1), dtype=int)
+    steps[rng.permutation(2 * (size - 1))[:size - 1]] = 1
+    rows = np.concatenate([[0], np.cumsum(steps)])
+    cols = np.concatenate([[0], np.cumsum(1 - steps)])
+    grid[rows, cols] = False
+    return grid
+
+
+def make_maze_grid(size):
+    """Carve a maze with a randomized depth first search on a lattice of odd cells"""
+    rng = np.random.default_rng(SEED)
+    grid = np.ones((size, size), dtype=bool)
+    n_cells = (size - 1) // 2
+    visited = np.zeros((n_cells, n_cells), dtype=bool)
+    stack = [(0, 0)]
+    visited[0, 0] = True
+    grid[1, 1] = False
+    while stack:
+        row, col = stack[-1]
+        options = [(row + d_row, col + d_col) for d_row, d_col in ((0, 1), (1, 0), (0, -1), (-1, 0))
+                   if 0 <= row + d_row < n_cells and 0 <= col + d_col < n_cells and not visited[row + d_row, col + d_col]]
+        if not options:
+            stack.pop()
+            continue
+        n_row, n_col = options[rng.integers(len(options))]
+        visited[n_row, n_col] = True
+        grid[row + n_row + 1, col + n_col + 1] = False
+        grid[2 * n_row + 1, 2 * n_col + 1] = False
+        stack.append((n_row, n_col))
+    # The lattice stops one cell short of the far edges when the size is even, so join its last cell to the corner
+    last = 2 * n_cells - 1
+    grid[0, 0] = grid[0, 1] = False
+    grid[last:, last] = False
+    grid[-1, last:] = False
+    return grid
+
+
+def solve_mdp_after_change(size, slip_probability=0.2):
+    """Solve a slippery MDP on a cluttered grid, then block the free cell closest to the goal along the bottom row, for the
+    timed warm start to repair"""
+    grid = make_cluttered_grid(size)
+    planner = Planner.MDPPlanner(slip_probability=slip_probability)
+    planner.solve([size - 1, size - 1], World.occupancy_grid_from_numpy_array(grid))
+    grid[size - 1, np.flatnonzero(~grid[size - 1, :size - 1])[-1]] = True
+    return planner, World.occupancy_grid_from_numpy_array(grid)
+
+
+def run_instrumented_astar(occ_grid, size):
+    stats = Planner.PlannerStats()
+    Planner.AStarPlanner(record_explored=False, stats=stats).create_plan([0, 0], [size - 1, size - 1], occ_grid)
+    return stats.as_dict()
+
+
+def potential_field_loop(planner, positions, goals, world, velocities):
+    """Per agent, per entity Python loop computing the same accelerations as PotentialFieldPlanner.compute_accelerations,
+    used as the baseline the vectorized version is measured against"""
+    accelerations = []
+    for position, goal, velocity in zip(positions, goals, velocities):
+        acc = planner.attractive_gain * (goal - position) - planner.damping * velocity
+        for entity in world.entity_list:
+            min_x, min_y, max_x, max_y = entity.get_bounding_box()
+            if isinstance(entity, World.Circle):
+                offset = position - entity.pos
+                center_distance = np.hypot(offset[0], offset[1])
+                inside = center_distance <= entity.radius
+                away = offset if inside else offset * (1 - entity.radius / center_distance)
+            else:
+                closest = np.array([min(max(position[0], min_x), max_x), min(max(position[1], min_y), max_y)])
+                inside = min_x <= position[0] <= max_x and min_y <= position[1] <= max_y
+                away = position - np.array([(min_x + max_x) / 2, (min_y + max_y) / 2]) if inside else position - closest
+            distance = max((0 if inside else np.hypot(away[0], away[1])) - planner.agent_radius, 1e-3)
+            if distance < planner.cutoff_distance:
+                magnitude = planner.repulsive_gain * (1.0 / distance - 1.0 / planner.cutoff_distance) / (distance * distance)
+                acc = acc + magnitude * away / max(np.hypot(away[0], away[1]), 1e-12)
+        norm = np.hypot(acc[0], acc[1])
+        if norm > planner.max_acc:
+            acc = acc * planner.max_acc / norm
+        accelerations.append(acc)
+    return np.array(accelerations).reshape(-1, 2)
+
+
+def make_agent_batch(n_agents, physics_limit):
+    """Seeded agent positions, goals and velocities spread over the world"""
+    rng = np.random.default_rng(SEED)
+    return (rng.uniform(-physics_limit, physics_limit, (n_agents, 2)),
+            rng.uniform(-physics_limit, physics_limit, (n_agents, 2)),
+            rng.uniform(-1, 1, (n_agents, 2)))
+
+
+def make_cases(settings):
+    """Build the list of benchmark cases for a settings dict such as QUICK_SETTINGS"""
+    cases = []
+
+    for n_entities in settings['grid_entity_counts']:
+        world = make_world(n_entities, physics_limit=50)
+        for resolution in settings['grid_resolutions']:
+            def setup(world=world):
+                world.occupancy_grid = None
+                return world
+            cases.append(BenchmarkCase('occupancy_grid/entities=' + str(n_entities) + '/resolution=' + str(resolution),
+                                       setup, lambda world, resolution=resolution: world.get_occupancy_grid(resolution)))
+
+    for use_entity_store, counts in ((False, settings['object_step_entity_counts']), (True, settings['store_step_entity_counts'])):
+        for n_entities in counts:
+            world = make_world(n_entities, physics_limit=1000, use_entity_store=use_entity_store)
+            cases.append(BenchmarkCase('world_step/' + ('store' if use_entity_store else 'objects') + '/entities=' + str(n_entities),
+                                       lambda world=world: world, lambda world: world.step(0.01)))
+
+    # Every entity moves, so the world's occupancy grid redraws a dirty window per entity on each step
+    for n_entities in settings['moving_grid_entity_counts']:
+        world = make_world(n_entities, physics_limit=100, use_entity_store=True, moving_fraction=1.0)
+        world.get_occupancy_grid(0.5)
+        cases.append(BenchmarkCase('world_step/occupancy_grid/moving=' + str(n_entities),
+                                   lambda world=world: world, lambda world: world.step(0.01)))
+
+    for size in settings['astar_grid_sizes']:
+        for kind, make_grid in (('open', make_open_grid), ('maze', make_maze_grid), ('cluttered', make_cluttered_grid)):
+            occ_grid = World.occupancy_grid_from_numpy_array(make_grid(size))
+            planner = Planner.AStarPlanner(record_explored=False)
+            cases.append(BenchmarkCase('astar/' + kind + '/size=' + str(size),
+                                       lambda occ_grid=occ_grid: occ_grid,
+                                       lambda occ_grid, planner=planner, size=size: planner.create_plan([0, 0], [size - 1, size - 1], occ_grid),
+                                       lambda occ_grid, size=size: run_instrumented_astar(occ_grid, size)))
+
+        # Same cluttered map with a terrain cost layer, to compare weighted planning against the binary case above
+        occ_grid = World.occupancy_grid_from_numpy_array(make_cluttered_grid(size))
+        occ_grid.set_cost_layer('terrain', np.random.default_rng(SEED).random((size, size)))
+        planner = Planner.AStarPlanner(record_explored=False)
+        cases.append(BenchmarkCase('astar/weighted/size=' + str(size),
+                                   lambda occ_grid=occ_grid: occ_grid,
+                                   lambda occ_grid, planner=planner, size=size: planner.create_plan([0, 0], [size - 1, size - 1], occ_grid),
+                                   lambda occ_grid, size=size: run_instrumented_astar(occ_grid, size)))
+
+    # Slipping makes value iteration carry changes only a few cells per sweep, so these grow with the cube of the size
+    for size in settings['mdp_grid_sizes']:
+        occ_grid = World.occupancy_grid_from_numpy_array(make_cluttered_grid(size))
+        cases.append(BenchmarkCase('mdp/slip/cold/size=' + str(size),
+                                   lambda occ_grid=occ_grid: (Planner.MDPPlanner(slip_probability=0.2), occ_grid),
+                                   lambda state, size=size: state[0].solve([size - 1, size - 1], state[1])))
+        cases.append(BenchmarkCase('mdp/slip/warm/size=' + str(size), lambda size=size: solve_mdp_after_change(size),
+                                   lambda state, size=size: state[0].solve([size - 1, size - 1], state[1])))
+
+    for n_agents in settings['agent_step_counts']:
+        positions = make_agent_batch(n_agents, 50)[0]
+        agents = [Agent.Agent(max_vel=5) for _ in range(n_agents)]
+        cases.append(BenchmarkCase('agent_step/objects/agents=' + str(n_agents), lambda agents=agents: agents,
+                                   lambda agents: [agent.step(0.01) for agent in agents]))
+        swarm = Agent.AgentSwarm(max_vel=5)
+        swarm.create_agents(positions)
+        cases.append(BenchmarkCase('agent_step/swarm/agents=' + str(n_agents), lambda swarm=swarm: swarm,
+                                   lambda swarm: swarm.step(0.01)))
+
+    world = make_world(1000, physics_limit=50, use_entity_store=True)
+    planner = Planner.PotentialFieldPlanner()
+    for n_agents in settings['potential_field_agent_counts']:
+        batch = make_agent_batch(n_agents, 50)
+        cases.append(BenchmarkCase('potential_field/loop/agents=' + str(n_agents), lambda batch=batch: batch,
+                                   lambda batch: potential_field_loop(planner, batch[0], batch[1], world, batch[2])))
+        cases.append(BenchmarkCase('potential_field/vectorized/agents=' + str(n_agents), lambda batch=batch: batch,
+                                   lambda batch: planner.compute_accelerations(batch[0], batch[1], world, batch[2])))
+    return cases
+
+
+def run_benchmarks(settings, name_filter=None):
+    """Run every case whose name contains name_filter and return {case name: measurement}"""
+    results = {}
+    for case in make_cases(settings):
+        if name_filter and name_filter not in case.name:
+            continue
+        results[case.name] = measure(case, settings['repeats'])
+        line = case.name + ': median ' + format_time(results[case.name]['median']) + \
+               ', p95 ' + format_time(results[case.name]['p95']) + \
+               ', peak memory ' + str(results[case.name]['peak_memory'] // 1024) + ' KiB'
+        if 'planner_stats' in results[case.name]:
+            line += ', expanded ' + str(results[case.name]['planner_stats']['nodes_expanded']) + \
+                    ', max open ' + str(results[case.name]['planner_stats']['max_open_size'])
+        print(line)
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance=0.2):
+    """
+    Find cases whose median time got worse than the baseline
+    :param tolerance: allowed fractional slowdown before a case counts as a regression
+    :return: list of (case name, baseline median, new median) for each regression
+    """
+    regressions = []
+    for name, result in results.items():
+        if name in baseline and result['median'] > baseline[name]['median'] * (1 + tolerance):
+            regressions.append((name, baseline[name]['median'], result['median']))
+    return regressions
+
+
+def format_time(seconds):
+    if seconds < 1e-3:
+        return str(round(seconds * 1e6, 1)) + ' us'
+    if seconds < 1:
+        return str(round(seconds * 1e3, 2)) + ' ms'
+    return str(round(seconds, 3)) + ' s'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark occupancy grid construction, world stepping and planning')
+    parser.add_argument('--full', action='store_true', help='run the full size range (up to 100k entities and 4096x4096 grids)')
+    parser.add_argument('--filter', help='only run cases whose name contains this text')
+    parser.add_argument('--baseline', help='baseline JSON file to compare against')
+    parser.add_argument('--save-baseline', help='write the results to this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed fractional slowdown against the baseline')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(FULL_SETTINGS if args.full else QUICK_SETTINGS, args.filter)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(results, json.load(f), args.tolerance)
+        for name, old, new in regressions:
+            print('REGRESSION ' + name + ': ' + format_time(old) + ' -> ' + format_time(new))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -8,7 +8,7 @@ import matplotlib.pyplot as plt
 #Configuration
 TARGET_FPS = 60
 WINDOW_SIZE = 750
-FILE_NAME =  'D:\LocalFiles\Github\PathPlanningSim\sample_world.json'
+FILE_NAME = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample_world.json')
 WINDOW_START_POS_X = 500
 WINDOW_START_POS_Y = 100
 WORLD_SCALE = 1
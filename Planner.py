@@ -1,54 +1,353 @@
 import numpy as np
 import math
 import heapq
+import threading
+import time
+import hashlib
+import json
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import World
 
 class Planner:
 
-    def __init__(self, planner_type):
-        if planner_type == 'Dstar':
-            self.planner = DStarPlanner()
-        elif planner_type == 'Astar':
-            self.planner = AStarPlanner()
+    def __init__(self, planner_type, plan_cache=None, stats=None):
+        """
+        Create a planner
+        :param planner_type: name of the planner, as accepted by create_discrete_planner or create_continuous_planner
+        :param plan_cache: optional PlanCache that discrete plans are looked up in and stored to. It can be shared between planners
+        :param stats: optional PlannerStats that the planner records its work in
+        """
+        if planner_type in CONTINUOUS_PLANNER_TYPES:
+            self.planner = create_continuous_planner(planner_type, stats=stats)
         else:
-            raise ValueError('Unknown planner type')
+            self.planner = create_discrete_planner(planner_type, stats=stats)
         self.planner_type = planner_type
+        self.plan_cache = plan_cache
 
     def create_plan_discrete(self, start, end, occupancy_grid):
         if self.planner_type == 'Astar' or \
-            self.planner_type == 'Dstar':
-            self.planner.create_plan(start, end, occupancy_grid)
+            self.planner_type == 'Dstar' or \
+            self.planner_type == 'JPS' or \
+            self.planner_type == 'HPAstar':
+            if self.plan_cache is None:
+                return self.planner.create_plan(start, end, occupancy_grid)
+            key = self.plan_cache.make_key(occupancy_grid, start, end, self.planner_type, self.planner.connection_type)
+            path = self.plan_cache.get(key)
+            if path is not None:
+                return path, []
+            path, explored = self.planner.create_plan(start, end, occupancy_grid)
+            self.plan_cache.put(key, path)
+            return path, explored
         else:
             raise ValueError('Planner type '+self.planner_type+ ' does not support discrete planning')
 
+    def create_plan_continuous(self, start, end, world):
+        """
+        Plan in world coordinates around the current shapes of the world entities, sampling inside the physics limit
+        :return: list of [x, y] positions from start to end and the list of explored positions, see RRTStarPlanner.create_plan
+        """
+        if self.planner_type in CONTINUOUS_PLANNER_TYPES:
+            limit = world.physics_limit
+            return self.planner.create_plan(start, end, world.entity_list, (-limit, -limit, limit, limit))
+        else:
+            raise ValueError('Planner type '+self.planner_type+ ' does not support continuous planning')
+
+    def create_plans_discrete(self, starts, ends, occupancy_grid, n_processes=None):
+        """
+        Plan many start/end pairs over the same grid in one call, see BatchPlanner
+        HPAstar instead answers the queries one after another on its cached abstract graph, which is only built once for all
+        of them, and ignores n_processes
+        :return: list of paths, one per start/end pair
+        """
+        if self.planner_type == 'Astar' or \
+            self.planner_type == 'Dstar' or \
+            self.planner_type == 'JPS':
+            batch_planner = BatchPlanner(connection_type=self.planner.connection_type, n_processes=n_processes)
+            return batch_planner.create_plans(starts, ends, occupancy_grid)
+        elif self.planner_type == 'HPAstar':
+            if len(starts) != len(ends):
+                raise ValueError('Need the same number of starts and ends')
+            return [self.planner.create_plan(start, end, occupancy_grid)[0] for start, end in zip(starts, ends)]
+        else:
+            raise ValueError('Planner type '+self.planner_type+ ' does not support discrete planning')
+
+
+class PlannerStats:
+    """Counters and phase timings recorded by a planner. Planners only record into it when one is passed in, so leaving it out costs nothing"""
+
+    def __init__(self, on_expand=None):
+        """
+        Create an empty set of planner statistics
+        :param on_expand: optional function called as on_expand(row, col, cost) every time a node is expanded
+        """
+        self.on_expand = on_expand
+        self.reset()
+
+    def reset(self):
+        self.plans = 0
+        self.nodes_expanded = 0
+        self.nodes_pushed = 0
+        self.max_open_size = 0
+        self.heuristic_calls = 0
+        self.phase_times = {}
+        self.phase_start = None
+
+    def begin(self):
+        """Start timing a new plan"""
+        self.plans += 1
+        self.phase_start = time.perf_counter()
+
+    def mark(self, phase):
+        """Add the time since the last mark (or begin) to a phase"""
+        now = time.perf_counter()
+        self.phase_times[phase] = self.phase_times.get(phase, 0.0) + now - self.phase_start
+        self.phase_start = now
+
+    def record_expansion(self, row, col, cost):
+        self.nodes_expanded += 1
+        if self.on_expand is not None:
+            self.on_expand(row, col, cost)
+
+    def record_open_size(self, size):
+        if size > self.max_open_size:
+            self.max_open_size = size
+
+    def as_dict(self):
+        return {'plans': self.plans,
+                'nodes_expanded': self.nodes_expanded,
+                'nodes_pushed': self.nodes_pushed,
+                'max_open_size': self.max_open_size,
+                'heuristic_calls': self.heuristic_calls,
+                'phase_times': dict(self.phase_times)}
+
+
+class PlanCache:
+    """LRU cache of discrete plans keyed by grid, endpoints, planner type and connection type.
+    IncrementalOccupancyGrids are keyed by identity and subscribed to: when they change, cached paths that now cross a blocked
+    cell and cached failures are dropped, while paths whose cells are all still free are kept. The cache only holds weak
+    references to them, and drops their plans once they are garbage collected. Call close when the cache is no longer used,
+    so the grids stop calling it. Other grids are keyed by a hash of their contents, which is only recomputed when their
+    version changes, so cells written directly through the grid array need a grid.mark_dirty call to miss the cache"""
+
+    def __init__(self, max_entries=1024, max_path_cells=1000000):
+        """
+        Create a plan cache
+        :param max_entries: maximum number of cached plans
+        :param max_path_cells: maximum total number of path cells held by the cache, used to bound memory
+        """
+        self.max_entries = max_entries
+        self.max_path_cells = max_path_cells
+        self.entries = OrderedDict()  # key -> (path, path cells as an (N, 2) array)
+        self.n_path_cells = 0
+        self.grids = {}  # id of an incremental grid -> (weak reference to it, subscriber callback)
+        self.digests = {}  # id of a grid -> [weak reference, grid array, version, cells digest, cost map, cost map digest]
+        self.stale_grids = set()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def make_key(self, grid, start, end, planner_type, connection_type):
+        """Build the cache key for a query, subscribing to the grid the first time an incremental grid is seen"""
+        digests = self.get_digests(grid, not hasattr(grid, 'subscribe'))
+        if hasattr(grid, 'subscribe'):
+            grid_key = id(grid)
+            if grid_key not in self.grids:
+                callback = lambda rows, cols, grid_key=grid_key: self.stale_grids.add(grid_key)
+                self.grids[grid_key] = (digests[0], callback)
+                grid.subscribe(callback)
+        else:
+            grid_key = digests[3]
+        # Weighted grids also key on their costs, so changing a cost layer misses the cache
+        return (grid_key, (int(start[0]), int(start[1])), (int(end[0]), int(end[1])), planner_type, connection_type, digests[5])
+
+    def get_digests(self, grid, hash_cells):
+        """
+        Get the digest record of a grid, rehashing its cells (if hash_cells) and its cost map only when they changed
+        The cells are rehashed when the grid version or grid array changes, and the cost map when the grid builds a new one
+        """
+        grid_key = id(grid)
+        digests = self.digests.get(grid_key)
+        if digests is None:
+            digests = [weakref.ref(grid, lambda ref, grid_key=grid_key: self.forget_grid(grid_key)), None, None, None, None, None]
+            self.digests[grid_key] = digests
+        if hash_cells and (digests[1] is not grid.grid or digests[2] != grid.version):
+            digests[1] = grid.grid
+            digests[2] = grid.version
+            digests[3] = hashlib.blake2b(np.ascontiguousarray(grid.grid).view(np.uint8), digest_size=16).digest() + \
+                         str(grid.grid.shape).encode()
+        cost_map = grid.get_cost_map()
+        if cost_map is not digests[4]:
+            digests[4] = cost_map
+            digests[5] = None if cost_map is None else hashlib.blake2b(np.ascontiguousarray(cost_map).view(np.uint8), digest_size=16).digest()
+        return digests
+
+    def get(self, key):
+        """Look up a cached path, returning a copy of it or None on a miss"""
+        if key[0] in self.stale_grids:
+            self.revalidate(key[0])
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return [list(cell) for cell in entry[0]]
+
+    def put(self, key, path):
+        """Store a path, evicting the least recently used plans to stay within the size and memory bounds"""
+        if isinstance(path, np.ndarray):
+            # Single point plans are trivial to recompute
+            return
+        if len(path) > self.max_path_cells:
+            return
+        if key in self.entries:
+            self.remove(key)
+        cells = np.array(path, dtype=np.int64).reshape(-1, 2)
+        self.entries[key] = ([list(cell) for cell in path], cells)
+        self.n_path_cells += len(cells)
+        while len(self.entries) > self.max_entries or self.n_path_cells > self.max_path_cells:
+            self.remove(next(iter(self.entries)))
+
+    def remove(self, key):
+        _, cells = self.entries.pop(key)
+        self.n_path_cells -= len(cells)
+
+    def revalidate(self, grid_key):
+        """Drop the cached plans for a changed grid that are no longer valid"""
+        self.stale_grids.discard(grid_key)
+        blocked = self.grids[grid_key][0]().grid
+        for key in [key for key in self.entries if key[0] == grid_key]:
+            cells = self.entries[key][1]
+            # An empty path may have become feasible, a path is only broken if one of its cells is now blocked
+            if len(cells) == 0 or np.any(blocked[cells[:, 0], cells[:, 1]]):
+                self.remove(key)
+                self.invalidations += 1
+
+    def forget_grid(self, grid_key):
+        """Drop the digests and plans of a grid that was garbage collected, since a new grid can reuse its id"""
+        self.grids.pop(grid_key, None)
+        self.digests.pop(grid_key, None)
+        self.stale_grids.discard(grid_key)
+        for key in [key for key in self.entries if key[0] == grid_key]:
+            self.remove(key)
+
+    def clear(self):
+        """Drop every cached plan and unsubscribe from the incremental grids. They are subscribed to again on their next query"""
+        for grid_ref, callback in self.grids.values():
+            grid = grid_ref()
+            if grid is not None:
+                grid.unsubscribe(callback)
+        self.grids = {}
+        self.digests = {}
+        self.stale_grids = set()
+        self.entries.clear()
+        self.n_path_cells = 0
+
+    def close(self):
+        """Unsubscribe from every grid, so grids that outlive the cache no longer keep it alive. The cache is left empty"""
+        self.clear()
+
+
+def create_discrete_planner(planner_type, **planner_args):
+    """Create a grid planner from its type name, passing any extra arguments on to the planner"""
+    if planner_type == 'Dstar':
+        return DStarPlanner(**planner_args)
+    elif planner_type == 'Astar':
+        return AStarPlanner(**planner_args)
+    elif planner_type == 'JPS':
+        return JPSPlanner(**planner_args)
+    elif planner_type == 'HPAstar':
+        return HPAStarPlanner(**planner_args)
+    else:
+        raise ValueError('Unknown planner type')
+
+
+CONTINUOUS_PLANNER_TYPES = ('RRT', 'RRTstar')
+
+
+def create_continuous_planner(planner_type, **planner_args):
+    """Create a world coordinate planner from its type name, passing any extra arguments on to the planner"""
+    if planner_type == 'RRT':
+        return RRTStarPlanner(rewire=False, **planner_args)
+    elif planner_type == 'RRTstar':
+        return RRTStarPlanner(**planner_args)
+    else:
+        raise ValueError('Unknown planner type')
+
 
 def computeEuclideanDistance(p1, p2):
     return math.sqrt((p1[0] - p2[0])**2 + (p1[1] - p2[1])**2)
 
 
+SQRT2 = math.sqrt(2)
+
+# Neighbor offsets as (row step, column step, step cost), listed in the order they are expanded
+FOUR_CONNECTED_OFFSETS = ((0, 1, 1.0),
+                          (1, 0, 1.0),
+                          (-1, 0, 1.0),
+                          (0, -1, 1.0))
+EIGHT_CONNECTED_OFFSETS = FOUR_CONNECTED_OFFSETS + ((-1, -1, SQRT2),
+                                                    (-1, 1, SQRT2),
+                                                    (1, 1, SQRT2),
+                                                    (1, -1, SQRT2))
+
+
+def get_connection_offsets(connection_type):
+    """Get the precomputed neighbor offsets for a connection type ('four' or 'eight')"""
+    if connection_type == 'four':
+        return FOUR_CONNECTED_OFFSETS
+    elif connection_type == 'eight':
+        return EIGHT_CONNECTED_OFFSETS
+    else:
+        raise ValueError('Unknown connection type '+str(connection_type))
+
+
+def require_uniform_costs(grid, planner_name):
+    """Raise a ValueError if the grid has cost layers, for planners that assume every free cell costs the same"""
+    if grid.get_cost_map() is not None:
+        raise ValueError(planner_name + ' does not support grids with cost layers, use the Astar planner instead')
+
+
+def reconstruct_path(parent, goal_index, n_cols):
+    """
+    Follow parent pointers back from the goal to build a path
+    :param parent: flat array of parent cell indices, where the start cell has a parent of -1
+    :param goal_index: flat index of the goal cell
+    :param n_cols: number of columns in the grid, used to convert flat indices to 2d coordinates
+    :return: list of [row, col] coordinates from the start to the goal
+    """
+    path = []
+    index = goal_index
+    while index != -1:
+        path.append(list(divmod(index, n_cols)))
+        index = int(parent[index])
+    path.reverse()
+    return path
+
+
 class AStarPlanner:
 
-    def __init__(self):
-        self.connection_type = 'four' #or eight
+    def __init__(self, connection_type='four', record_explored=True, stats=None):
+        """
+        Create an A* planner
+        :param connection_type: 'four' or 'eight' connected grid moves
+        :param record_explored: if False, the explored list returned by create_plan is left empty to save time and memory
+        :param stats: optional PlannerStats to record expansions, queue pushes and phase timings in
+        """
+        self.connection_type = connection_type
+        self.record_explored = record_explored
+        self.stats = stats
 
     def get_neighbors(self, grid, point):
-        if self.connection_type == 'four':
-            a = [np.array([0, 1]),
-                 np.array([1, 0]),
-                 np.array([-1, 0]),
-                 np.array([0, -1])]
-        else:
-            a = [np.array([0, 1]),
-                 np.array([1, 0]),
-                 np.array([-1, 0]),
-                 np.array([0, -1]),
-                 np.array([-1, -1]),
-                 np.array([-1, 1]),
-                 np.array([1, 1]),
-                 np.array([1, -1])]
-
         new_points = []
-        for direction in a:
-            p = point + direction
+        for d_row, d_col, _ in get_connection_offsets(self.connection_type):
+            p = np.array([point[0] + d_row, point[1] + d_col])
             if not (grid.is_out_of_bounds(p) or grid.is_blocked(p)):
                 new_points.append(p)
 
@@ -57,10 +356,14 @@ class AStarPlanner:
     def create_plan(self, start, end, grid):
         """
         Generate a path through the occupancy grid that avoids obstacles
+        Search state (g-scores, parents and closed flags) is kept in flat numpy arrays indexed by cell
         :param start: 2d grid coordinates of start location
         :param end: 2d grid coordinates of end location
-        :param grid: boolean 2d numpy array where 0 is free space and 1 is blocked space
-        :return: a list of coordinates which are the path from the start to the end. Returning an empty list means that no path was found
+        :param grid: OccupancyGrid where 0 is free space and 1 is blocked space. If the grid has cost layers the cheapest path
+                     under the grid's cached cost map is found instead of the shortest one. A move costs its step length
+                     times 1 plus the mean cost of the two cells, so the Euclidean heuristic stays admissible
+        :return: a list of coordinates which are the path from the start to the end. Returning an empty list means that no path was found.
+                 Also returns the list of explored points in the order they were expanded (empty if record_explored is False)
         """
 
         # Ensure start and end are numpy arrays
@@ -75,55 +378,2512 @@ class AStarPlanner:
         if np.all(start == end):
             return start,[]
 
-        # Initialize queue with start position
-        queue = []
+        stats = self.stats
+        if stats is not None:
+            stats.begin()
+
+        blocked = grid.grid
+        n_rows, n_cols = blocked.shape
+        offsets = get_connection_offsets(self.connection_type)
+        cost_map = grid.get_cost_map()
+        if cost_map is not None:
+            cell_costs = cost_map.ravel()
+        blocked = blocked.ravel()
+        n_total = n_rows * n_cols
+        end_row = int(end[0])
+        end_col = int(end[1])
+        end_index = end_row * n_cols + end_col
+
+        g_score = np.full(n_total, np.inf)
+        parent = np.full(n_total, -1, dtype=np.int64)
+        closed = np.zeros(n_total, dtype=bool)
         explored_points = []
-        score = computeEuclideanDistance(start, end)
-        counter = 0 # unique counter for points to ensure tuple comparison functions correctly
-        entry = (score, counter, (start, [list(start)], 0))
-        counter += 1
-        heapq.heappush(queue, entry)
+        record_explored = self.record_explored
 
-        while True:
+        # Initialize queue with start position
+        start_index = int(start[0]) * n_cols + int(start[1])
+        g_score[start_index] = 0.0
+        counter = 0 # unique counter for points to ensure tuple comparison functions correctly
+        queue = [(math.hypot(start[0] - end_row, start[1] - end_col), counter, start_index)]
+        found = False
+        if stats is not None:
+            stats.record_open_size(1)
+            stats.mark('setup')
 
-            # if there are no points left to pop, then there is no feasible path
-            if len(queue) == 0:
-                return [], explored_points
+        # if there are no points left to pop, then there is no feasible path
+        while queue:
 
-            # Get next entry from heap
-            score, count, node = heapq.heappop(queue)
-            point = node[0]
-            path = node[1]
-            path_cost = node[2]
-            explored_points.append(list(point))
+            # Get next entry from heap, skipping stale entries for points that were already expanded
+            _, _, index = heapq.heappop(queue)
+            if closed[index]:
+                continue
+            closed[index] = True
+            row, col = divmod(index, n_cols)
+            if record_explored:
+                explored_points.append([row, col])
+            if stats is not None:
+                stats.record_expansion(row, col, g_score[index])
 
             # If the point we pop is the goal, then we are done and can return the path
-            if np.all(point == end):
-                return path, explored_points
+            if index == end_index:
+                found = True
+                break
 
             # Expand neighbors of the current point
-            neighbors = self.get_neighbors(grid, point)
+            path_cost = g_score[index]
+            if cost_map is not None:
+                cell_cost = float(cell_costs[index])
+            for d_row, d_col, step_cost in offsets:
+                n_row = row + d_row
+                n_col = col + d_col
+                if n_row < 0 or n_row >= n_rows or n_col < 0 or n_col >= n_cols:
+                    continue
+                n_index = n_row * n_cols + n_col
+                if closed[n_index] or blocked[n_index]:
+                    continue
+                if cost_map is not None:
+                    # Weighted edges are priced from the cached cost map as they are reached, cells of infinite cost are blocked
+                    step_cost = step_cost * (1.0 + 0.5 * (cell_cost + float(cell_costs[n_index])))
+                    if step_cost == math.inf:
+                        continue
+                new_path_cost = path_cost + step_cost
+                if new_path_cost < g_score[n_index]:
+                    g_score[n_index] = new_path_cost
+                    parent[n_index] = index
+                    counter += 1
+                    new_score = new_path_cost + math.hypot(n_row - end_row, n_col - end_col)
+                    heapq.heappush(queue, (new_score, counter, n_index))
+                    if stats is not None:
+                        stats.record_open_size(len(queue))
+
+        # Every push, including the start, needed one heuristic evaluation
+        if stats is not None:
+            stats.nodes_pushed += counter + 1
+            stats.heuristic_calls += counter + 1
+            stats.mark('search')
+        path = reconstruct_path(parent, end_index, n_cols) if found else []
+        if stats is not None:
+            stats.mark('reconstruct')
+        return path, explored_points
+
+
+def octile_distance(d_row, d_col):
+    """Cost of the shortest eight connected move sequence covering the given row and column offsets"""
+    d_row = abs(d_row)
+    d_col = abs(d_col)
+    return SQRT2 * min(d_row, d_col) + abs(d_row - d_col)
+
+
+class JPSPlanner:
+    """Jump point search planner for uniform cost, eight connected grids.
+    Returns paths with the same cost as AStarPlanner with 'eight' connections, but only expands jump points instead of every cell"""
+
+    def __init__(self, connection_type='eight', record_explored=True, stats=None):
+        """
+        Create a jump point search planner
+        :param connection_type: only 'eight' is supported
+        :param record_explored: if False, the explored list returned by create_plan is left empty to save time and memory
+        :param stats: optional PlannerStats to record expansions, queue pushes and phase timings in
+        """
+        if connection_type != 'eight':
+            raise ValueError('Jump point search only supports eight connected grids')
+        self.connection_type = connection_type
+        self.record_explored = record_explored
+        self.stats = stats
 
-            for n in neighbors:
-                # Compute scores for current neighbor
-                new_path_cost = path_cost + computeEuclideanDistance(point, n)
-                estimated_goal_cost = computeEuclideanDistance(n, end)
-                new_score = new_path_cost + estimated_goal_cost
-                # Append neighbor to path
-                new_path = path.copy()
-                new_path.append(list(n))
-                # Create node and entry
-                node = (n, new_path, new_path_cost)
-                entry = (new_score, counter, node)
-                counter += 1
-                # Push onto heap
-                heapq.heappush(queue, entry)
+    def create_plan(self, start, end, grid):
+        """
+        Generate a path through the occupancy grid that avoids obstacles
+        :param start: 2d grid coordinates of start location
+        :param end: 2d grid coordinates of end location
+        :param grid: OccupancyGrid where 0 is free space and 1 is blocked space
+        :return: a list of coordinates which are the path from the start to the end. Returning an empty list means that no path was found.
+                 Also returns the list of jump points in the order they were expanded (empty if record_explored is False)
+        """
 
+        require_uniform_costs(grid, 'JPS')
+
+        # Ensure start and end are numpy arrays
+        start = np.array(start)
+        end = np.array(end)
+
+        # If start or end is blocked, there is no feasible path
+        if grid.is_blocked(start) or grid.is_blocked(end):
+            return [],[]
+
+        # If the start position and the end are the same point, return that point as the path
+        if np.all(start == end):
+            return start,[]
+
+        stats = self.stats
+        if stats is not None:
+            stats.begin()
+
+        self.blocked = grid.grid
+        self.n_rows, self.n_cols = self.blocked.shape
+        self.end_row = int(end[0])
+        self.end_col = int(end[1])
+        n_cols = self.n_cols
+        end_index = self.end_row * n_cols + self.end_col
+
+        n_total = self.n_rows * n_cols
+        g_score = np.full(n_total, np.inf)
+        parent = np.full(n_total, -1, dtype=np.int64)
+        closed = np.zeros(n_total, dtype=bool)
+        explored_points = []
+
+        start_index = int(start[0]) * n_cols + int(start[1])
+        g_score[start_index] = 0.0
+        counter = 0
+        queue = [(octile_distance(start[0] - self.end_row, start[1] - self.end_col), counter, start_index)]
+        found = False
+        if stats is not None:
+            stats.record_open_size(1)
+            stats.mark('setup')
+
+        while queue:
+            _, _, index = heapq.heappop(queue)
+            if closed[index]:
+                continue
+            closed[index] = True
+            row, col = divmod(index, n_cols)
+            if self.record_explored:
+                explored_points.append([row, col])
+            if stats is not None:
+                stats.record_expansion(row, col, g_score[index])
+
+            if index == end_index:
+                found = True
+                break
+
+            parent_index = int(parent[index])
+            for d_row, d_col in self.get_directions(row, col, parent_index):
+                jump_point = self.jump(row, col, d_row, d_col)
+                if jump_point is None:
+                    continue
+                j_row, j_col = jump_point
+                j_index = j_row * n_cols + j_col
+                if closed[j_index]:
+                    continue
+                new_path_cost = g_score[index] + octile_distance(j_row - row, j_col - col)
+                if new_path_cost < g_score[j_index]:
+                    g_score[j_index] = new_path_cost
+                    parent[j_index] = index
+                    counter += 1
+                    new_score = new_path_cost + octile_distance(j_row - self.end_row, j_col - self.end_col)
+                    heapq.heappush(queue, (new_score, counter, j_index))
+                    if stats is not None:
+                        stats.record_open_size(len(queue))
+
+        # Every push, including the start, needed one heuristic evaluation
+        if stats is not None:
+            stats.nodes_pushed += counter + 1
+            stats.heuristic_calls += counter + 1
+            stats.mark('search')
+        path = self.expand_path(parent, end_index) if found else []
+        if stats is not None:
+            stats.mark('reconstruct')
+        return path, explored_points
+
+    def is_free(self, row, col):
+        return 0 <= row < self.n_rows and 0 <= col < self.n_cols and not self.blocked[row, col]
+
+    def get_directions(self, row, col, parent_index):
+        """Get the pruned set of directions to search from a jump point, given the jump point it was reached from"""
+        if parent_index == -1:
+            return [(d_row, d_col) for d_row, d_col, _ in EIGHT_CONNECTED_OFFSETS]
+
+        p_row, p_col = divmod(parent_index, self.n_cols)
+        d_row = (row > p_row) - (row < p_row)
+        d_col = (col > p_col) - (col < p_col)
+        is_free = self.is_free
+        directions = []
+        if d_row != 0 and d_col != 0:
+            directions.append((d_row, 0))
+            directions.append((0, d_col))
+            directions.append((d_row, d_col))
+            if not is_free(row - d_row, col):
+                directions.append((-d_row, d_col))
+            if not is_free(row, col - d_col):
+                directions.append((d_row, -d_col))
+        elif d_row != 0:
+            directions.append((d_row, 0))
+            if not is_free(row, col + 1):
+                directions.append((d_row, 1))
+            if not is_free(row, col - 1):
+                directions.append((d_row, -1))
+        else:
+            directions.append((0, d_col))
+            if not is_free(row + 1, col):
+                directions.append((1, d_col))
+            if not is_free(row - 1, col):
+                directions.append((-1, d_col))
+        return directions
+
+    def jump_straight(self, row, col, d_row, d_col):
+        """Step from (row, col) along a row or column until reaching the goal, a cell with a forced neighbor, or an obstacle"""
+        is_free = self.is_free
+        while True:
+            row += d_row
+            col += d_col
+            if not is_free(row, col):
+                return None
+            if row == self.end_row and col == self.end_col:
+                return row, col
+            if d_row != 0:
+                if (is_free(row + d_row, col + 1) and not is_free(row, col + 1)) or \
+                   (is_free(row + d_row, col - 1) and not is_free(row, col - 1)):
+                    return row, col
+            else:
+                if (is_free(row + 1, col + d_col) and not is_free(row + 1, col)) or \
+                   (is_free(row - 1, col + d_col) and not is_free(row - 1, col)):
+                    return row, col
+
+    def jump(self, row, col, d_row, d_col):
+        """Find the next jump point from (row, col) in a direction, or None if the search in that direction hits an obstacle or the grid edge"""
+        if d_row == 0 or d_col == 0:
+            return self.jump_straight(row, col, d_row, d_col)
+
+        is_free = self.is_free
+        while True:
+            row += d_row
+            col += d_col
+            if not is_free(row, col):
+                return None
+            if row == self.end_row and col == self.end_col:
+                return row, col
+            if (is_free(row - d_row, col + d_col) and not is_free(row - d_row, col)) or \
+               (is_free(row + d_row, col - d_col) and not is_free(row, col - d_col)):
+                return row, col
+            if self.jump_straight(row, col, d_row, 0) is not None or \
+               self.jump_straight(row, col, 0, d_col) is not None:
+                return row, col
+
+    def expand_path(self, parent, goal_index):
+        """Rebuild the full cell by cell path from the jump point parent pointers"""
+        jump_points = reconstruct_path(parent, goal_index, self.n_cols)
+        path = [jump_points[0]]
+        for p_row, p_col in jump_points[1:]:
+            row, col = path[-1]
+            d_row = (p_row > row) - (p_row < row)
+            d_col = (p_col > col) - (p_col < col)
+            while row != p_row or col != p_col:
+                row += d_row
+                col += d_col
+                path.append([row, col])
+        return path
 
 
 class DStarPlanner:
-    def __init__(self):
-        pass
+    """D* Lite planner. Search state is kept between calls so that replanning after the start moves
+    or after cells of the occupancy grid change only repairs the affected part of the search"""
+
+    def __init__(self, connection_type='four', record_explored=True, stats=None):
+        """
+        Create a D* Lite planner
+        :param connection_type: 'four' or 'eight' connected grid moves
+        :param record_explored: if False, the explored list returned by create_plan is left empty to save time and memory
+        :param stats: optional PlannerStats to record expansions, queue pushes and phase timings in
+        """
+        self.connection_type = connection_type
+        self.record_explored = record_explored
+        self.stats = stats
+        self.offsets = get_connection_offsets(connection_type)
+        self.grid = None
+        self.goal_index = None
+        self.pending_windows = []
+        self.pending_cells = []
+
+    def on_cells_changed(self, rows, cols):
+        """Occupancy grid subscriber callback, records a dirty region to be checked on the next plan"""
+        self.pending_windows.append((rows, cols))
+
+    def notify_changed_cells(self, cells):
+        """
+        Tell the planner which cells of the occupancy grid may have changed since the last plan
+        :param cells: iterable of 2d grid coordinates
+        """
+        self.pending_cells.extend((int(cell[0]), int(cell[1])) for cell in cells)
+
+    def close(self):
+        """Unsubscribe from the occupancy grid and throw away the search, so the grid no longer keeps the planner alive"""
+        if self.grid is not None and hasattr(self.grid, 'unsubscribe'):
+            self.grid.unsubscribe(self.on_cells_changed)
+        self.grid = None
+        self.goal_index = None
+        self.pending_windows = []
+        self.pending_cells = []
+
+    def reset(self, start_index, goal_index, grid):
+        """Throw away any previous search and initialize a new one towards goal_index"""
+        self.close()
+        self.grid = grid
+        if hasattr(grid, 'subscribe'):
+            grid.subscribe(self.on_cells_changed)
+        self.pending_windows = []
+        self.pending_cells = []
+
+        self.n_rows, self.n_cols = grid.grid.shape
+        n_total = self.n_rows * self.n_cols
+        self.blocked = np.array(grid.grid, dtype=bool).ravel()
+        self.g = np.full(n_total, np.inf)
+        self.rhs = np.full(n_total, np.inf)
+        self.queued = np.zeros(n_total, dtype=bool)
+        self.queued_key = np.zeros((n_total, 2))
+        self.queue = []
+        self.km = 0.0
+        self.start_index = start_index
+        self.goal_index = goal_index
+
+        self.rhs[goal_index] = 0.0
+        self.push(goal_index, self.calculate_key(goal_index))
+
+    def heuristic(self, index_a, index_b):
+        if self.stats is not None:
+            self.stats.heuristic_calls += 1
+        row_a, col_a = divmod(index_a, self.n_cols)
+        row_b, col_b = divmod(index_b, self.n_cols)
+        return math.hypot(row_a - row_b, col_a - col_b)
+
+    def calculate_key(self, index):
+        g_rhs = min(self.g[index], self.rhs[index])
+        return (g_rhs + self.heuristic(self.start_index, index) + self.km, g_rhs)
+
+    def push(self, index, key):
+        self.queued[index] = True
+        self.queued_key[index] = key
+        heapq.heappush(self.queue, (key[0], key[1], index))
+        if self.stats is not None:
+            self.stats.nodes_pushed += 1
+            self.stats.record_open_size(len(self.queue))
+
+    def top(self):
+        """Get the smallest valid queue entry without removing it, dropping stale entries along the way"""
+        queue = self.queue
+        while queue:
+            k1, k2, index = queue[0]
+            if self.queued[index] and self.queued_key[index, 0] == k1 and self.queued_key[index, 1] == k2:
+                return (k1, k2), index
+            heapq.heappop(queue)
+        return None, None
+
+    def neighbors(self, index):
+        """Yield (neighbor index, step cost) for every in bounds neighbor of a cell"""
+        row, col = divmod(index, self.n_cols)
+        for d_row, d_col, step_cost in self.offsets:
+            n_row = row + d_row
+            n_col = col + d_col
+            if 0 <= n_row < self.n_rows and 0 <= n_col < self.n_cols:
+                yield n_row * self.n_cols + n_col, step_cost
+
+    def update_vertex(self, index):
+        if index != self.goal_index:
+            best = np.inf
+            if not self.blocked[index]:
+                g = self.g
+                blocked = self.blocked
+                for n_index, step_cost in self.neighbors(index):
+                    if not blocked[n_index] and step_cost + g[n_index] < best:
+                        best = step_cost + g[n_index]
+            self.rhs[index] = best
+        if self.g[index] != self.rhs[index]:
+            self.push(index, self.calculate_key(index))
+        else:
+            self.queued[index] = False
+
+    def compute_shortest_path(self, explored_points):
+        start_index = self.start_index
+        while True:
+            top_key, index = self.top()
+            if index is None:
+                break
+            if not (top_key < self.calculate_key(start_index) or self.rhs[start_index] != self.g[start_index]):
+                break
+            new_key = self.calculate_key(index)
+            if top_key < new_key:
+                self.push(index, new_key)
+                continue
+            self.queued[index] = False
+            if self.record_explored:
+                explored_points.append(list(divmod(index, self.n_cols)))
+            if self.stats is not None:
+                self.stats.record_expansion(*divmod(index, self.n_cols), self.rhs[index])
+            if self.g[index] > self.rhs[index]:
+                self.g[index] = self.rhs[index]
+            else:
+                self.g[index] = np.inf
+                self.update_vertex(index)
+            for n_index, _ in self.neighbors(index):
+                self.update_vertex(n_index)
+
+    def apply_grid_changes(self):
+        """Compare the grid against the planner's copy and repair the search around every cell whose state changed"""
+        current = self.grid.grid
+        changed = []
+        if hasattr(self.grid, 'subscribe'):
+            for rows, cols in self.pending_windows:
+                d_rows, d_cols = np.nonzero(current[rows, cols] != self.blocked.reshape(current.shape)[rows, cols])
+                changed.extend((d_rows + rows.start) * self.n_cols + d_cols + cols.start)
+        else:
+            changed.extend(np.flatnonzero(current.ravel() != self.blocked))
+        for row, col in self.pending_cells:
+            index = row * self.n_cols + col
+            if current[row, col] != self.blocked[index]:
+                changed.append(index)
+        self.pending_windows = []
+        self.pending_cells = []
+
+        changed = set(int(index) for index in changed)
+        for index in changed:
+            self.blocked[index] = current.flat[index]
+        for index in changed:
+            self.update_vertex(index)
+            for n_index, _ in self.neighbors(index):
+                self.update_vertex(n_index)
+
+    def extract_path(self):
+        """Follow the cheapest successors from the start to the goal"""
+        index = self.start_index
+        path = [list(divmod(index, self.n_cols))]
+        for _ in range(self.n_rows * self.n_cols):
+            if index == self.goal_index:
+                return path
+            best = np.inf
+            best_index = -1
+            for n_index, step_cost in self.neighbors(index):
+                if not self.blocked[n_index] and step_cost + self.g[n_index] < best:
+                    best = step_cost + self.g[n_index]
+                    best_index = n_index
+            if best_index == -1:
+                return []
+            index = best_index
+            path.append(list(divmod(index, self.n_cols)))
+        return []
+
+    def create_plan(self, start, end, grid):
+        """
+        Generate a path through the occupancy grid that avoids obstacles, reusing the previous search when the goal and grid are unchanged
+        :param start: 2d grid coordinates of start location
+        :param end: 2d grid coordinates of end location
+        :param grid: OccupancyGrid where 0 is free space and 1 is blocked space. IncrementalOccupancyGrids are subscribed to so only their dirty regions are checked for changes
+        :return: a list of coordinates which are the path from the start to the end. Returning an empty list means that no path was found.
+                 Also returns the list of points expanded during this call (empty if record_explored is False)
+        """
+
+        require_uniform_costs(grid, 'Dstar')
+
+        # Ensure start and end are numpy arrays
+        start = np.array(start)
+        end = np.array(end)
+
+        # If start or end is blocked, there is no feasible path
+        if grid.is_blocked(start) or grid.is_blocked(end):
+            return [],[]
+
+        # If the start position and the end are the same point, return that point as the path
+        if np.all(start == end):
+            return start,[]
+
+        stats = self.stats
+        if stats is not None:
+            stats.begin()
+
+        n_cols = grid.grid.shape[1]
+        start_index = int(start[0]) * n_cols + int(start[1])
+        goal_index = int(end[0]) * n_cols + int(end[1])
+
+        if grid is not self.grid or goal_index != self.goal_index or grid.grid.shape != (self.n_rows, self.n_cols):
+            self.reset(start_index, goal_index, grid)
+        else:
+            self.km += self.heuristic(self.start_index, start_index)
+            self.start_index = start_index
+            self.apply_grid_changes()
+        if stats is not None:
+            stats.mark('update')
+
+        explored_points = []
+        self.compute_shortest_path(explored_points)
+        if stats is not None:
+            stats.mark('search')
+        path = self.extract_path() if self.g[start_index] != np.inf else []
+        if stats is not None:
+            stats.mark('extract')
+        return path, explored_points
+
+
+def compute_cost_to_go(blocked, n_cols, goal_index, offsets, targets=()):
+    """
+    Run Dijkstra backwards from the goal over a flattened blocked array
+    :param blocked: flat boolean array of blocked cells
+    :param n_cols: number of columns in the grid
+    :param goal_index: flat index of the goal cell
+    :param offsets: neighbor offsets as returned by get_connection_offsets
+    :param targets: flat indices of cells we need costs for. The search stops once all of them are settled. If empty, the whole reachable grid is searched
+    :return: flat array of cost to reach the goal (inf where unknown or unreachable) and flat array of the next cell on the way to the goal (-1 for the goal and unreached cells)
+    """
+    n_rows = blocked.shape[0] // n_cols
+    cost = np.full(blocked.shape[0], np.inf)
+    next_step = np.full(blocked.shape[0], -1, dtype=np.int64)
+    closed = np.zeros(blocked.shape[0], dtype=bool)
+    remaining = set(int(index) for index in targets)
+    stop_early = bool(remaining)
+
+    cost[goal_index] = 0.0
+    queue = [(0.0, goal_index)]
+    while queue:
+        path_cost, index = heapq.heappop(queue)
+        if closed[index]:
+            continue
+        closed[index] = True
+        if stop_early:
+            remaining.discard(index)
+            if not remaining:
+                break
+
+        row, col = divmod(index, n_cols)
+        for d_row, d_col, step_cost in offsets:
+            n_row = row + d_row
+            n_col = col + d_col
+            if n_row < 0 or n_row >= n_rows or n_col < 0 or n_col >= n_cols:
+                continue
+            n_index = n_row * n_cols + n_col
+            if closed[n_index] or blocked[n_index]:
+                continue
+            new_path_cost = path_cost + step_cost
+            if new_path_cost < cost[n_index]:
+                cost[n_index] = new_path_cost
+                next_step[n_index] = index
+                heapq.heappush(queue, (new_path_cost, n_index))
+
+    return cost, next_step
+
+
+def follow_next_steps(next_step, start_index, goal_index, n_cols):
+    """Build the path from the start to the goal by following next step pointers from compute_cost_to_go"""
+    path = []
+    index = start_index
+    while index != -1:
+        path.append(list(divmod(index, n_cols)))
+        if index == goal_index:
+            return path
+        index = int(next_step[index])
+    return []
+
+
+def plan_goal_group(grid, connection_type, end, queries):
+    """
+    Plan every query that shares one goal
+    :param grid: OccupancyGrid to plan over
+    :param connection_type: 'four' or 'eight'
+    :param end: 2d grid coordinates of the shared goal
+    :param queries: list of (query number, start) pairs
+    :return: list of (query number, path) pairs
+    """
+    blocked = grid.grid
+    n_cols = blocked.shape[1]
+    end_index = int(end[0]) * n_cols + int(end[1])
+    results = []
+    pending = []
+    for query_number, start in queries:
+        if grid.is_blocked(start) or grid.is_blocked(end):
+            results.append((query_number, []))
+        elif start[0] == end[0] and start[1] == end[1]:
+            results.append((query_number, [[int(start[0]), int(start[1])]]))
+        else:
+            pending.append((query_number, start, int(start[0]) * n_cols + int(start[1])))
+
+    # A single query is answered faster by A*, several queries share one reverse search
+    if len(pending) == 1:
+        query_number, start, _ = pending[0]
+        path, _ = AStarPlanner(connection_type, record_explored=False).create_plan(start, end, grid)
+        results.append((query_number, path))
+    elif pending:
+        _, next_step = compute_cost_to_go(blocked.ravel(), n_cols, end_index, get_connection_offsets(connection_type),
+                                          targets=[start_index for _, _, start_index in pending])
+        for query_number, _, start_index in pending:
+            results.append((query_number, follow_next_steps(next_step, start_index, end_index, n_cols)))
+    return results
+
+
+# Per process cache of attached shared memory grids, keyed by shared memory name. Each entry holds the segment, a grid view of
+# it and the planners that were built for it, keyed by planner type and arguments
+_worker_grids = {}
+
+
+def release_worker_grids():
+    """Detach this process from every shared memory grid. The grid views and planners are dropped first, since a segment cannot
+    be closed while views of it exist"""
+    segments = [segment for segment, _, _ in _worker_grids.values()]
+    _worker_grids.clear()
+    for segment in segments:
+        segment.close()
+
+
+def get_worker_state(shared_memory_name, shape):
+    """Get the (segment, grid, planners) entry of a shared memory grid, attaching to it the first time it is seen by this process"""
+    if shared_memory_name not in _worker_grids:
+        # Only keep the newest grid attached, older versions are not planned against again
+        release_worker_grids()
+        segment = shared_memory.SharedMemory(name=shared_memory_name)
+        blocked = np.ndarray(shape, dtype=bool, buffer=segment.buf)
+        _worker_grids[shared_memory_name] = (segment, World.occupancy_grid_from_numpy_array(blocked), {})
+    return _worker_grids[shared_memory_name]
+
+
+def get_worker_grid(shared_memory_name, shape):
+    """Get a zero copy OccupancyGrid view of a shared memory grid"""
+    return get_worker_state(shared_memory_name, shape)[1]
+
+
+def plan_in_worker(shared_memory_name, shape, planner_type, planner_args, start, end):
+    """Plan one query in a worker process. The worker keeps one planner per planner type, arguments and grid, so stateful
+    planners such as Dstar and HPAstar reuse their search or abstraction across queries instead of rebuilding it"""
+    _, grid, planners = get_worker_state(shared_memory_name, shape)
+    key = (planner_type, repr(sorted(planner_args.items())))
+    planner = planners.get(key)
+    if planner is None:
+        planner = create_discrete_planner(planner_type, **planner_args)
+        planners[key] = planner
+    path, _ = planner.create_plan(start, end, grid)
+    return path
+
+
+def plan_goal_group_in_worker(shared_memory_name, shape, connection_type, end, queries):
+    return plan_goal_group(get_worker_grid(shared_memory_name, shape), connection_type, end, queries)
+
+
+class SharedGrid:
+    """A copy of an occupancy grid in shared memory, along with the number of submitted queries still using it"""
+
+    def __init__(self, grid):
+        self.segment = shared_memory.SharedMemory(create=True, size=max(grid.grid.nbytes, 1))
+        self.blocked = np.ndarray(grid.grid.shape, dtype=bool, buffer=self.segment.buf)
+        self.blocked[:] = grid.grid
+        self.source = grid
+        self.version = getattr(grid, 'version', None)
+        self.users = 0
+
+    def matches(self, grid):
+        """Check if this copy is still up to date with a grid, using the grid version when it has one"""
+        if grid is not self.source or grid.grid.shape != self.blocked.shape:
+            return False
+        if self.version is not None:
+            return getattr(grid, 'version', None) == self.version
+        return np.array_equal(grid.grid, self.blocked)
+
+    def release(self):
+        del self.blocked
+        self.segment.close()
+        self.segment.unlink()
+
+
+class PlannerPool:
+    """Pool of worker processes that run grid planners against a shared memory copy of the occupancy grid.
+    The grid is copied into shared memory once per grid version and workers attach to it without any per query pickling"""
+
+    def __init__(self, n_processes=None):
+        """
+        Create a planner pool
+        :param n_processes: number of worker processes, defaults to the number of cores
+        """
+        self.executor = ProcessPoolExecutor(max_workers=n_processes)
+        self.shared_grid = None
+        self.retired_grids = []
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def set_grid(self, grid):
+        """Make grid the grid that following queries plan against, copying it into shared memory if it changed since the last copy"""
+        require_uniform_costs(grid, 'PlannerPool')
+        with self.lock:
+            if self.shared_grid is not None and self.shared_grid.matches(grid):
+                return
+            if self.shared_grid is not None:
+                self.retired_grids.append(self.shared_grid)
+            self.shared_grid = SharedGrid(grid)
+            self.release_unused_grids()
+
+    def release_unused_grids(self):
+        """Free the shared memory of old grid versions once no submitted query is using them. Must be called with the lock held"""
+        still_used = []
+        for shared_grid in self.retired_grids:
+            if shared_grid.users == 0:
+                shared_grid.release()
+            else:
+                still_used.append(shared_grid)
+        self.retired_grids = still_used
+
+    def submit_task(self, function, grid, *args):
+        if grid is not None:
+            self.set_grid(grid)
+        with self.lock:
+            if self.shared_grid is None:
+                raise ValueError('Set a grid before submitting queries')
+            shared_grid = self.shared_grid
+            shared_grid.users += 1
+        future = self.executor.submit(function, shared_grid.segment.name, shared_grid.blocked.shape, *args)
+        future.add_done_callback(lambda _: self.finish_task(shared_grid))
+        return future
+
+    def finish_task(self, shared_grid):
+        with self.lock:
+            shared_grid.users -= 1
+            self.release_unused_grids()
+
+    def submit(self, start, end, grid=None, planner_type='Astar', **planner_args):
+        """
+        Queue a single query
+        :param start: 2d grid coordinates of start location
+        :param end: 2d grid coordinates of end location
+        :param grid: OccupancyGrid to plan over. If not given, the last grid passed to the pool is used
+        :param planner_type: name of the planner to run, as accepted by create_discrete_planner
+        :param planner_args: extra arguments for the planner, for example connection_type
+        :return: a Future whose result is the path
+        """
+        return self.submit_task(plan_in_worker, grid, planner_type, planner_args, start, end)
+
+    def submit_goal_group(self, end, queries, grid=None, connection_type='four'):
+        """Queue all queries that share a goal, see plan_goal_group. Returns a Future of (query number, path) pairs"""
+        return self.submit_task(plan_goal_group_in_worker, grid, connection_type, end, queries)
+
+    def close(self):
+        """Stop the workers and free all shared memory"""
+        self.executor.shutdown(wait=True)
+        with self.lock:
+            if self.shared_grid is not None:
+                self.retired_grids.append(self.shared_grid)
+                self.shared_grid = None
+            self.release_unused_grids()
+
+
+class BatchPlanner:
+    """Plans many start/end pairs over the same grid at once.
+    Queries that share a goal are answered from a single reverse Dijkstra search from that goal"""
+
+    def __init__(self, connection_type='four', n_processes=None, pool=None):
+        """
+        Create a batch planner
+        :param connection_type: 'four' or 'eight' connected grid moves
+        :param n_processes: if greater than 1, goal groups are spread over a temporary PlannerPool that reads a shared memory copy of the grid
+        :param pool: existing PlannerPool to spread goal groups over, takes priority over n_processes
+        """
+        self.connection_type = connection_type
+        self.n_processes = n_processes
+        self.pool = pool
+
+    def group_queries(self, starts, ends):
+        """Group the queries by goal as {goal: [(query number, start), ...]}"""
+        starts = np.asarray(starts, dtype=np.int64).reshape(-1, 2)
+        ends = np.asarray(ends, dtype=np.int64).reshape(-1, 2)
+        if starts.shape != ends.shape:
+            raise ValueError('Need the same number of starts and ends')
+        groups = {}
+        for query_number, (start, end) in enumerate(zip(starts, ends)):
+            groups.setdefault((int(end[0]), int(end[1])), []).append((query_number, start))
+        return groups, len(starts)
+
+    def create_plans(self, starts, ends, grid):
+        """
+        Generate paths for many start/end pairs
+        :param starts: array like of 2d grid coordinates, one row per query
+        :param ends: array like of 2d grid coordinates, one row per query
+        :param grid: OccupancyGrid where 0 is free space and 1 is blocked space
+        :return: list with one path per query, each a list of [row, col] coordinates from start to end. An empty list means no path was found
+        """
+        require_uniform_costs(grid, 'BatchPlanner')
+        groups, n_queries = self.group_queries(starts, ends)
+        paths = [[] for _ in range(n_queries)]
+        if self.pool is not None:
+            group_results = self.run_in_pool(self.pool, groups, grid)
+        elif self.n_processes is not None and self.n_processes > 1 and len(groups) > 1:
+            with PlannerPool(self.n_processes) as pool:
+                group_results = self.run_in_pool(pool, groups, grid)
+        else:
+            group_results = [plan_goal_group(grid, self.connection_type, end, queries) for end, queries in groups.items()]
+        for results in group_results:
+            for query_number, path in results:
+                paths[query_number] = path
+        return paths
+
+    def run_in_pool(self, pool, groups, grid):
+        """Fan the goal groups out across a PlannerPool and wait for all of them"""
+        pool.set_grid(grid)
+        futures = [pool.submit_goal_group(end, queries, connection_type=self.connection_type) for end, queries in groups.items()]
+        return [future.result() for future in futures]
+
+
+class HPAStarPlanner:
+    """Hierarchical A* planner. The grid is split into square clusters connected through entrances on their shared borders.
+    Shortest paths between the entrances of each cluster are precomputed and cached, so long queries are searched on the
+    small abstract graph and refined by stitching the cached paths together. Paths are near optimal rather than optimal"""
+
+    def __init__(self, connection_type='eight', cluster_size=10, max_entrance_width=6, record_explored=True, stats=None):
+        """
+        Create a hierarchical planner
+        :param connection_type: 'four' or 'eight' connected grid moves inside clusters
+        :param cluster_size: width of the square clusters in cells
+        :param max_entrance_width: entrances at least this wide get a transition at each end instead of one in the middle
+        :param record_explored: if False, the explored list returned by create_plan is left empty to save time and memory
+        :param stats: optional PlannerStats to record abstract graph expansions, queue pushes and phase timings in
+        """
+        self.connection_type = connection_type
+        self.stats = stats
+        self.offsets = get_connection_offsets(connection_type)
+        self.cluster_size = cluster_size
+        self.max_entrance_width = max_entrance_width
+        self.record_explored = record_explored
+        self.grid = None
+        self.pending_windows = []
+        self.rebuilt_clusters = set()
+
+    def on_cells_changed(self, rows, cols):
+        """Occupancy grid subscriber callback, records a dirty region to be rebuilt on the next plan"""
+        self.pending_windows.append((rows, cols))
+
+    def get_cluster_bounds(self, cluster):
+        """Get the (row start, row end, col start, col end) of the cells in a cluster"""
+        c_row, c_col = cluster
+        size = self.cluster_size
+        return (c_row * size, min((c_row + 1) * size, self.n_rows),
+                c_col * size, min((c_col + 1) * size, self.n_cols))
+
+    def get_cluster(self, index):
+        row, col = divmod(index, self.n_cols)
+        return row // self.cluster_size, col // self.cluster_size
+
+    def get_borders(self, cluster):
+        """
+        Get the keys of the borders around a cluster. Each border is keyed by the (upper or left cluster, lower or right cluster)
+        pair. Eight connected moves can also cross the corner between diagonal clusters, keyed by the (upper, lower) pair
+        """
+        c_row, c_col = cluster
+        neighbors = [(c_row - 1, c_col), (c_row + 1, c_col), (c_row, c_col - 1), (c_row, c_col + 1)]
+        if self.connection_type == 'eight':
+            neighbors += [(c_row - 1, c_col - 1), (c_row - 1, c_col + 1), (c_row + 1, c_col - 1), (c_row + 1, c_col + 1)]
+        borders = []
+        for neighbor in neighbors:
+            if 0 <= neighbor[0] < self.n_cluster_rows and 0 <= neighbor[1] < self.n_cluster_cols:
+                borders.append((cluster, neighbor) if cluster < neighbor else (neighbor, cluster))
+        return borders
+
+    def close(self):
+        """Unsubscribe from the occupancy grid and throw away the abstraction, so the grid no longer keeps the planner alive"""
+        if self.grid is not None and hasattr(self.grid, 'unsubscribe'):
+            self.grid.unsubscribe(self.on_cells_changed)
+        self.grid = None
+        self.pending_windows = []
+
+    def build(self, grid):
+        """Throw away any cached abstraction and build it for a new grid"""
+        self.close()
+        self.grid = grid
+        if hasattr(grid, 'subscribe'):
+            grid.subscribe(self.on_cells_changed)
+        self.pending_windows = []
+
+        self.n_rows, self.n_cols = grid.grid.shape
+        self.blocked = np.array(grid.grid, dtype=bool)
+        self.n_cluster_rows = -(-self.n_rows // self.cluster_size)
+        self.n_cluster_cols = -(-self.n_cols // self.cluster_size)
+        self.transitions = {}
+        self.crossings = {}
+        self.intra_edges = {}
+
+        clusters = [(c_row, c_col) for c_row in range(self.n_cluster_rows) for c_col in range(self.n_cluster_cols)]
+        self.rebuild_clusters(clusters)
+
+    def rebuild_clusters(self, dirty_clusters):
+        """Recompute the borders around the dirty clusters, then the intra cluster paths of every cluster touching those borders"""
+        dirty_borders = set()
+        for cluster in dirty_clusters:
+            dirty_borders.update(self.get_borders(cluster))
+        affected_clusters = set(dirty_clusters)
+        for border in dirty_borders:
+            self.set_transitions(border, self.find_transitions(border))
+            affected_clusters.update(border)
+        for cluster in affected_clusters:
+            self.intra_edges[cluster] = self.find_intra_edges(cluster)
+        self.rebuilt_clusters = affected_clusters
+
+    def set_transitions(self, border, transitions):
+        """Replace the transitions of a border, updating the crossing edges of the abstract graph in place"""
+        for index_a, index_b in self.transitions.get(border, []):
+            for node, other in ((index_a, index_b), (index_b, index_a)):
+                edges = [edge for edge in self.crossings[node] if edge[0] != other]
+                if edges:
+                    self.crossings[node] = edges
+                else:
+                    del self.crossings[node]
+        self.transitions[border] = transitions
+        for index_a, index_b in transitions:
+            row_a, col_a = divmod(index_a, self.n_cols)
+            row_b, col_b = divmod(index_b, self.n_cols)
+            cost = math.hypot(row_a - row_b, col_a - col_b)
+            self.crossings.setdefault(index_a, []).append((index_b, cost, None))
+            self.crossings.setdefault(index_b, []).append((index_a, cost, None))
+
+    def find_transitions(self, border):
+        """Find the pairs of cells (one on each side of a border) used to cross between two clusters"""
+        (c_row_a, c_col_a), (c_row_b, c_col_b) = border
+        row_start, row_end, col_start, col_end = self.get_cluster_bounds((c_row_a, c_col_a))
+        if c_row_a != c_row_b and c_col_a != c_col_b:
+            # Diagonal clusters only meet at a corner, crossed by one diagonal move
+            cell_a = (row_end - 1, col_end - 1) if c_col_a < c_col_b else (row_end - 1, col_start)
+            cell_b = (row_end, col_end) if c_col_a < c_col_b else (row_end, col_start - 1)
+            if self.blocked[cell_a] or self.blocked[cell_b]:
+                return []
+            return [(cell_a[0] * self.n_cols + cell_a[1], cell_b[0] * self.n_cols + cell_b[1])]
+        if c_row_a == c_row_b:
+            # Vertical border between left and right clusters
+            side_a = [(row, col_end - 1) for row in range(row_start, row_end)]
+            side_b = [(row, col_end) for row in range(row_start, row_end)]
+        else:
+            # Horizontal border between upper and lower clusters
+            side_a = [(row_end - 1, col) for col in range(col_start, col_end)]
+            side_b = [(row_end, col) for col in range(col_start, col_end)]
+        free = [not self.blocked[a] and not self.blocked[b] for a, b in zip(side_a, side_b)]
+
+        transitions = []
+        position = 0
+        while position < len(free):
+            if not free[position]:
+                position += 1
+                continue
+            run_start = position
+            while position < len(free) and free[position]:
+                position += 1
+            if position - run_start >= self.max_entrance_width:
+                crossings = [run_start, position - 1]
+            else:
+                crossings = [(run_start + position - 1) // 2]
+            for crossing in crossings:
+                cell_a = side_a[crossing]
+                cell_b = side_b[crossing]
+                transitions.append((cell_a[0] * self.n_cols + cell_a[1], cell_b[0] * self.n_cols + cell_b[1]))
+
+        if self.connection_type == 'eight':
+            # A diagonal move between free cells crosses the border even where no straight crossing is open next to it.
+            # Where one is open, the free cells along each side already join the diagonal move to that crossing
+            for position in range(len(side_a) - 1):
+                for a, b in ((position, position + 1), (position + 1, position)):
+                    if not self.blocked[side_a[a]] and not self.blocked[side_b[b]] and \
+                            self.blocked[side_a[b]] and self.blocked[side_b[a]]:
+                        transitions.append((side_a[a][0] * self.n_cols + side_a[a][1], side_b[b][0] * self.n_cols + side_b[b][1]))
+        return transitions
+
+    def get_cluster_nodes(self, cluster):
+        nodes = set()
+        for border in self.get_borders(cluster):
+            for index_a, index_b in self.transitions[border]:
+                nodes.add(index_a if border[0] == cluster else index_b)
+        return sorted(nodes)
+
+    def search_cluster(self, cluster, source, targets):
+        """
+        Run Dijkstra from a cell, staying inside its cluster
+        :return: dict of target cell index -> (cost, path from source to target) for every reachable target
+        """
+        row_start, row_end, col_start, col_end = self.get_cluster_bounds(cluster)
+        width = col_end - col_start
+        local_blocked = self.blocked[row_start:row_end, col_start:col_end].ravel()
+
+        def to_local(index):
+            row, col = divmod(index, self.n_cols)
+            return (row - row_start) * width + col - col_start
+
+        local_source = to_local(source)
+        local_targets = [to_local(target) for target in targets]
+        cost, next_step = compute_cost_to_go(local_blocked, width, local_source, self.offsets, targets=local_targets)
+        results = {}
+        for target, local_target in zip(targets, local_targets):
+            if cost[local_target] == np.inf:
+                continue
+            local_path = follow_next_steps(next_step, local_target, local_source, width)
+            path = [[row + row_start, col + col_start] for row, col in reversed(local_path)]
+            results[target] = (cost[local_target], path)
+        return results
+
+    def find_intra_edges(self, cluster):
+        """Find the shortest path inside a cluster between every pair of its entrance nodes"""
+        nodes = self.get_cluster_nodes(cluster)
+        edges = {node: [] for node in nodes}
+        for position, source in enumerate(nodes):
+            targets = nodes[position + 1:]
+            if not targets:
+                continue
+            for target, (cost, path) in self.search_cluster(cluster, source, targets).items():
+                edges[source].append((target, cost, path))
+                edges[target].append((source, cost, path[::-1]))
+        return edges
+
+    def get_node_edges(self, node):
+        """Get the abstract graph edges of an entrance node, the paths across its cluster and its border crossings"""
+        return self.intra_edges[self.get_cluster(node)].get(node, []) + self.crossings.get(node, [])
+
+    def apply_grid_changes(self):
+        """Find the clusters whose cells changed since the abstraction was built and rebuild only those"""
+        current = self.grid.grid
+        changed_rows = []
+        changed_cols = []
+        if hasattr(self.grid, 'subscribe'):
+            for rows, cols in self.pending_windows:
+                d_rows, d_cols = np.nonzero(current[rows, cols] != self.blocked[rows, cols])
+                changed_rows.extend(d_rows + rows.start)
+                changed_cols.extend(d_cols + cols.start)
+        else:
+            changed_rows, changed_cols = np.nonzero(current != self.blocked)
+        self.pending_windows = []
+        if len(changed_rows) == 0:
+            self.rebuilt_clusters = set()
+            return
+        changed_rows = np.asarray(changed_rows)
+        changed_cols = np.asarray(changed_cols)
+        self.blocked[changed_rows, changed_cols] = current[changed_rows, changed_cols]
+        dirty_clusters = set(zip((changed_rows // self.cluster_size).tolist(), (changed_cols // self.cluster_size).tolist()))
+        self.rebuild_clusters(dirty_clusters)
+
+    def connect_endpoint(self, index, extra_edges, reverse):
+        """Add temporary edges between a start or goal cell and the entrance nodes of its cluster"""
+        cluster = self.get_cluster(index)
+        nodes = [node for node in self.get_cluster_nodes(cluster) if node != index]
+        for node, (cost, path) in self.search_cluster(cluster, index, nodes).items():
+            if reverse:
+                extra_edges.setdefault(node, []).append((index, cost, path[::-1]))
+            else:
+                extra_edges.setdefault(index, []).append((node, cost, path))
+
+    def create_plan(self, start, end, grid):
+        """
+        Generate a path through the occupancy grid that avoids obstacles using the cached cluster abstraction
+        :param start: 2d grid coordinates of start location
+        :param end: 2d grid coordinates of end location
+        :param grid: OccupancyGrid where 0 is free space and 1 is blocked space. IncrementalOccupancyGrids are subscribed to so only their dirty clusters are rebuilt
+        :return: a list of coordinates which are the path from the start to the end. Returning an empty list means that no path was found.
+                 Also returns the list of abstract graph nodes in the order they were expanded (empty if record_explored is False)
+        """
+
+        require_uniform_costs(grid, 'HPAstar')
+
+        # Ensure start and end are numpy arrays
+        start = np.array(start)
+        end = np.array(end)
+
+        # If start or end is blocked, there is no feasible path
+        if grid.is_blocked(start) or grid.is_blocked(end):
+            return [],[]
+
+        # If the start position and the end are the same point, return that point as the path
+        if np.all(start == end):
+            return start,[]
+
+        stats = self.stats
+        if stats is not None:
+            stats.begin()
+
+        if grid is not self.grid or grid.grid.shape != (self.n_rows, self.n_cols):
+            self.build(grid)
+        else:
+            self.apply_grid_changes()
+        if stats is not None:
+            stats.mark('abstraction')
+
+        n_cols = self.n_cols
+        start_index = int(start[0]) * n_cols + int(start[1])
+        end_index = int(end[0]) * n_cols + int(end[1])
+
+        # Connect the endpoints to the abstract graph, and to each other if they share a cluster
+        extra_edges = {}
+        self.connect_endpoint(start_index, extra_edges, reverse=False)
+        self.connect_endpoint(end_index, extra_edges, reverse=True)
+        if self.get_cluster(start_index) == self.get_cluster(end_index):
+            direct = self.search_cluster(self.get_cluster(start_index), start_index, [end_index])
+            if end_index in direct:
+                cost, path = direct[end_index]
+                extra_edges.setdefault(start_index, []).append((end_index, cost, path))
+        if stats is not None:
+            stats.mark('connect')
+
+        return self.search_abstract_graph(start_index, end_index, extra_edges)
+
+    def search_abstract_graph(self, start_index, end_index, extra_edges):
+        """A* over the abstract graph, then stitch the edge paths together into a full path"""
+        n_cols = self.n_cols
+        end_row, end_col = divmod(end_index, n_cols)
+        g_score = {start_index: 0.0}
+        parent = {start_index: (None, None)}
+        closed = set()
+        explored_points = []
+        counter = 0
+        start_row, start_col = divmod(start_index, n_cols)
+        queue = [(math.hypot(start_row - end_row, start_col - end_col), counter, start_index)]
+        stats = self.stats
+        found = False
+
+        while queue:
+            _, _, node = heapq.heappop(queue)
+            if node in closed:
+                continue
+            closed.add(node)
+            if self.record_explored:
+                explored_points.append(list(divmod(node, n_cols)))
+            if stats is not None:
+                stats.record_expansion(*divmod(node, n_cols), g_score[node])
+
+            if node == end_index:
+                found = True
+                break
+
+            path_cost = g_score[node]
+            for neighbor, edge_cost, edge_path in self.get_node_edges(node) + extra_edges.get(node, []):
+                if neighbor in closed:
+                    continue
+                new_path_cost = path_cost + edge_cost
+                if new_path_cost < g_score.get(neighbor, np.inf):
+                    g_score[neighbor] = new_path_cost
+                    parent[neighbor] = (node, edge_path)
+                    counter += 1
+                    n_row, n_col = divmod(neighbor, n_cols)
+                    heapq.heappush(queue, (new_path_cost + math.hypot(n_row - end_row, n_col - end_col), counter, neighbor))
+                    if stats is not None:
+                        stats.record_open_size(len(queue))
+
+        # Every push, including the start, needed one heuristic evaluation
+        if stats is not None:
+            stats.nodes_pushed += counter + 1
+            stats.heuristic_calls += counter + 1
+            stats.mark('search')
+        path = self.stitch_path(parent, end_index) if found else []
+        if stats is not None:
+            stats.mark('refine')
+        return path, explored_points
+
+    def stitch_path(self, parent, end_index):
+        segments = []
+        node = end_index
+        while True:
+            previous, edge_path = parent[node]
+            if previous is None:
+                break
+            segments.append(edge_path if edge_path is not None else [list(divmod(node, self.n_cols))])
+            node = previous
+        path = [list(divmod(node, self.n_cols))]
+        for segment in reversed(segments):
+            path.extend(segment[1:] if segment[0] == path[-1] else segment)
+        return path
+
+
+class SIPPPlanner:
+    """Safe interval path planning: A* over (cell, safe interval) states of a World.OccupancyPrediction
+    Instead of planning on a snapshot of the moving obstacles, the plan says when to be in each cell, including where to wait
+    for an obstacle to pass, so it stays valid as long as the obstacles keep their predicted velocities"""
+
+    def __init__(self, connection_type='four', move_time=1.0, record_explored=True, stats=None):
+        """
+        Create a SIPP planner
+        :param connection_type: 'four' or 'eight' connected grid moves
+        :param move_time: seconds the agent needs to move one cell, diagonal moves take SQRT2 times longer
+        :param record_explored: if False, the explored list returned by create_plan is left empty to save time and memory
+        :param stats: optional PlannerStats to record expansions, queue pushes and phase timings in
+        """
+        self.connection_type = connection_type
+        self.move_time = move_time
+        self.record_explored = record_explored
+        self.stats = stats
+
+    def create_plan(self, start, end, prediction, start_time=0.0):
+        """
+        Generate a time-stamped path that avoids static obstacles and the predicted positions of moving ones
+        The agent occupies both cells for the whole of a move, and the goal is only reached in a safe interval that never ends
+        :param start: 2d grid coordinates of start location
+        :param end: 2d grid coordinates of end location
+        :param prediction: World.OccupancyPrediction giving the safe intervals of each cell
+        :param start_time: time the agent is at the start, on the clock of the prediction
+        :return: a list of [row, col, time] entries giving the time the agent arrives at each cell. A cell is listed twice
+                 when the agent waits there, the second time being when it leaves. Returning an empty list means that no
+                 path was found. Also returns the list of explored points in the order they were expanded (empty if record_explored is False)
+        """
+        n_rows, n_cols = prediction.shape
+        start_row, start_col = int(start[0]), int(start[1])
+        end_row, end_col = int(end[0]), int(end[1])
+        for row, col in ((start_row, start_col), (end_row, end_col)):
+            if row < 0 or row >= n_rows or col < 0 or col >= n_cols:
+                return [],[]
+        start_interval = -1
+        for i, (interval_start, interval_end) in enumerate(prediction.get_safe_intervals(start_row, start_col)):
+            if interval_start <= start_time <= interval_end:
+                start_interval = i
+        if start_interval == -1 or not prediction.get_safe_intervals(end_row, end_col):
+            return [],[]
+
+        stats = self.stats
+        if stats is not None:
+            stats.begin()
+
+        offsets = get_connection_offsets(self.connection_type)
+        move_time = self.move_time
+        explored_points = []
+        record_explored = self.record_explored
+        start_state = (start_row * n_cols + start_col, start_interval)
+        arrival = {start_state: start_time}
+        parent = {start_state: (None, start_time)}  # state -> (previous state, time the agent left the previous cell)
+        closed = set()
+        counter = 0
+        queue = [(start_time + move_time * math.hypot(start_row - end_row, start_col - end_col), counter, start_state)]
+        goal_state = None
+        if stats is not None:
+            stats.record_open_size(1)
+            stats.mark('setup')
+
+        while queue:
+            _, _, state = heapq.heappop(queue)
+            if state in closed:
+                continue
+            closed.add(state)
+            index, interval = state
+            row, col = divmod(index, n_cols)
+            time = arrival[state]
+            if record_explored:
+                explored_points.append([row, col])
+            if stats is not None:
+                stats.record_expansion(row, col, time)
+
+            interval_end = prediction.get_safe_intervals(row, col)[interval][1]
+            if index == end_row * n_cols + end_col and interval_end == math.inf:
+                goal_state = state
+                break
+
+            for d_row, d_col, step_cost in offsets:
+                n_row = row + d_row
+                n_col = col + d_col
+                if n_row < 0 or n_row >= n_rows or n_col < 0 or n_col >= n_cols:
+                    continue
+                duration = move_time * step_cost
+                n_index = n_row * n_cols + n_col
+                for n_interval, (n_start, n_end) in enumerate(prediction.get_safe_intervals(n_row, n_col)):
+                    # Leave as soon as the next cell is free, waiting in the current cell if needed
+                    departure = max(time, n_start)
+                    if departure + duration > interval_end:
+                        break
+                    if departure + duration > n_end:
+                        continue
+                    n_state = (n_index, n_interval)
+                    n_arrival = departure + duration
+                    if n_state in closed or n_arrival >= arrival.get(n_state, math.inf):
+                        continue
+                    arrival[n_state] = n_arrival
+                    parent[n_state] = (state, departure)
+                    counter += 1
+                    heapq.heappush(queue, (n_arrival + move_time * math.hypot(n_row - end_row, n_col - end_col), counter, n_state))
+                    if stats is not None:
+                        stats.record_open_size(len(queue))
+
+        if stats is not None:
+            stats.nodes_pushed += counter + 1
+            stats.heuristic_calls += counter + 1
+            stats.mark('search')
+        path = self.reconstruct_timed_path(parent, arrival, goal_state, n_cols) if goal_state is not None else []
+        if stats is not None:
+            stats.mark('reconstruct')
+        return path, explored_points
+
+    def reconstruct_timed_path(self, parent, arrival, goal_state, n_cols):
+        path = []
+        state = goal_state
+        departure = None
+        while state is not None:
+            row, col = divmod(state[0], n_cols)
+            if departure is not None and departure > arrival[state]:
+                path.append([row, col, departure])
+            path.append([row, col, arrival[state]])
+            state, departure = parent[state]
+        path.reverse()
+        return path
+
+
+def segments_hit_circles(p0, p1, centers, radii):
+    """
+    Test many line segments against many circles at once
+    :param p0, p1: (S, 2) arrays of segment end points
+    :param centers: (C, 2) array of circle centers
+    :param radii: (C,) array of circle radii
+    :return: (S,) boolean array that is True where a segment passes through any circle
+    """
+    d = p1 - p0
+    to_center = centers[np.newaxis, :, :] - p0[:, np.newaxis, :]
+    length_squared = np.maximum(np.sum(d * d, axis=1), 1e-12)
+    t = np.clip(np.sum(to_center * d[:, np.newaxis, :], axis=2) / length_squared[:, np.newaxis], 0, 1)
+    offset = to_center - t[:, :, np.newaxis] * d[:, np.newaxis, :]
+    return np.any(np.sum(offset * offset, axis=2) < radii * radii, axis=1)
+
+
+def segments_hit_boxes(p0, p1, boxes):
+    """
+    Test many line segments against many axis aligned boxes at once with the slab method
+    :param p0, p1: (S, 2) arrays of segment end points
+    :param boxes: (B, 4) array of (min_x, min_y, max_x, max_y)
+    :return: (S,) boolean array that is True where a segment passes through any box
+    """
+    t_min = np.zeros((len(p0), len(boxes)))
+    t_max = np.ones((len(p0), len(boxes)))
+    hit = np.ones((len(p0), len(boxes)), dtype=bool)
+    for axis in range(2):
+        start = p0[:, axis, np.newaxis]
+        d = (p1[:, axis] - p0[:, axis])[:, np.newaxis]
+        lo = boxes[np.newaxis, :, axis]
+        hi = boxes[np.newaxis, :, axis + 2]
+        parallel = np.abs(d) < 1e-12
+        hit &= ~parallel | ((start > lo) & (start < hi))
+        safe_d = np.where(parallel, 1.0, d)
+        t1 = (lo - start) / safe_d
+        t2 = (hi - start) / safe_d
+        t_min = np.where(parallel, t_min, np.maximum(t_min, np.minimum(t1, t2)))
+        t_max = np.where(parallel, t_max, np.minimum(t_max, np.maximum(t1, t2)))
+    return np.any(hit & (t_min < t_max), axis=1)
+
+
+def segments_hit_triangles(p0, p1, vertices):
+    """
+    Test many line segments against many triangles at once
+    :param p0, p1: (S, 2) arrays of segment end points
+    :param vertices: (T, 3, 2) array of triangle corners in counter-clockwise order
+    :return: (S,) boolean array that is True where a segment starts inside or crosses any triangle
+    """
+    def cross(o, a, b):
+        return (a[..., 0] - o[..., 0]) * (b[..., 1] - o[..., 1]) - (a[..., 1] - o[..., 1]) * (b[..., 0] - o[..., 0])
+
+    a = p0[:, np.newaxis, :]
+    b = p1[:, np.newaxis, :]
+    inside = np.ones((len(p0), len(vertices)), dtype=bool)
+    crosses = np.zeros((len(p0), len(vertices)), dtype=bool)
+    for k in range(3):
+        c = vertices[np.newaxis, :, k, :]
+        e = vertices[np.newaxis, :, (k + 1) % 3, :]
+        inside &= cross(c, e, a) >= 0
+        crosses |= (cross(a, b, c) * cross(a, b, e) <= 0) & (cross(c, e, a) * cross(c, e, b) <= 0)
+    return np.any(inside | crosses, axis=1)
+
+
+class ShapeObstacles:
+    """The shapes of a set of entities as arrays, for vectorized segment collision checks in world coordinates
+    A World.SpatialHash over the entities picks the candidate shapes near each batch of segments"""
+
+    def __init__(self, entities, cell_size=5.0):
+        """
+        Snapshot the current shapes of entities
+        :param entities: entities to collide with, such as World.entity_list
+        :param cell_size: cell size in meters of the spatial hash used as a broadphase
+        """
+        self.spatial_hash = World.SpatialHash(cell_size)
+        self.spatial_hash.insert_all(entities)
+        self.shape_index = {}  # entity -> (shape code, row in the array for that shape)
+        circles = []
+        boxes = []
+        triangles = []
+        for entity in entities:
+            if isinstance(entity, World.Circle):
+                self.shape_index[entity] = (World.SHAPE_CIRCLE, len(circles))
+                circles.append([entity.pos[0], entity.pos[1], entity.radius])
+            elif isinstance(entity, World.Triangle):
+                self.shape_index[entity] = (World.SHAPE_TRIANGLE, len(triangles))
+                triangles.append(entity.get_vertices())
+            else:
+                self.shape_index[entity] = (World.SHAPE_RECTANGLE, len(boxes))
+                boxes.append(entity.get_bounding_box())
+        circles = np.array(circles, dtype=float).reshape(-1, 3)
+        self.circle_centers = circles[:, :2]
+        self.circle_radii = circles[:, 2]
+        self.boxes = np.array(boxes, dtype=float).reshape(-1, 4)
+        self.triangles = np.array(triangles, dtype=float).reshape(-1, 3, 2)
+
+    def segments_collide(self, p0, p1):
+        """
+        Check a batch of segments against every shape
+        :param p0, p1: (S, 2) arrays of segment end points in meters. Either may be a single point shared by every segment
+        :return: (S,) boolean array that is True where a segment hits a shape
+        """
+        p0 = np.asarray(p0, dtype=float).reshape(-1, 2)
+        p1 = np.asarray(p1, dtype=float).reshape(-1, 2)
+        hit = np.zeros(max(len(p0), len(p1)), dtype=bool)
+        if len(hit) == 0:
+            return hit
+        low = np.minimum(p0.min(axis=0), p1.min(axis=0))
+        high = np.maximum(p0.max(axis=0), p1.max(axis=0))
+        candidates = self.spatial_hash.query_box((low[0], low[1], high[0], high[1]))
+        if not candidates:
+            return hit
+        p0, p1 = np.broadcast_arrays(p0, p1)
+        rows = {World.SHAPE_CIRCLE: [], World.SHAPE_RECTANGLE: [], World.SHAPE_TRIANGLE: []}
+        for entity in candidates:
+            shape_code, row = self.shape_index[entity]
+            rows[shape_code].append(row)
+        if rows[World.SHAPE_CIRCLE]:
+            circle_rows = rows[World.SHAPE_CIRCLE]
+            hit |= segments_hit_circles(p0, p1, self.circle_centers[circle_rows], self.circle_radii[circle_rows])
+        if rows[World.SHAPE_RECTANGLE]:
+            hit |= segments_hit_boxes(p0, p1, self.boxes[rows[World.SHAPE_RECTANGLE]])
+        if rows[World.SHAPE_TRIANGLE]:
+            hit |= segments_hit_triangles(p0, p1, self.triangles[rows[World.SHAPE_TRIANGLE]])
+        return hit
+
+
+class PointBucketIndex:
+    """Incremental nearest neighbor index over 2d points, bucketing point ids into a uniform grid
+    Nearest queries search rings of buckets outwards from the query and stop once no closer point can exist"""
+
+    def __init__(self, bucket_size, capacity=1024):
+        """
+        Create an empty index
+        :param bucket_size: side length of a bucket in meters. Near queries are fastest when this is close to their radius
+        :param capacity: initial number of points to allocate room for, the arrays grow as needed
+        """
+        self.bucket_size = bucket_size
+        self.points = np.zeros((capacity, 2))
+        self.count = 0
+        self.buckets = {}  # (x bucket, y bucket) -> list of point ids
+
+    def __len__(self):
+        return self.count
+
+    def get_bucket(self, point):
+        return int(math.floor(point[0] / self.bucket_size)), int(math.floor(point[1] / self.bucket_size))
+
+    def add(self, point):
+        """Add a point and return its id, which is the number of points added before it"""
+        if self.count == len(self.points):
+            self.points = np.concatenate((self.points, np.zeros_like(self.points)))
+        point_id = self.count
+        self.points[point_id] = point
+        self.count += 1
+        bucket = self.buckets.setdefault(self.get_bucket(point), [])
+        bucket.append(point_id)
+        return point_id
+
+    def nearest(self, point):
+        """Get the id of the point closest to point, or -1 if the index is empty"""
+        if self.count == 0:
+            return -1
+        bucket_x, bucket_y = self.get_bucket(point)
+        buckets = self.buckets
+        best_id = -1
+        best_distance = math.inf
+        max_ring = len(buckets) + 1
+        # The first step looks at the 3x3 block of buckets around the query, later steps at one more ring each
+        ring = 1
+        ids = []
+        for x in range(bucket_x - 1, bucket_x + 2):
+            for y in range(bucket_y - 1, bucket_y + 2):
+                bucket = buckets.get((x, y))
+                if bucket is not None:
+                    ids.extend(bucket)
+        while True:
+            if ids:
+                offsets = self.points[ids] - point
+                distances = np.einsum('ij,ij->i', offsets, offsets)
+                closest = int(np.argmin(distances))
+                if distances[closest] < best_distance:
+                    best_distance = distances[closest]
+                    best_id = ids[closest]
+            # Every point outside this ring is at least ring bucket sizes away
+            if best_id != -1 and math.sqrt(best_distance) <= ring * self.bucket_size:
+                return best_id
+            ring += 1
+            if ring > max_ring and best_id != -1:
+                # The remaining buckets are far away, fall back to checking every point
+                offsets = self.points[:self.count] - point
+                return int(np.argmin(np.einsum('ij,ij->i', offsets, offsets)))
+            ids = []
+            for x in range(bucket_x - ring, bucket_x + ring + 1):
+                on_edge = x == bucket_x - ring or x == bucket_x + ring
+                for y in (range(bucket_y - ring, bucket_y + ring + 1) if on_edge else (bucket_y - ring, bucket_y + ring)):
+                    bucket = buckets.get((x, y))
+                    if bucket is not None:
+                        ids.extend(bucket)
+
+    def within(self, point, radius):
+        """Get an array of the ids of every point within radius of point"""
+        low_x, low_y = self.get_bucket((point[0] - radius, point[1] - radius))
+        high_x, high_y = self.get_bucket((point[0] + radius, point[1] + radius))
+        ids = []
+        for x in range(low_x, high_x + 1):
+            for y in range(low_y, high_y + 1):
+                bucket = self.buckets.get((x, y))
+                if bucket is not None:
+                    ids.extend(bucket)
+        ids = np.array(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return ids
+        offsets = self.points[ids] - point
+        return ids[np.einsum('ij,ij->i', offsets, offsets) <= radius * radius]
+
+
+class RRTStarPlanner:
+    """Continuous RRT and RRT* planning in world coordinates against the shapes of World entities"""
+
+    def __init__(self, step_size=1.0, max_samples=5000, goal_bias=0.05, goal_tolerance=None, rewire=True, seed=None, stats=None):
+        """
+        Create an RRT* planner
+        :param step_size: longest tree edge in meters
+        :param max_samples: number of random samples to draw. RRT* keeps improving the path until all of them are used
+        :param goal_bias: fraction of samples taken at the goal
+        :param goal_tolerance: tree nodes within this many meters of the goal, with a free straight line to it, connect to the goal. Defaults to step_size
+        :param rewire: if False, plain RRT is run and the first path found is returned
+        :param seed: seed for the random samples, for repeatable plans
+        :param stats: optional PlannerStats to record tree growth and phase timings in
+        """
+        self.step_size = step_size
+        self.max_samples = max_samples
+        self.goal_bias = goal_bias
+        self.goal_tolerance = step_size if goal_tolerance is None else goal_tolerance
+        self.rewire = rewire
+        self.seed = seed
+        self.stats = stats
+
+    def create_plan(self, start, end, entities, bounds):
+        """
+        Generate a path in world coordinates that avoids the shapes of the entities
+        :param start: 2d start position in meters
+        :param end: 2d goal position in meters
+        :param entities: entities to avoid, such as World.entity_list. Their current positions are used
+        :param bounds: (min_x, min_y, max_x, max_y) of the region to sample in meters
+        :return: a list of [x, y] positions which are the path from the start to the end. Returning an empty list means that no path was found.
+                 Also returns the list of tree node positions in the order they were added
+        """
+        start = np.array(start, dtype=float)
+        end = np.array(end, dtype=float)
+        stats = self.stats
+        if stats is not None:
+            stats.begin()
+
+        obstacles = ShapeObstacles(entities, cell_size=max(self.step_size * 2, 1.0))
+        if obstacles.segments_collide(start[np.newaxis], start[np.newaxis])[0] or \
+                obstacles.segments_collide(end[np.newaxis], end[np.newaxis])[0]:
+            return [],[]
+
+        rng = np.random.default_rng(self.seed)
+        min_x, min_y, max_x, max_y = bounds
+        samples = rng.random((self.max_samples, 2)) * [max_x - min_x, max_y - min_y] + [min_x, min_y]
+        samples[rng.random(self.max_samples) < self.goal_bias] = end
+        # Near radius from Karaman and Frazzoli, large enough for asymptotic optimality in 2d
+        gamma = 2.0 * math.sqrt(1.5 * (max_x - min_x) * (max_y - min_y) / math.pi)
+
+        index = PointBucketIndex(self.step_size, capacity=self.max_samples + 1)
+        index.add(start)
+        parent = [-1]
+        children = [[]]
+        cost = np.zeros(self.max_samples + 1)
+        best_goal_node = -1
+        best_goal_cost = math.inf
+        if stats is not None:
+            stats.mark('setup')
+
+        for sample in samples:
+            nearest = index.nearest(sample)
+            nearest_point = index.points[nearest]
+            offset = sample - nearest_point
+            distance = math.hypot(offset[0], offset[1])
+            if distance < 1e-9:
+                continue
+            new_point = nearest_point + offset * (self.step_size / distance) if distance > self.step_size else sample
+
+            if self.rewire:
+                n = index.count + 1
+                radius = min(gamma * math.sqrt(math.log(n) / n), self.step_size)
+                near = index.within(new_point, max(radius, 1e-9))
+                if len(near) == 0:
+                    near = np.array([nearest])
+            else:
+                near = np.array([nearest])
+
+            # Choose the cheapest collision free parent among the near nodes with one batched check
+            near_points = index.points[near]
+            near_distances = np.sqrt(np.sum((near_points - new_point) ** 2, axis=1))
+            free = ~obstacles.segments_collide(near_points, new_point[np.newaxis])
+            if not free.any():
+                continue
+            through_near = np.where(free, cost[near] + near_distances, np.inf)
+            best = int(np.argmin(through_near))
+            new_id = index.add(new_point)
+            cost[new_id] = through_near[best]
+            parent.append(int(near[best]))
+            children.append([])
+            children[near[best]].append(new_id)
+            if stats is not None:
+                stats.record_expansion(new_point[0], new_point[1], cost[new_id])
+
+            if self.rewire:
+                # Reroute near nodes through the new node where that is cheaper, then push the saving down their subtrees
+                improved = free & (cost[new_id] + near_distances < cost[near] - 1e-12)
+                for node, node_distance in zip(near[improved].tolist(), near_distances[improved].tolist()):
+                    children[parent[node]].remove(node)
+                    parent[node] = new_id
+                    children[new_id].append(node)
+                    delta = cost[new_id] + node_distance - cost[node]
+                    stack = [node]
+                    while stack:
+                        descendant = stack.pop()
+                        cost[descendant] += delta
+                        stack.extend(children[descendant])
+                if improved.any() and best_goal_node != -1:
+                    best_goal_cost = cost[best_goal_node] + math.hypot(*(end - index.points[best_goal_node]))
+
+            goal_distance = math.hypot(end[0] - new_point[0], end[1] - new_point[1])
+            if goal_distance <= self.goal_tolerance and cost[new_id] + goal_distance < best_goal_cost and \
+                    not obstacles.segments_collide(new_point[np.newaxis], end[np.newaxis])[0]:
+                best_goal_node = new_id
+                best_goal_cost = cost[new_id] + goal_distance
+                if not self.rewire:
+                    break
+
+        if stats is not None:
+            stats.nodes_pushed += index.count
+            stats.mark('search')
+        explored_points = index.points[:index.count].tolist()
+        if best_goal_node == -1:
+            return [], explored_points
+        path = [end.tolist()]
+        node = best_goal_node
+        while node != -1:
+            path.append(index.points[node].tolist())
+            node = parent[node]
+        path.reverse()
+        if path[-2] == path[-1]:
+            path.pop()
+        if stats is not None:
+            stats.mark('reconstruct')
+        return path, explored_points
+
+
+def get_obstacle_arrays(world):
+    """
+    Get the centers and sizes of every world entity as arrays, from the EntityStore when the world uses one
+    :return: (N, 2) centers, (N, 2) half extents of the bounding boxes and an (N,) boolean array that is True for circles,
+             whose half extents are both the radius
+    """
+    if world.entity_store is not None:
+        store = world.entity_store
+        is_circle = store.shape_codes == World.SHAPE_CIRCLE
+        half_extents = np.where(is_circle[:, np.newaxis], store.shape_params, store.shape_params / 2.0)
+        return store.positions, half_extents, is_circle
+    boxes = np.array([entity.get_bounding_box() for entity in world.entity_list], dtype=float).reshape(-1, 4)
+    is_circle = np.array([isinstance(entity, World.Circle) for entity in world.entity_list], dtype=bool)
+    return (boxes[:, :2] + boxes[:, 2:]) / 2.0, (boxes[:, 2:] - boxes[:, :2]) / 2.0, is_circle
+
+
+class PotentialFieldPlanner:
+    """Reactive local planner that steers many agents at once with attractive and repulsive potential field forces
+    Circles repel from their surface and every other shape from its bounding box. Only obstacles within the cutoff
+    distance of an agent push on it"""
+
+    def __init__(self, attractive_gain=1.0, repulsive_gain=10.0, cutoff_distance=5.0, damping=1.0, max_acc=10.0, agent_radius=0.0,
+                 tile_factor=4):
+        """
+        Create a potential field planner
+        :param attractive_gain: acceleration per meter of distance to the goal
+        :param repulsive_gain: strength of the obstacle repulsion
+        :param cutoff_distance: obstacles further than this many meters from an agent's edge are ignored
+        :param damping: acceleration per meter/second of agent velocity opposing the motion, to stop agents oscillating
+        :param max_acc: longest acceleration vector returned
+        :param agent_radius: radius of the agents in meters, distances are measured from their edge
+        :param tile_factor: agents are batched in square tiles this many cutoff distances wide, each only broadcast against the obstacles near it
+        """
+        self.attractive_gain = attractive_gain
+        self.repulsive_gain = repulsive_gain
+        self.cutoff_distance = cutoff_distance
+        self.damping = damping
+        self.max_acc = max_acc
+        self.agent_radius = agent_radius
+        self.tile_factor = tile_factor
+
+    def compute_accelerations(self, positions, goals, world, velocities=None):
+        """
+        Compute the commanded acceleration of a batch of agents in one broadcast over agents and nearby obstacles
+        :param positions: (A, 2) agent positions in meters
+        :param goals: (A, 2) goal positions, or a single goal shared by every agent
+        :param world: World whose entities are the obstacles
+        :param velocities: optional (A, 2) agent velocities for damping
+        :return: (A, 2) array of accelerations
+        """
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        acc = self.attractive_gain * (np.asarray(goals, dtype=float) - positions)
+        if velocities is not None:
+            acc -= self.damping * np.asarray(velocities, dtype=float)
+
+        centers, half_extents, is_circle = get_obstacle_arrays(world)
+        if len(centers) and len(positions):
+            # Agents are grouped into tiles a few cutoff distances wide. Only obstacles that can be within the cutoff of
+            # some agent in a tile take part in that tile's broadcast
+            reach = self.cutoff_distance + self.agent_radius
+            obstacle_low = centers - half_extents
+            obstacle_high = centers + half_extents
+            tiles = np.floor(positions / (self.tile_factor * reach)).astype(np.int64)
+            _, tile_of_agent = np.unique(tiles, axis=0, return_inverse=True)
+            tile_of_agent = tile_of_agent.reshape(-1)
+            order = np.argsort(tile_of_agent, kind='stable')
+            boundaries = np.flatnonzero(np.diff(tile_of_agent[order])) + 1
+            for agents in np.split(order, boundaries):
+                tile_positions = positions[agents]
+                low = tile_positions.min(axis=0) - reach
+                high = tile_positions.max(axis=0) + reach
+                nearby = np.all((obstacle_high > low) & (obstacle_low < high), axis=1)
+                if nearby.any():
+                    acc[agents] += self.compute_repulsion(tile_positions, centers[nearby], half_extents[nearby], is_circle[nearby])
+
+        norms = np.sqrt(np.sum(acc * acc, axis=1))
+        too_large = norms > self.max_acc
+        acc[too_large] *= (self.max_acc / norms[too_large])[:, np.newaxis]
+        return acc
+
+    def compute_repulsion(self, positions, centers, half_extents, is_circle):
+        """Sum the repulsive accelerations of obstacles on agents with (A, N) broadcasting"""
+        offset = positions[:, np.newaxis, :] - centers[np.newaxis, :, :]
+        center_distance = np.sqrt(np.sum(offset * offset, axis=2))
+
+        # Vector from the closest point of each obstacle to each agent
+        box_away = np.sign(offset) * np.maximum(np.abs(offset) - half_extents, 0)
+        circle_scale = np.where(center_distance > 0, 1 - half_extents[np.newaxis, :, 0] / np.maximum(center_distance, 1e-12), 0)
+        away = np.where(is_circle[np.newaxis, :, np.newaxis], offset * circle_scale[:, :, np.newaxis], box_away)
+        surface_distance = np.sqrt(np.sum(away * away, axis=2))
+        inside = np.where(is_circle, center_distance <= half_extents[:, 0], np.all(np.abs(offset) <= half_extents, axis=2))
+        # Agents inside an obstacle are pushed straight out from its center
+        away = np.where(inside[:, :, np.newaxis], offset, away)
+        direction = away / np.maximum(np.sqrt(np.sum(away * away, axis=2)), 1e-12)[:, :, np.newaxis]
+
+        distance = np.maximum(np.where(inside, 0, surface_distance) - self.agent_radius, 1e-3)
+        magnitude = np.where(distance < self.cutoff_distance,
+                             self.repulsive_gain * (1.0 / distance - 1.0 / self.cutoff_distance) / (distance * distance), 0)
+        return np.sum(magnitude[:, :, np.newaxis] * direction, axis=1)
+
+    def update_swarm(self, swarm, goals, world):
+        """Compute accelerations for every agent of an Agent.AgentSwarm straight from its arrays and command them in one call"""
+        swarm.set_accelerations(self.compute_accelerations(swarm.positions, goals, world, swarm.velocities))
+
+    def update_agents(self, agents, goals, world):
+        """Compute accelerations for a list of Agents and command them with Agent.set_acc"""
+        positions = np.array([agent.get_pos() for agent in agents], dtype=float).reshape(-1, 2)
+        velocities = np.array([agent.get_vel() for agent in agents], dtype=float).reshape(-1, 2)
+        for agent, acc in zip(agents, self.compute_accelerations(positions, goals, world, velocities)):
+            agent.set_acc(acc)
+
+
+# Moves in angular order, so the two moves next to a move in the list are the ones it slips into
+FOUR_CONNECTED_RING = ((0, 1, 1.0), (1, 0, 1.0), (0, -1, 1.0), (-1, 0, 1.0))
+EIGHT_CONNECTED_RING = ((0, 1, 1.0), (1, 1, SQRT2), (1, 0, 1.0), (1, -1, SQRT2),
+                        (0, -1, 1.0), (-1, -1, SQRT2), (-1, 0, 1.0), (-1, 1, SQRT2))
+
+
+def shift_into(array, d_row, d_col, fill):
+    """Get an array where entry [r, c] is array[r + d_row, c + d_col], or fill where that is outside the array"""
+    n_rows, n_cols = array.shape
+    shifted = np.full_like(array, fill)
+    shifted[max(-d_row, 0):n_rows - max(d_row, 0), max(-d_col, 0):n_cols - max(d_col, 0)] = \
+        array[max(d_row, 0):n_rows - max(-d_row, 0), max(d_col, 0):n_cols - max(-d_col, 0)]
+    return shifted
+
+
+class MDPPlanner:
+    """Value iteration over an occupancy grid treated as a Markov decision process with slippery moves
+    Each move costs its step length. With probability slip_probability the agent moves in one of the two directions next
+    to the intended one instead, and a move into a blocked cell or off the grid leaves the agent where it was. Bellman backups
+    are done a whole diagonal, row or column of cells at a time, and later calls with the same goal warm start from the
+    previous value function so small grid changes only need a few sweeps
+
+    Without slipping a sweep carries a value across the whole grid. A slipped move can go back against the sweep, so with
+    slipping each sweep only settles the values a few cells (about 2 / slip_probability) further from the goal. The number of
+    sweeps then grows with the grid width and the run time with its cube. A cold solve of a 1024 x 1024 cluttered grid with
+    slip_probability=0.2 takes about 700 sweeps and 40 s, and blocking one cell near the goal takes about two thirds of that
+    to repair, see the mdp benchmark cases. Large slippery grids are better planned on a coarser grid"""
+
+    def __init__(self, connection_type='four', slip_probability=0.0, discount=1.0, tolerance=1e-6, max_iterations=100000,
+                 stats=None):
+        """
+        Create an MDP planner
+        :param connection_type: 'four' or 'eight' connected grid moves
+        :param slip_probability: chance that a move goes to one of the two neighboring directions instead, split evenly
+        :param discount: discount factor applied to the value of the next cell
+        :param tolerance: value iteration stops once no value changes by more than this in a sweep
+        :param max_iterations: upper limit on the number of sweeps per call
+        :param stats: optional PlannerStats to record sweeps and phase timings in
+        """
+        if not 0 <= slip_probability < 1:
+            raise ValueError('Slip probability must be in [0, 1)')
+        if not 0 < discount <= 1:
+            raise ValueError('Discount must be in (0, 1]')
+        self.connection_type = connection_type
+        self.slip_probability = slip_probability
+        self.discount = discount
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+        self.stats = stats
+        self.values = None
+        self.shortest = None
+        self.blocked = None
+        self.goal = None
+        self.iterations = 0
+
+    def get_moves(self):
+        if self.connection_type == 'four':
+            return FOUR_CONNECTED_RING
+        elif self.connection_type == 'eight':
+            return EIGHT_CONNECTED_RING
+        else:
+            raise ValueError('Unknown connection type '+str(self.connection_type))
+
+    def get_q_values(self, values, free):
+        """Get the expected cost of every move from every cell as an (n_moves, rows, cols) array"""
+        moves = self.get_moves()
+        n_moves = len(moves)
+        # Value of the cell each move ends in, which is the current cell when the move is blocked
+        landing = np.empty((n_moves,) + values.shape)
+        for k, (d_row, d_col, _) in enumerate(moves):
+            landing[k] = np.where(shift_into(free, d_row, d_col, False), shift_into(values, d_row, d_col, np.inf), values)
+        side = self.slip_probability / 2.0
+        q_values = np.empty_like(landing)
+        for k, (_, _, step_cost) in enumerate(moves):
+            expected = (1 - self.slip_probability) * landing[k]
+            if side > 0:
+                expected = expected + side * (landing[(k - 1) % n_moves] + landing[(k + 1) % n_moves])
+            q_values[k] = step_cost + self.discount * expected
+        return q_values
+
+    def get_sweep_orders(self, shape):
+        """
+        Get the orders that sweeps visit the cells of a padded grid in. Cells are grouped into levels so that every move
+        goes from one level to the next or previous one, which lets a whole level be backed up at once and lets a value
+        travel across the grid in one sweep. Four connected moves use the diagonals, since a path made of steps down and
+        right goes straight along the anti-diagonals, and eight connected moves use rows and columns
+        :param shape: shape of the padded grid
+        :return: list of (level ids, list of flat index arrays for each level) for each order
+        """
+        rows, cols = np.indices(shape)
+        interior = (rows > 0) & (rows < shape[0] - 1) & (cols > 0) & (cols < shape[1] - 1)
+        if self.connection_type == 'four':
+            keys = (rows + cols, rows - cols)
+        else:
+            keys = (rows, cols)
+        orders = []
+        for key in keys:
+            key = (key - key[interior].min()).ravel()
+            key[~interior.ravel()] = -1
+            cells = np.flatnonzero(interior)
+            cells = cells[np.argsort(key[cells], kind='stable')]
+            levels = np.split(cells, np.flatnonzero(np.diff(key[cells])) + 1)
+            orders.append((key, levels))
+            orders.append((key, levels[::-1]))
+        return orders
+
+    def sweep_levels(self, values, free, active, level_ids, levels, width, slip_probability):
+        """
+        Do one Gauss-Seidel pass of Bellman backups over the levels of a padded grid in order, backing up each level at once
+        :param values: flattened padded array of values, updated in place
+        :param free: flattened padded boolean array of free cells, False on the border
+        :param active: flattened padded boolean array of the cells that changed in the previous pass
+        :param level_ids: flattened padded array of the level of each cell, -1 on the border
+        :param levels: flat index arrays of the cells to back up at each level, in sweep order
+        :param width: number of columns in the padded grid
+        :param slip_probability: chance that a move goes to one of the two neighboring directions instead
+        :return: flattened padded boolean array of the cells whose value changed by more than the tolerance, and the total
+                 change of those values
+        """
+        moves = self.get_moves()
+        n_moves = len(moves)
+        side = slip_probability / 2.0
+        offsets = [d_row * width + d_col for d_row, d_col, _ in moves]
+        changed = np.zeros_like(active)
+        total_change = 0.0
+        active_levels = np.zeros(level_ids.max() + 3, dtype=bool)
+        active_levels[level_ids[active] + 1] = True
+        changed_levels = np.zeros_like(active_levels)
+        landing = [None] * n_moves
+        for cells in levels:
+            level = level_ids[cells[0]] + 1
+            # A level only needs a backup when a level it depends on has changed since its last backup
+            if not (active_levels[level - 1:level + 2].any() or changed_levels[level - 1] or changed_levels[level + 1]):
+                continue
+            old = values[cells]
+            for k, offset in enumerate(offsets):
+                targets = cells + offset
+                landing[k] = np.where(free[targets], values[targets], old)
+            new = None
+            for k, (_, _, step_cost) in enumerate(moves):
+                expected = landing[k]
+                if side > 0:
+                    expected = (1 - slip_probability) * expected + \
+                        side * (landing[(k - 1) % n_moves] + landing[(k + 1) % n_moves])
+                q_value = step_cost + self.discount * expected
+                new = q_value if new is None else np.minimum(new, q_value)
+            moved = (new != old) & ~(np.abs(new - old) <= self.tolerance)
+            values[cells] = new
+            if moved.any():
+                total_change += float(np.abs(new - old)[moved].sum())
+                changed[cells[moved]] = True
+                changed_levels[level] = True
+        return changed, total_change
+
+    def run_sweeps(self, values, free, active, goal, slip_probability, max_iterations):
+        """
+        Sweep the grid until no value changes by more than the tolerance. After trying every order once, each sweep uses
+        the order whose last sweep changed the values the most. With slipping a value only travels a few cells against the
+        sweep direction, so the order running outwards from the goal does most of the work and is picked far more often
+        :param values: padded 2d array of values, updated in place
+        :param free: padded 2d boolean array of free cells, False on the border
+        :param active: padded 2d boolean array of the cells whose value is new
+        :param goal: 2d grid coordinates of the goal cell
+        :param slip_probability: chance that a move goes to one of the two neighboring directions instead
+        :param max_iterations: upper limit on the number of sweeps
+        :return: number of sweeps done
+        """
+        # Blocked cells and the goal keep their values, so they are left out of the sweeps
+        fixed = ~free.ravel()
+        fixed[(1 + goal[0]) * values.shape[1] + 1 + goal[1]] = True
+        orders = [(level_ids, [cells[~fixed[cells]] for cells in levels])
+                  for level_ids, levels in self.get_sweep_orders(values.shape)]
+        orders = [(level_ids, [cells for cells in levels if len(cells) > 0]) for level_ids, levels in orders]
+        flat_values = values.ravel()
+        flat_free = free.ravel()
+        flat_active = active.ravel()
+        iterations = 0
+        progress = [np.inf] * len(orders)
+        with np.errstate(invalid='ignore'):
+            while flat_active.any() and iterations < max_iterations:
+                order = iterations if iterations < len(orders) else int(np.argmax(progress))
+                level_ids, levels = orders[order]
+                flat_active, progress[order] = self.sweep_levels(flat_values, flat_free, flat_active, level_ids, levels,
+                                                                 values.shape[1], slip_probability)
+                iterations += 1
+        return iterations
+
+    def solve(self, goal, grid):
+        """
+        Run value iteration until the values of every cell settle. The values without slipping are found first, starting
+        from infinity everywhere but the goal. When moves can slip those are a lower bound, and they are used as the start
+        for a second round of sweeps with slipping, since sweeps with slipping cannot move on from infinite values
+        :param goal: 2d grid coordinates of the goal cell
+        :param grid: OccupancyGrid where 0 is free space and 1 is blocked space
+        :return: array of the expected cost to reach the goal from each cell, inf where the goal cannot be reached
+        """
+        goal = (int(goal[0]), int(goal[1]))
+        blocked = np.array(grid.grid, dtype=bool)
+        n_rows, n_cols = blocked.shape
+        free = np.zeros((n_rows + 2, n_cols + 2), dtype=bool)
+        free[1:-1, 1:-1] = ~blocked
+        values = np.full((n_rows + 2, n_cols + 2), np.inf)
+        active = np.zeros_like(free)
+
+        warm = self.values is not None and self.goal == goal and self.values.shape == blocked.shape
+        if warm:
+            # Freeing cells can only lower values, so the old values are still upper bounds. Blocking a cell can raise the
+            # value of any cell that relied on it, and those all had a value at least as high as it did
+            changed = blocked != self.blocked
+            if not changed.any():
+                self.iterations = 0
+                return self.values
+            previous = self.shortest.copy()
+            newly_blocked = changed & blocked
+            reset = np.zeros_like(blocked)
+            if newly_blocked.any():
+                reset = self.values >= self.values[newly_blocked].min()
+                previous[reset | (self.shortest >= self.shortest[newly_blocked].min())] = np.inf
+            previous[blocked] = np.inf
+            values[1:-1, 1:-1] = previous
+            active[1:-1, 1:-1] = changed | (previous != self.shortest)
+        else:
+            active[1 + goal[0], 1 + goal[1]] = True
+        values[1 + goal[0], 1 + goal[1]] = 0.0
+        iterations = self.run_sweeps(values, free, active, goal, 0.0, self.max_iterations)
+        shortest = values[1:-1, 1:-1].copy()
+
+        if self.slip_probability > 0:
+            if warm:
+                # Blocking cells only raises values and freeing cells only lowers them, so the old values are a close start
+                # either way, and a lower bound at least as tight as the values without slipping when cells were only
+                # blocked. Value iteration settles from any finite start, so a change that does both is fine too
+                seed = np.where(np.isfinite(self.values), np.maximum(self.values, shortest), shortest)
+                seed[~np.isfinite(shortest)] = np.inf
+                values[1:-1, 1:-1] = seed
+                values[1 + goal[0], 1 + goal[1]] = 0.0
+                active[1:-1, 1:-1] = values[1:-1, 1:-1] != self.values
+            else:
+                active[1:-1, 1:-1] = np.isfinite(shortest)
+            iterations += self.run_sweeps(values, free, active, goal, self.slip_probability,
+                                          self.max_iterations - iterations)
+
+        self.values = values[1:-1, 1:-1].copy()
+        self.shortest = shortest
+        self.blocked = blocked
+        self.goal = goal
+        self.iterations = iterations
+        return self.values
+
+    def extract_policy(self, values, grid):
+        """Get the index into get_moves() of the best move from every cell, -1 where the goal cannot be reached"""
+        free = ~np.array(grid.grid, dtype=bool)
+        q_values = self.get_q_values(values, free)
+        policy = np.argmin(q_values, axis=0)
+        policy[~np.isfinite(values)] = -1
+        return policy
+
+    def create_plan(self, start, end, grid):
+        """
+        Generate a path by following the optimal policy of the MDP from the start, taking the intended move at every step
+        :param start: 2d grid coordinates of start location
+        :param end: 2d grid coordinates of end location
+        :param grid: OccupancyGrid where 0 is free space and 1 is blocked space
+        :return: a list of coordinates which are the path from the start to the end. Returning an empty list means that no path was found.
+                 Also returns an empty explored list, since value iteration updates every cell at once
+        """
+        require_uniform_costs(grid, 'MDP')
+
+        # Ensure start and end are numpy arrays
+        start = np.array(start)
+        end = np.array(end)
+
+        # If start or end is blocked, there is no feasible path
+        if grid.is_blocked(start) or grid.is_blocked(end):
+            return [],[]
+
+        # If the start position and the end are the same point, return that point as the path
+        if np.all(start == end):
+            return start,[]
+
+        stats = self.stats
+        if stats is not None:
+            stats.begin()
+        values = self.solve(end, grid)
+        if stats is not None:
+            stats.nodes_expanded += self.iterations
+            stats.mark('solve')
+        if not np.isfinite(values[start[0], start[1]]):
+            return [],[]
+
+        moves = self.get_moves()
+        policy = self.extract_policy(values, grid)
+        n_rows, n_cols = values.shape
+        row, col = int(start[0]), int(start[1])
+        path = [[row, col]]
+        visited = {(row, col)}
+        while row != end[0] or col != end[1]:
+            d_row, d_col, _ = moves[policy[row, col]]
+            row += d_row
+            col += d_col
+            # The intended move of an optimal policy always makes progress, so a blocked move or a loop means no path
+            if row < 0 or row >= n_rows or col < 0 or col >= n_cols or grid.grid[row, col] or (row, col) in visited:
+                return [],[]
+            visited.add((row, col))
+            path.append([row, col])
+        if stats is not None:
+            stats.mark('extract')
+        return path, []
+
+
+def get_heading_angle(heading, n_headings):
+    """Angle in radians of a heading index, counterclockwise from the +column direction with rows increasing downward"""
+    return 2 * math.pi * heading / n_headings
+
+
+def find_turn(start_angle, end_angle, end_x, end_y):
+    """
+    Find the arc followed by a straight segment that goes from the origin at start_angle to (end_x, end_y) at end_angle
+    :return: signed turning radius (positive for left turns) and straight segment length, or None if there is no such path
+    """
+    # The arc end is linear in the signed radius, so the radius and the straight length solve a 2x2 linear system
+    a = math.sin(end_angle) - math.sin(start_angle)
+    b = math.cos(end_angle)
+    c = math.cos(start_angle) - math.cos(end_angle)
+    d = math.sin(end_angle)
+    determinant = a * d - b * c
+    if abs(determinant) < 1e-12:
+        return None
+    radius = (d * end_x - b * end_y) / determinant
+    straight = (a * end_y - c * end_x) / determinant
+    return radius, straight
+
+
+def sample_turn(start_angle, end_angle, radius, straight, spacing):
+    """Sample [x, y, angle] poses about spacing apart along an arc of the given signed radius followed by a straight segment"""
+    turn = end_angle - start_angle
+    n_arc = int(math.ceil(abs(radius * turn) / spacing))
+    angles = start_angle + turn * np.arange(n_arc + 1) / max(n_arc, 1)
+    poses = [[radius * (math.sin(angle) - math.sin(start_angle)),
+              radius * (math.cos(start_angle) - math.cos(angle)), angle] for angle in angles]
+    n_straight = int(math.ceil(straight / spacing))
+    arc_x, arc_y = poses[-1][0], poses[-1][1]
+    for i in range(1, n_straight + 1):
+        distance = straight * i / n_straight
+        poses.append([arc_x + distance * math.cos(end_angle), arc_y + distance * math.sin(end_angle), end_angle])
+    return poses
+
+
+def create_motion_primitives(turning_radius=2.0, n_headings=8, spacing=0.25):
+    """
+    Build a basic motion primitive set for a vehicle that cannot turn in place: for every heading, one straight move to the
+    next cell along the heading and the shortest left and right turns to the neighboring headings that end on a cell
+    :param turning_radius: smallest turning radius of the vehicle in cells
+    :param n_headings: number of headings, 4 or 8, since straight moves must end on a cell
+    :param spacing: distance in cells between the poses sampled along each primitive
+    :return: motion primitive set in the format read by load_motion_primitives
+    """
+    if n_headings not in (4, 8):
+        raise ValueError('Motion primitives can only be created for 4 or 8 headings')
+    if turning_radius <= 0:
+        raise ValueError('Turning radius must be positive')
+    max_offset = int(math.ceil(2 * turning_radius)) + 2
+    primitives = []
+    for heading in range(n_headings):
+        start_angle = get_heading_angle(heading, n_headings)
+        # Straight moves go to the neighboring cell, which is diagonal for the odd headings of an 8 heading set
+        direction = np.array([math.cos(start_angle), math.sin(start_angle)])
+        end_x, end_y = np.rint(direction / np.abs(direction).max()).astype(int).tolist()
+        poses = sample_turn(start_angle, start_angle, 0.0, math.hypot(end_x, end_y), spacing)
+        primitives.append((heading, end_x, end_y, heading, math.hypot(end_x, end_y), poses))
+        for turn in (1, -1):
+            end_heading = (heading + turn) % n_headings
+            end_angle = start_angle + turn * 2 * math.pi / n_headings
+            best = None
+            for end_x in range(-max_offset, max_offset + 1):
+                for end_y in range(-max_offset, max_offset + 1):
+                    solution = find_turn(start_angle, end_angle, end_x, end_y)
+                    if solution is None:
+                        continue
+                    radius, straight = solution
+                    if radius * turn < turning_radius - 1e-9 or straight < -1e-9:
+                        continue
+                    length = abs(radius) * 2 * math.pi / n_headings + max(straight, 0.0)
+                    if best is None or length < best[0] - 1e-9:
+                        best = (length, end_x, end_y, radius, max(straight, 0.0))
+            length, end_x, end_y, radius, straight = best
+            poses = sample_turn(start_angle, end_angle, radius, straight, spacing)
+            primitives.append((heading, end_x, end_y, end_heading, length, poses))
+
+    # Primitives are stored in grid offsets, where a positive y offset is a move up to a lower row
+    return {'Headings': n_headings,
+            'Primitives': [{'StartHeading': heading,
+                            'End': [-end_y, end_x, end_heading],
+                            'Cost': length,
+                            'Poses': [[-y, x, angle] for x, y, angle in poses]}
+                           for heading, end_x, end_y, end_heading, length, poses in primitives]}
+
+
+def save_motion_primitives(primitive_data, file):
+    """Write a motion primitive set to a JSON file"""
+    with open(file, 'w') as f:
+        json.dump(primitive_data, f, indent=2)
+
+
+def load_motion_primitives(file, footprint_radius=0.0):
+    """Read a motion primitive set from a JSON file, see MotionPrimitiveTable for the format"""
+    with open(file) as f:
+        return MotionPrimitiveTable(json.load(f), footprint_radius)
+
+
+def get_swept_cells(points, footprint_radius):
+    """
+    Get the cells covered by a disc of the footprint radius centered on any of the points
+    :param points: (N, 2) array of [row, col] offsets in cells, where cell [0, 0] is centered on the origin
+    :param footprint_radius: radius of the vehicle in cells, 0 for a point
+    :return: (M, 2) array of unique [row, col] cell offsets
+    """
+    if footprint_radius <= 0:
+        return np.unique(np.floor(points + 0.5).astype(np.int64), axis=0)
+    reach = int(math.ceil(footprint_radius)) + 1
+    d_row, d_col = np.meshgrid(np.arange(-reach, reach + 1), np.arange(-reach, reach + 1), indexing='ij')
+    centers = np.floor(points + 0.5).astype(np.int64)
+    cells = centers[:, np.newaxis, :] + np.stack([d_row.ravel(), d_col.ravel()], axis=1)[np.newaxis]
+    # Distance from each point to the nearest point of each cell square
+    gap = np.maximum(np.abs(cells - points[:, np.newaxis, :]) - 0.5, 0.0)
+    covered = np.sum(gap * gap, axis=2) <= footprint_radius * footprint_radius
+    return np.unique(cells[covered], axis=0)
+
+
+def get_swept_path_cost(cells, d_row, d_col):
+    """
+    Get the eight connected shortest path cost from the start cell to the end cell of a primitive through its swept cells
+    :param cells: (M, 2) array of swept [row, col] cell offsets, as returned by get_swept_cells
+    :return: the path cost, or inf if the swept cells do not join the start to the end
+    """
+    origin = cells.min(axis=0)
+    n_rows, n_cols = cells.max(axis=0) - origin + 1
+    blocked = np.ones(n_rows * n_cols, dtype=bool)
+    blocked[(cells[:, 0] - origin[0]) * n_cols + cells[:, 1] - origin[1]] = False
+    start_index = int(-origin[0] * n_cols - origin[1])
+    end_index = int((d_row - origin[0]) * n_cols + d_col - origin[1])
+    cost, _ = compute_cost_to_go(blocked, int(n_cols), start_index, EIGHT_CONNECTED_OFFSETS, targets=[end_index])
+    return float(cost[end_index])
+
+
+class MotionPrimitiveTable:
+    """Motion primitives grouped by start heading, with the cells each one sweeps precomputed so that checking all the
+    primitives from a state for collisions is one lookup into the occupancy grid
+
+    The primitive set is a dict (usually loaded from JSON) with 'Headings', the number of evenly spaced headings, and
+    'Primitives', a list of primitives that each have:
+      'StartHeading': heading index the primitive starts from
+      'End': [row offset, column offset, end heading index] of the end state
+      'Cost': optional cost of the primitive, defaults to its length in cells
+      'Poses': optional list of [row offset, column offset, angle] poses along the primitive, used for the swept cells.
+               Defaults to a straight line from the start to the end
+    Heading index k points along the angle 2 * pi * k / Headings, counterclockwise from the +column direction
+    A turn can cost less than the eight connected grid path to its end cell, so heuristic_scale holds the lowest ratio of
+    primitive cost to that grid path cost, at most 1, for LatticePlanner to keep its heuristic admissible"""
+
+    def __init__(self, primitive_data, footprint_radius=0.0, spacing=0.25):
+        """
+        Create a motion primitive table
+        :param primitive_data: motion primitive set, see the class description
+        :param footprint_radius: radius of the vehicle in cells, every cell it touches along a primitive must be free
+        :param spacing: largest distance in cells between poses when filling in gaps before finding the swept cells
+        """
+        self.n_headings = int(primitive_data['Headings'])
+        if self.n_headings <= 0:
+            raise ValueError('Motion primitive set must have at least one heading')
+        self.footprint_radius = footprint_radius
+        self.heuristic_scale = 1.0
+        grouped = [[] for _ in range(self.n_headings)]
+        for primitive in primitive_data['Primitives']:
+            start_heading = int(primitive['StartHeading'])
+            d_row, d_col, end_heading = (int(value) for value in primitive['End'])
+            if not (0 <= start_heading < self.n_headings and 0 <= end_heading < self.n_headings):
+                raise ValueError('Motion primitive heading out of range: '+str(primitive))
+            if d_row == 0 and d_col == 0:
+                raise ValueError('Motion primitives must move to another cell: '+str(primitive))
+            if 'Poses' in primitive:
+                poses = np.array(primitive['Poses'], dtype=float)[:, :2]
+            else:
+                poses = np.array([[0.0, 0.0], [d_row, d_col]])
+            if not (np.allclose(poses[0], 0) and np.allclose(poses[-1], [d_row, d_col])):
+                raise ValueError('Motion primitive poses must run from the start cell to the end cell: '+str(primitive))
+            # Fill in long gaps so that no swept cell is skipped between poses
+            points = [poses[:1]]
+            for p0, p1 in zip(poses[:-1], poses[1:]):
+                n_steps = max(int(math.ceil(np.hypot(*(p1 - p0)) / spacing)), 1)
+                points.append(p0 + (p1 - p0) * (np.arange(1, n_steps + 1) / n_steps)[:, np.newaxis])
+            points = np.concatenate(points)
+            cost = float(primitive.get('Cost', np.sum(np.hypot(*np.diff(points, axis=0).T))))
+            cells = get_swept_cells(points, footprint_radius)
+            # A grid path through the swept cells is no shorter than an eight connected shortest path, so scaling those
+            # costs by the lowest cost to swept path ratio never overestimates the cost of a sequence of primitives
+            swept_cost = get_swept_path_cost(cells, d_row, d_col)
+            if swept_cost == np.inf:
+                # Only possible for poses that jump between cells, fall back to the open space distance
+                swept_cost = max(abs(d_row), abs(d_col)) + (math.sqrt(2) - 1) * min(abs(d_row), abs(d_col))
+            self.heuristic_scale = min(self.heuristic_scale, cost / swept_cost)
+            full_poses = np.array(primitive.get('Poses', poses), dtype=float)
+            grouped[start_heading].append((d_row, d_col, end_heading, cost, cells, full_poses))
+
+        self.end_rows = []
+        self.end_cols = []
+        self.end_headings = []
+        self.costs = []
+        self.swept_rows = []
+        self.swept_cols = []
+        self.poses = []
+        self.primitive_index = {}
+        self.max_extent = 0
+        for heading, primitives in enumerate(grouped):
+            self.end_rows.append(np.array([p[0] for p in primitives], dtype=np.int64))
+            self.end_cols.append(np.array([p[1] for p in primitives], dtype=np.int64))
+            self.end_headings.append(np.array([p[2] for p in primitives], dtype=np.int64))
+            self.costs.append(np.array([p[3] for p in primitives], dtype=float))
+            self.poses.append([p[5] for p in primitives])
+            # Pad every primitive to the same number of swept cells by repeating its start cell
+            n_cells = max([len(p[4]) for p in primitives], default=0)
+            swept = np.zeros((len(primitives), n_cells, 2), dtype=np.int64)
+            for k, primitive in enumerate(primitives):
+                swept[k, :len(primitive[4])] = primitive[4]
+                self.primitive_index[(heading, primitive[0], primitive[1], primitive[2])] = k
+            self.swept_rows.append(swept[:, :, 0])
+            self.swept_cols.append(swept[:, :, 1])
+            if swept.size:
+                self.max_extent = max(self.max_extent, int(np.abs(swept).max()))
+
+    def get_valid_primitives(self, padded_blocked, row, col, heading):
+        """
+        Get a boolean array of the primitives from a state that only sweep free cells
+        :param padded_blocked: blocked grid padded on every side by max_extent blocked cells
+        :param row: row of the state in the unpadded grid
+        :param col: column of the state in the unpadded grid
+        :param heading: heading index of the state
+        """
+        rows = self.swept_rows[heading] + (row + self.max_extent)
+        cols = self.swept_cols[heading] + (col + self.max_extent)
+        return ~padded_blocked[rows, cols].any(axis=1)
+
+    def get_poses(self, path):
+        """
+        Get the poses along a lattice path
+        :param path: list of [row, col, heading] states as returned by LatticePlanner.create_plan
+        :return: (N, 3) array of [row, col, angle] poses, with the angle in radians
+        """
+        poses = [np.array([[path[0][0], path[0][1], get_heading_angle(path[0][2], self.n_headings)]], dtype=float)]
+        for (row, col, heading), (next_row, next_col, next_heading) in zip(path[:-1], path[1:]):
+            k = self.primitive_index[(heading, next_row - row, next_col - col, next_heading)]
+            primitive_poses = self.poses[heading][k]
+            if primitive_poses.shape[1] < 3:
+                # Primitives without poses are straight lines, so they keep the start heading until the end
+                angles = np.full((len(primitive_poses), 1), get_heading_angle(heading, self.n_headings))
+                primitive_poses = np.hstack([primitive_poses, angles])
+            poses.append(primitive_poses[1:] + [row, col, 0.0])
+        return np.concatenate(poses)
+
+
+class LatticePlanner:
+    """A* over (row, col, heading) states connected by motion primitives, for vehicles that cannot turn in place
+    The heuristic is the eight connected shortest path cost to the goal around obstacles, ignoring the heading, scaled by
+    the heuristic_scale of the primitive table so that it never overestimates. It is found with an MDPPlanner sweep over the
+    whole grid and cached by goal and grid contents, and a new grid with the same goal warm starts from the last table"""
+
+    def __init__(self, primitives, heuristic_weight=1.0, heuristic_cache_size=8, record_explored=True, stats=None):
+        """
+        Create a lattice planner
+        :param primitives: MotionPrimitiveTable, see load_motion_primitives and create_motion_primitives
+        :param heuristic_weight: factor the heuristic is multiplied by. At 1 the path is the lowest cost one. Values above 1
+                                 expand far fewer states on large grids, at the price of paths that can cost up to that factor
+                                 more than the best one
+        :param heuristic_cache_size: number of heuristic tables to keep
+        :param record_explored: if False, the explored list returned by create_plan is left empty to save time and memory
+        :param stats: optional PlannerStats to record expansions, queue pushes and phase timings in
+        """
+        self.primitives = primitives
+        self.heuristic_weight = heuristic_weight
+        self.heuristic_cache_size = heuristic_cache_size
+        self.heuristic_cache = OrderedDict()
+        self.heuristic_planner = MDPPlanner('eight')
+        self.record_explored = record_explored
+        self.stats = stats
+
+    def get_heuristic(self, end, grid):
+        """Get the table of eight connected shortest path costs from every cell to the end cell, inf where it cannot be reached"""
+        key = (int(end[0]), int(end[1]), grid.grid.shape,
+               hashlib.blake2b(np.ascontiguousarray(grid.grid).view(np.uint8), digest_size=16).digest())
+        table = self.heuristic_cache.get(key)
+        if table is not None:
+            self.heuristic_cache.move_to_end(key)
+            return table
+        table = self.heuristic_planner.solve(end, grid)
+        self.heuristic_cache[key] = table
+        if len(self.heuristic_cache) > self.heuristic_cache_size:
+            self.heuristic_cache.popitem(last=False)
+        return table
+
+    def create_plan(self, start, end, grid):
+        """
+        Generate a sequence of motion primitives through the occupancy grid that avoids obstacles
+        :param start: [row, col, heading index] start state
+        :param end: [row, col] goal cell reached with any heading, or [row, col, heading index] goal state
+        :param grid: OccupancyGrid where 0 is free space and 1 is blocked space
+        :return: a list of [row, col, heading] states at the ends of the primitives, from the start to the end. Returning an
+                 empty list means that no path was found. Also returns the list of explored states in the order they were
+                 expanded (empty if record_explored is False)
+        """
+        require_uniform_costs(grid, 'Lattice')
+        table = self.primitives
+        n_headings = table.n_headings
+
+        # Ensure start and end are numpy arrays
+        start = np.array(start)
+        end = np.array(end)
+        if not (0 <= start[2] < n_headings) or (len(end) > 2 and not 0 <= end[2] < n_headings):
+            raise ValueError('Heading out of range for '+str(n_headings)+' headings')
+
+        # If start or end is blocked, there is no feasible path
+        if grid.is_blocked(start[:2]) or grid.is_blocked(end[:2]):
+            return [],[]
+
+        # If the start state is already at the goal, return it as the path
+        if np.all(start[:len(end)] == end):
+            return start,[]
+
+        stats = self.stats
+        if stats is not None:
+            stats.begin()
+        heuristic = self.get_heuristic(end, grid)
+        if stats is not None:
+            stats.mark('heuristic')
+        if heuristic[start[0], start[1]] == np.inf:
+            return [],[]
+
+        blocked = grid.grid
+        n_rows, n_cols = blocked.shape
+        pad = table.max_extent
+        padded_blocked = np.ones((n_rows + 2 * pad, n_cols + 2 * pad), dtype=bool)
+        padded_blocked[pad:pad + n_rows, pad:pad + n_cols] = blocked
+        end_row = int(end[0])
+        end_col = int(end[1])
+        end_heading = int(end[2]) if len(end) > 2 else None
+
+        start_state = (int(start[0]), int(start[1]), int(start[2]))
+        g_score = {start_state: 0.0}
+        parent = {start_state: None}
+        closed = set()
+        explored_points = []
+        record_explored = self.record_explored
+        counter = 0 # unique counter for states to ensure tuple comparison functions correctly
+        # Ties on the f-score go to the state with the larger g-score, which is closer to the goal. Many lattice states tie,
+        # since the heuristic ignores the heading
+        heuristic_weight = self.heuristic_weight * table.heuristic_scale
+        queue = [(heuristic_weight * float(heuristic[start_state[0], start_state[1]]), 0.0, counter, start_state)]
+        goal_state = None
+        if stats is not None:
+            stats.record_open_size(1)
+            stats.mark('setup')
+
+        while queue:
+
+            # Get next entry from heap, skipping stale entries for states that were already expanded
+            _, _, _, state = heapq.heappop(queue)
+            if state in closed:
+                continue
+            closed.add(state)
+            row, col, heading = state
+            path_cost = g_score[state]
+            if record_explored:
+                explored_points.append([row, col, heading])
+            if stats is not None:
+                stats.record_expansion(row, col, path_cost)
+
+            if row == end_row and col == end_col and (end_heading is None or heading == end_heading):
+                goal_state = state
+                break
+
+            # Check every primitive from this heading against the grid at once
+            valid = table.get_valid_primitives(padded_blocked, row, col, heading)
+            if not valid.any():
+                continue
+            n_rows_next = table.end_rows[heading][valid] + row
+            n_cols_next = table.end_cols[heading][valid] + col
+            h_scores = heuristic[n_rows_next, n_cols_next]
+            if stats is not None:
+                stats.heuristic_calls += len(h_scores)
+            for n_row, n_col, n_heading, cost, h_score in zip(n_rows_next.tolist(), n_cols_next.tolist(),
+                                                              table.end_headings[heading][valid].tolist(),
+                                                              table.costs[heading][valid].tolist(), h_scores.tolist()):
+                if h_score == math.inf:
+                    continue
+                n_state = (n_row, n_col, n_heading)
+                if n_state in closed:
+                    continue
+                new_path_cost = path_cost + cost
+                if new_path_cost < g_score.get(n_state, math.inf):
+                    g_score[n_state] = new_path_cost
+                    parent[n_state] = state
+                    counter += 1
+                    heapq.heappush(queue, (new_path_cost + heuristic_weight * h_score, -new_path_cost, counter, n_state))
+                    if stats is not None:
+                        stats.record_open_size(len(queue))
 
-    def create_plan(self,start, end, occupancy_grid):
-        pass
\ No newline at end of file
+        if stats is not None:
+            stats.nodes_pushed += counter + 1
+            stats.mark('search')
+        path = []
+        state = goal_state
+        while state is not None:
+            path.append(list(state))
+            state = parent[state]
+        path.reverse()
+        if stats is not None:
+            stats.mark('reconstruct')
+        return path, explored_points
@@ -0,0 +1,107 @@
+import argparse
+import time
+import World
+import Agent
+
+
+class RunStats:
+    """Summary of a simulation run"""
+
+    def __init__(self, steps, sim_time, wall_time):
+        self.steps = steps
+        self.sim_time = sim_time
+        self.wall_time = wall_time
+
+    @property
+    def steps_per_second(self):
+        if self.wall_time <= 0:
+            return float('inf')
+        return self.steps / self.wall_time
+
+    @property
+    def real_time_factor(self):
+        """How many times faster than real time the simulation ran"""
+        if self.wall_time <= 0:
+            return float('inf')
+        return self.sim_time / self.wall_time
+
+    def __str__(self):
+        return 'Ran ' + str(self.steps) + ' steps (' + str(round(self.sim_time, 3)) + ' s simulated) in ' + \
+               str(round(self.wall_time, 3)) + ' s, ' + str(round(self.steps_per_second, 1)) + ' steps/s, ' + \
+               str(round(self.real_time_factor, 1)) + 'x real time'
+
+
+class SimulationRunner:
+    """Steps a world and an agent with a fixed time step as fast as possible, without any drawing or frame rate limiting"""
+
+    def __init__(self, world, agent=None, dt=0.01, grid_resolution=None):
+        """
+        Create a headless simulation runner
+        :param world: World to simulate, normally created without a screen
+        :param agent: Agent, or Agent.AgentSwarm of many agents, to step along with the world. If not provided a default Agent is created
+        :param dt: fixed time step in seconds
+        :param grid_resolution: if given, the world's occupancy grid at this resolution (meters/cell) is kept up to date every step
+        """
+        self.world = world
+        self.agent = agent if agent is not None else Agent.Agent()
+        self.dt = dt
+        self.steps = 0
+        self.sim_time = 0.0
+        if grid_resolution is not None:
+            self.world.get_occupancy_grid(grid_resolution)
+
+    def step(self):
+        """Advance the world and agent by one fixed time step"""
+        self.world.step(self.dt)
+        self.agent.step(self.dt)
+        self.steps += 1
+        self.sim_time += self.dt
+
+    def run(self, n_steps=None, until=None, max_steps=None):
+        """
+        Run the simulation
+        :param n_steps: number of steps to run
+        :param until: function called as until(runner) before every step, the run stops once it returns True
+        :param max_steps: upper limit on steps when running until a condition, so a condition that never holds cannot hang the run
+        :return: RunStats for this call
+        """
+        if n_steps is None and until is None:
+            raise ValueError('Specify a number of steps or a stop condition')
+        if n_steps is not None and max_steps is not None:
+            n_steps = min(n_steps, max_steps)
+        elif n_steps is None:
+            n_steps = max_steps
+
+        start_steps = self.steps
+        start_sim_time = self.sim_time
+        start_wall_time = time.perf_counter()
+        while n_steps is None or self.steps - start_steps < n_steps:
+            if until is not None and until(self):
+                break
+            self.step()
+        return RunStats(self.steps - start_steps, self.sim_time - start_sim_time, time.perf_counter() - start_wall_time)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a world headless with a fixed time step')
+    parser.add_argument('world_file', help='JSON file describing the world entities')
+    parser.add_argument('--steps', type=int, default=1000, help='number of steps to run')
+    parser.add_argument('--sim-time', type=float, help='run until this much time has been simulated instead of a fixed number of steps')
+    parser.add_argument('--dt', type=float, default=0.01, help='time step in seconds')
+    parser.add_argument('--physics-limit', type=float, default=100, help='distance from the origin in meters beyond which entities are removed')
+    parser.add_argument('--grid-resolution', type=float, help='keep the occupancy grid at this resolution (meters/cell) updated every step')
+    parser.add_argument('--entity-store', action='store_true', help='step entities with the vectorized EntityStore')
+    args = parser.parse_args(argv)
+
+    world = World.World(args.world_file, physics_limit=args.physics_limit, use_entity_store=args.entity_store)
+    runner = SimulationRunner(world, dt=args.dt, grid_resolution=args.grid_resolution)
+    if args.sim_time is not None:
+        stats = runner.run(until=lambda r: r.sim_time >= args.sim_time - 1e-9)
+    else:
+        stats = runner.run(n_steps=args.steps)
+    print(stats)
+    return stats
+
+
+if __name__ == '__main__':
+    main()
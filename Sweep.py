@@ -0,0 +1,182 @@
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import World
+import Planner
+
+RESULT_COLUMNS = ['scenario_id', 'planner', 'success', 'path_length', 'plan_time', 'nodes_expanded', 'collisions', 'steps']
+
+
+def scenarios_from_directory(directory, **scenario_args):
+    """
+    Generate one scenario per world descriptor file in a directory
+    :param directory: directory containing world JSON files
+    :param scenario_args: extra scenario settings (planner, start, goal, ...) applied to every scenario
+    :return: generator of scenario dicts, identified by file name
+    """
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.endswith('.json'):
+            scenario = dict(scenario_args)
+            scenario['id'] = file_name
+            scenario['world'] = os.path.join(directory, file_name)
+            yield scenario
+
+
+def random_scenarios(n_scenarios, seed=0, n_obstacles=(5, 20), max_speed=2.0, moving_fraction=0.5, physics_limit=50, **scenario_args):
+    """
+    Generate random worlds of circles, rectangles and triangles
+    :param n_scenarios: number of scenarios to generate
+    :param seed: base random seed, scenario i uses seed + i so every scenario can be regenerated on its own
+    :param n_obstacles: (min, max) number of obstacles per world
+    :param max_speed: largest obstacle speed in meters/second along each axis
+    :param moving_fraction: probability that an obstacle moves with constant velocity instead of being static
+    :param physics_limit: half width of the world in meters
+    :param scenario_args: extra scenario settings (planner, dt, ...) applied to every scenario
+    :return: generator of scenario dicts
+    """
+    for scenario_number in range(n_scenarios):
+        rng = np.random.default_rng(seed + scenario_number)
+        entities = []
+        for _ in range(int(rng.integers(n_obstacles[0], n_obstacles[1] + 1))):
+            shape_type = str(rng.choice(['Rectangle', 'Triangle', 'Circle']))
+            if shape_type == 'Circle':
+                shape = {'Type': shape_type, 'Radius': float(rng.uniform(1, physics_limit / 10.0))}
+            else:
+                shape = {'Type': shape_type, 'Length': int(rng.integers(2, physics_limit // 4 + 3)),
+                         'Height': int(rng.integers(2, physics_limit // 4 + 3))}
+            moving = rng.random() < moving_fraction
+            velocity = rng.uniform(-max_speed, max_speed, 2).tolist() if moving else [0, 0]
+            position = rng.uniform(-0.7 * physics_limit, 0.7 * physics_limit, 2).tolist()
+            entities.append({'Shape': shape,
+                             'Motion': {'Type': 'ConstVel' if moving else 'Static',
+                                        'InitialPosition': position,
+                                        'InitialVelocity': velocity}})
+        scenario = dict(scenario_args)
+        scenario['id'] = 'seed_' + str(seed + scenario_number)
+        scenario['world'] = {'Name': scenario['id'], 'Entities': entities}
+        scenario.setdefault('physics_limit', physics_limit)
+        yield scenario
+
+
+def run_episode(scenario):
+    """
+    Plan across a world and play the plan back while the world moves
+    :param scenario: dict with 'id' and 'world' (descriptor file path or dict) and optional 'planner' ('Astar'), 'physics_limit' (50),
+                     'resolution' (1 meter/cell), 'dt' (0.1 seconds per path cell), 'start' and 'goal' (world positions in meters,
+                     defaulting to opposite corners of the world)
+    :return: dict of metrics with the keys in RESULT_COLUMNS
+    """
+    planner_type = scenario.get('planner', 'Astar')
+    physics_limit = scenario.get('physics_limit', 50)
+    resolution = scenario.get('resolution', 1)
+    dt = scenario.get('dt', 0.1)
+    corner = 0.9 * physics_limit
+    start = scenario.get('start', [-corner, -corner])
+    goal = scenario.get('goal', [corner, corner])
+
+    world = World.World(scenario['world'], physics_limit=physics_limit)
+    grid = world.get_occupancy_grid(resolution)
+    start_cell = grid.position_to_2d_index(start)
+    goal_cell = grid.position_to_2d_index(goal)
+
+    planner = Planner.Planner(planner_type)
+    plan_start = time.perf_counter()
+    path, explored = planner.create_plan_discrete(start_cell, goal_cell, grid)
+    plan_time = time.perf_counter() - plan_start
+    if isinstance(path, np.ndarray):
+        path = [list(path)]
+
+    # Move one path cell per time step and count the steps where the agent's cell is blocked
+    collisions = 0
+    for cell in path[1:]:
+        world.step(dt)
+        if grid.is_blocked(cell):
+            collisions += 1
+
+    path_length = sum(Planner.computeEuclideanDistance(p1, p2) for p1, p2 in zip(path[:-1], path[1:])) * resolution
+    return {'scenario_id': scenario['id'],
+            'planner': planner_type,
+            'success': int(len(path) > 0),
+            'path_length': path_length,
+            'plan_time': plan_time,
+            'nodes_expanded': len(explored),
+            'collisions': collisions,
+            'steps': max(len(path) - 1, 0)}
+
+
+def read_completed_ids(results_file):
+    """
+    Get the scenario ids already recorded in a results file
+    A trailing line cut off by an interrupted run is removed from the file so appending can carry on cleanly
+    """
+    if not os.path.exists(results_file):
+        return set()
+    with open(results_file, 'r+', newline='') as f:
+        content = f.read()
+        if content and not content.endswith('\n'):
+            content = content[:content.rfind('\n') + 1]
+            f.seek(0)
+            f.truncate()
+            f.write(content)
+    with open(results_file, newline='') as f:
+        return set(row['scenario_id'] for row in csv.DictReader(f))
+
+
+def run_sweep(scenarios, results_file, n_processes=None, resume=True):
+    """
+    Run a family of scenarios in a process pool and stream one row of metrics per episode to a CSV file as episodes finish
+    :param scenarios: iterable of scenario dicts, see run_episode. Scenario ids must be unique and stable between runs for resuming
+    :param results_file: CSV file with the columns in RESULT_COLUMNS
+    :param n_processes: number of worker processes, defaults to the number of cores. 1 runs the episodes in this process
+    :param resume: if True, scenarios already in the results file are skipped and new rows are appended, otherwise the file is overwritten
+    :return: number of episodes run
+    """
+    completed = read_completed_ids(results_file) if resume else set()
+    pending = [scenario for scenario in scenarios if scenario['id'] not in completed]
+    write_header = not (resume and os.path.exists(results_file) and os.path.getsize(results_file) > 0)
+
+    with open(results_file, 'a' if not write_header else 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_COLUMNS)
+        if write_header:
+            writer.writeheader()
+            f.flush()
+
+        def record(result):
+            writer.writerow(result)
+            f.flush()
+
+        if n_processes == 1:
+            for scenario in pending:
+                record(run_episode(scenario))
+        else:
+            with ProcessPoolExecutor(max_workers=n_processes) as executor:
+                futures = [executor.submit(run_episode, scenario) for scenario in pending]
+                for future in as_completed(futures):
+                    record(future.result())
+    return len(pending)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run planning episodes over many worlds in parallel')
+    parser.add_argument('results_file', help='CSV file to write per episode metrics to')
+    parser.add_argument('--world-dir', help='directory of world JSON files to run, one episode per file')
+    parser.add_argument('--random', type=int, default=0, help='number of random worlds to generate when no directory is given')
+    parser.add_argument('--seed', type=int, default=0, help='base seed for random worlds')
+    parser.add_argument('--planner', default='Astar', help='planner type to evaluate')
+    parser.add_argument('--processes', type=int, help='number of worker processes')
+    parser.add_argument('--no-resume', action='store_true', help='overwrite the results file instead of skipping finished scenarios')
+    args = parser.parse_args(argv)
+
+    if args.world_dir:
+        scenarios = scenarios_from_directory(args.world_dir, planner=args.planner)
+    else:
+        scenarios = random_scenarios(args.random, seed=args.seed, planner=args.planner)
+    n_run = run_sweep(scenarios, args.results_file, n_processes=args.processes, resume=not args.no_resume)
+    print('Ran ' + str(n_run) + ' episodes, results in ' + args.results_file)
+
+
+if __name__ == '__main__':
+    main()
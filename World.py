@@ -27,9 +27,25 @@ class BaseEntity:
     derived shape class and motion class need to reference it"""
 
     def __init__(self, position):
+        self.store = None
+        self.store_index = None
         self.pos = np.array(position)
         self.id = idGenerator()
 
+    @property
+    def pos(self):
+        """Position of the entity. While the entity is in an EntityStore this is a view of its row in the store"""
+        if self.store is None:
+            return self._pos
+        return self.store.positions[self.store_index]
+
+    @pos.setter
+    def pos(self, value):
+        if self.store is None:
+            self._pos = value
+        else:
+            self.store.positions[self.store_index] = value
+
     def get_id(self):
         return self.id
 
@@ -38,6 +54,53 @@ class BaseEntity:
 
 
 
+def box_overlaps_cells(bounds, x_lo, x_hi, y_lo, y_hi):
+    """
+    Test which grid cells overlap an axis aligned box
+    :param bounds: (min_x, min_y, max_x, max_y) of the box in meters
+    :param x_lo, x_hi, y_lo, y_hi: broadcastable arrays of cell edges in meters
+    :return: boolean array that is True where the box and the cell share some area
+    """
+    min_x, min_y, max_x, max_y = bounds
+    return (x_lo < max_x) & (x_hi > min_x) & (y_lo < max_y) & (y_hi > min_y)
+
+
+def convex_polygon_overlaps_cells(vertices, x_lo, x_hi, y_lo, y_hi):
+    """
+    Test which grid cells overlap a convex polygon using the separating axis theorem
+    :param vertices: list of polygon vertices in counter-clockwise order
+    :param x_lo, x_hi, y_lo, y_hi: broadcastable arrays of cell edges in meters
+    :return: boolean array that is True where the polygon and the cell share some area
+    """
+    vertices = np.asarray(vertices, dtype=float)
+    min_x, min_y = vertices.min(axis=0)
+    max_x, max_y = vertices.max(axis=0)
+    overlap = box_overlaps_cells((min_x, min_y, max_x, max_y), x_lo, x_hi, y_lo, y_hi)
+
+    # Each edge defines a half-plane n.p < c containing the polygon. A cell is separated
+    # from the polygon if its corner furthest into that half-plane is still outside it
+    for p1, p2 in zip(vertices, np.roll(vertices, -1, axis=0)):
+        n_x = p2[1] - p1[1]
+        n_y = p1[0] - p2[0]
+        c = n_x * p1[0] + n_y * p1[1]
+        corner_x = x_lo if n_x > 0 else x_hi
+        corner_y = y_lo if n_y > 0 else y_hi
+        overlap = overlap & (n_x * corner_x + n_y * corner_y < c)
+    return overlap
+
+
+def circle_overlaps_cells(center, radius, x_lo, x_hi, y_lo, y_hi):
+    """
+    Test which grid cells overlap a circle by checking the distance to the closest point of each cell
+    :param center: 2d center of the circle in meters
+    :param radius: radius of the circle in meters
+    :param x_lo, x_hi, y_lo, y_hi: broadcastable arrays of cell edges in meters
+    :return: boolean array that is True where the circle and the cell share some area
+    """
+    dx = np.maximum(np.maximum(x_lo - center[0], center[0] - x_hi), 0)
+    dy = np.maximum(np.maximum(y_lo - center[1], center[1] - y_hi), 0)
+    return dx * dx + dy * dy < radius * radius
+
 
 class Rectangle(BaseEntity):
     """A derived shape class for a rectangle"""
@@ -73,6 +136,15 @@ class Rectangle(BaseEntity):
                 blocked_cells.append((px, py))
         return blocked_cells
 
+    def get_bounding_box(self):
+        """Get the axis aligned bounds of the shape as (min_x, min_y, max_x, max_y) in meters"""
+        return (self.pos[0] - self.length / 2.0, self.pos[1] - self.height / 2.0,
+                self.pos[0] + self.length / 2.0, self.pos[1] + self.height / 2.0)
+
+    def overlaps_cells(self, x_lo, x_hi, y_lo, y_hi):
+        """Test which grid cells, given as broadcastable arrays of cell edges, overlap the shape"""
+        return box_overlaps_cells(self.get_bounding_box(), x_lo, x_hi, y_lo, y_hi)
+
 
 class Triangle(BaseEntity):
     """Derived shape class for a triangle"""
@@ -119,6 +191,22 @@ class Triangle(BaseEntity):
                     blocked_cells.extend([(px,py), (xSym,py)])
         return blocked_cells
 
+    def get_vertices(self):
+        """Get the corners of the triangle in counter-clockwise order"""
+        top = self.pos + np.array([0, self.height / 2.0])
+        bottom_left = self.pos + np.array([-self.length / 2.0, -self.height / 2.0])
+        bottom_right = self.pos + np.array([self.length / 2.0, -self.height / 2.0])
+        return [bottom_left, bottom_right, top]
+
+    def get_bounding_box(self):
+        """Get the axis aligned bounds of the shape as (min_x, min_y, max_x, max_y) in meters"""
+        return (self.pos[0] - self.length / 2.0, self.pos[1] - self.height / 2.0,
+                self.pos[0] + self.length / 2.0, self.pos[1] + self.height / 2.0)
+
+    def overlaps_cells(self, x_lo, x_hi, y_lo, y_hi):
+        """Test which grid cells, given as broadcastable arrays of cell edges, overlap the shape"""
+        return convex_polygon_overlaps_cells(self.get_vertices(), x_lo, x_hi, y_lo, y_hi)
+
 
 class Circle(BaseEntity):
     """Derived shape class for a circle"""
@@ -154,6 +242,15 @@ class Circle(BaseEntity):
                     blocked_cells.extend([(px,py), (px,ySym), (xSym,py), (xSym,ySym)])
         return blocked_cells
 
+    def get_bounding_box(self):
+        """Get the axis aligned bounds of the shape as (min_x, min_y, max_x, max_y) in meters"""
+        return (self.pos[0] - self.radius, self.pos[1] - self.radius,
+                self.pos[0] + self.radius, self.pos[1] + self.radius)
+
+    def overlaps_cells(self, x_lo, x_hi, y_lo, y_hi):
+        """Test which grid cells, given as broadcastable arrays of cell edges, overlap the shape"""
+        return circle_overlaps_cells(self.pos, self.radius, x_lo, x_hi, y_lo, y_hi)
+
 
 
 
@@ -164,6 +261,20 @@ class MotionBase(BaseEntity):
         super(MotionBase, self).__init__(**kw)
         self.vel = np.array(motion_data['InitialVelocity'])
 
+    @property
+    def vel(self):
+        """Velocity of the entity. While the entity is in an EntityStore this is a view of its row in the store"""
+        if self.store is None:
+            return self._vel
+        return self.store.velocities[self.store_index]
+
+    @vel.setter
+    def vel(self, value):
+        if self.store is None:
+            self._vel = value
+        else:
+            self.store.velocities[self.store_index] = value
+
     def update(self, dt):
         pass
 
@@ -188,6 +299,339 @@ class ConstVel(MotionBase):
         self.pos = self.pos + self.vel * dt
 
 
+# Type codes used by EntityStore
+MOTION_STATIC = 0
+MOTION_CONST_VEL = 1
+SHAPE_RECTANGLE = 0
+SHAPE_TRIANGLE = 1
+SHAPE_CIRCLE = 2
+
+
+def get_motion_code(entity):
+    """Get the EntityStore motion code for an entity"""
+    if isinstance(entity, Static):
+        return MOTION_STATIC
+    elif isinstance(entity, ConstVel):
+        return MOTION_CONST_VEL
+    else:
+        raise ValueError('Unsupported motion type for entity '+str(entity.get_id()))
+
+
+def get_shape_code_and_params(entity):
+    """Get the EntityStore shape code and the two shape parameters ((length, height) or (radius, radius)) for an entity"""
+    if isinstance(entity, Rectangle):
+        return SHAPE_RECTANGLE, (entity.length, entity.height)
+    elif isinstance(entity, Triangle):
+        return SHAPE_TRIANGLE, (entity.length, entity.height)
+    elif isinstance(entity, Circle):
+        return SHAPE_CIRCLE, (entity.radius, entity.radius)
+    else:
+        raise ValueError('Unsupported shape type for entity '+str(entity.get_id()))
+
+
+class EntityStore:
+    """Structure of arrays storage for entity state so the whole world can be stepped with a few vectorized operations
+    Entities added to the store keep working as normal objects, but their position and velocity become views into the store arrays"""
+
+    def __init__(self, entities=(), capacity=16):
+        """
+        Create an entity store
+        :param entities: iterable of entities to add to the store
+        :param capacity: initial number of rows to allocate, the arrays grow as needed
+        """
+        self.count = 0
+        self.entities = []
+        self._positions = np.zeros((capacity, 2))
+        self._velocities = np.zeros((capacity, 2))
+        self._motion_codes = np.zeros(capacity, dtype=np.int8)
+        self._shape_codes = np.zeros(capacity, dtype=np.int8)
+        self._shape_params = np.zeros((capacity, 2))
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self.add_entities(entities)
+
+    @property
+    def positions(self):
+        return self._positions[:self.count]
+
+    @property
+    def velocities(self):
+        return self._velocities[:self.count]
+
+    @property
+    def motion_codes(self):
+        return self._motion_codes[:self.count]
+
+    @property
+    def shape_codes(self):
+        return self._shape_codes[:self.count]
+
+    @property
+    def shape_params(self):
+        return self._shape_params[:self.count]
+
+    @property
+    def ids(self):
+        return self._ids[:self.count]
+
+    def __len__(self):
+        return self.count
+
+    def reserve(self, capacity):
+        """Grow the store arrays so they can hold at least capacity entities"""
+        if capacity <= self._positions.shape[0]:
+            return
+        new_capacity = max(capacity, 2 * self._positions.shape[0])
+        for name in ('_positions', '_velocities', '_motion_codes', '_shape_codes', '_shape_params', '_ids'):
+            old = getattr(self, name)
+            new = np.zeros((new_capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def add_entity(self, entity):
+        self.add_entities([entity])
+
+    def add_entities(self, entities):
+        """Copy the state of each entity into the store and turn its position and velocity into views of the store"""
+        entities = list(entities)
+        self.reserve(self.count + len(entities))
+        for entity in entities:
+            index = self.count
+            shape_code, shape_params = get_shape_code_and_params(entity)
+            self._positions[index] = entity.pos
+            self._velocities[index] = entity.vel
+            self._motion_codes[index] = get_motion_code(entity)
+            self._shape_codes[index] = shape_code
+            self._shape_params[index] = shape_params
+            self._ids[index] = entity.get_id()
+            entity.store = self
+            entity.store_index = index
+            self.entities.append(entity)
+            self.count += 1
+
+    def step(self, dt):
+        """Move every constant velocity entity forward by dt"""
+        moving = self.motion_codes == MOTION_CONST_VEL
+        self.positions[moving] += self.velocities[moving] * dt
+
+    def get_bounding_boxes(self):
+        """Get the axis aligned bounds of every entity as an (N, 4) array of (min_x, min_y, max_x, max_y)"""
+        half_extent = np.where((self.shape_codes == SHAPE_CIRCLE)[:, np.newaxis], self.shape_params, self.shape_params / 2.0)
+        return np.hstack((self.positions - half_extent, self.positions + half_extent))
+
+    def remove_where(self, mask):
+        """
+        Remove the entities selected by a boolean mask, compacting the arrays
+        Removed entities are detached from the store and keep a copy of their last position and velocity
+        :param mask: boolean array with one entry per entity, True for entities to remove
+        :return: list of removed entities
+        """
+        mask = np.asarray(mask, dtype=bool)
+        if not np.any(mask):
+            return []
+        removed = [entity for entity, remove in zip(self.entities, mask) if remove]
+        for entity in removed:
+            pos = np.copy(entity.pos)
+            vel = np.copy(entity.vel)
+            entity.store = None
+            entity.store_index = None
+            entity.pos = pos
+            entity.vel = vel
+
+        keep = ~mask
+        n_keep = int(np.count_nonzero(keep))
+        for name in ('_positions', '_velocities', '_motion_codes', '_shape_codes', '_shape_params', '_ids'):
+            array = getattr(self, name)
+            array[:n_keep] = array[:self.count][keep]
+        self.count = n_keep
+
+        # Only entities after the first removed one change index
+        first_removed = int(np.argmax(mask))
+        self.entities = [entity for entity, remove in zip(self.entities, mask) if not remove]
+        for index in range(first_removed, n_keep):
+            self.entities[index].store_index = index
+        return removed
+
+    def cull_outside(self, limit):
+        """Remove every entity whose position is further than limit from the origin along either axis and return the removed entities"""
+        return self.remove_where(np.any(np.abs(self.positions) > limit, axis=1))
+
+
+def convex_polygon_overlaps_circle(vertices, center, radius):
+    """Test whether a convex polygon, with vertices in counter-clockwise order, and a circle share some area"""
+    vertices = np.asarray(vertices, dtype=float)
+    center = np.asarray(center, dtype=float)
+    edges = np.roll(vertices, -1, axis=0) - vertices
+    to_center = center - vertices
+    # Inside test: the center is to the left of every edge
+    if np.all(edges[:, 0] * to_center[:, 1] - edges[:, 1] * to_center[:, 0] >= 0):
+        return True
+    t = np.clip(np.sum(to_center * edges, axis=1) / np.sum(edges * edges, axis=1), 0, 1)
+    closest = vertices + t[:, np.newaxis] * edges
+    return bool(np.min(np.sum((closest - center) ** 2, axis=1)) < radius * radius)
+
+
+def entity_overlaps_circle(entity, center, radius):
+    """Exact test of whether an entity's shape and a circle, such as an agent's footprint, share some area"""
+    if isinstance(entity, Circle):
+        d = np.asarray(entity.pos, dtype=float) - center
+        return bool(d[0] * d[0] + d[1] * d[1] < (entity.radius + radius) ** 2)
+    elif isinstance(entity, Triangle):
+        return convex_polygon_overlaps_circle(entity.get_vertices(), center, radius)
+    else:
+        return bool(circle_overlaps_cells(center, radius, *np.array(entity.get_bounding_box())[[0, 2, 1, 3]]))
+
+
+class SpatialHash:
+    """Uniform hash grid broadphase over entity bounding boxes
+    Each entity is listed in every hash cell its bounding box touches, so box and radius queries only look at the entities
+    in the few cells they cover. Entities are only re-hashed when their bounding box moves into a different range of cells"""
+
+    def __init__(self, cell_size=5.0):
+        """
+        Create an empty spatial hash
+        :param cell_size: side length of the hash cells in meters. Works best around the size of a typical entity
+        """
+        if cell_size <= 0:
+            raise ValueError('Cell size must be positive')
+        self.cell_size = cell_size
+        self.cells = {}  # (x cell, y cell) -> set of entities
+        self.entity_cells = {}  # entity -> (x cell lo, y cell lo, x cell hi, y cell hi)
+        self.boxes = {}  # entity -> bounding box when it was last inserted or updated
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __contains__(self, entity):
+        return entity in self.boxes
+
+    def get_cell_ranges(self, boxes):
+        """Convert an (N, 4) array of bounding boxes into an (N, 4) integer array of covered hash cell ranges"""
+        return np.floor(np.asarray(boxes, dtype=float) / self.cell_size).astype(np.int64)
+
+    def insert(self, entity, box=None):
+        """Add an entity, using its current bounding box unless one is given"""
+        if box is None:
+            box = entity.get_bounding_box()
+        cell_range = tuple(int(i) for i in self.get_cell_ranges(box))
+        self.boxes[entity] = tuple(box)
+        self.entity_cells[entity] = cell_range
+        self.add_to_cells(entity, cell_range)
+
+    def insert_all(self, entities, boxes=None):
+        """Add many entities, computing the covered cells of all of them with one vectorized operation"""
+        entities = list(entities)
+        if not entities:
+            return
+        if boxes is None:
+            boxes = [entity.get_bounding_box() for entity in entities]
+        boxes = np.asarray(boxes, dtype=float)
+        for entity, box, cell_range in zip(entities, boxes.tolist(), self.get_cell_ranges(boxes).tolist()):
+            cell_range = tuple(cell_range)
+            self.boxes[entity] = tuple(box)
+            self.entity_cells[entity] = cell_range
+            self.add_to_cells(entity, cell_range)
+
+    def remove(self, entity):
+        """Remove an entity, doing nothing if it is not in the hash"""
+        if entity not in self.boxes:
+            return
+        self.remove_from_cells(entity, self.entity_cells.pop(entity))
+        del self.boxes[entity]
+
+    def update(self, entities, boxes=None):
+        """
+        Refresh the stored bounding boxes of entities that may have moved
+        :param entities: list of entities already in the hash
+        :param boxes: optional (N, 4) array of their current bounding boxes, for example from EntityStore.get_bounding_boxes
+        """
+        entities = list(entities)
+        if not entities:
+            return
+        if boxes is None:
+            boxes = [entity.get_bounding_box() for entity in entities]
+        boxes = np.asarray(boxes, dtype=float)
+        for entity, box, cell_range in zip(entities, boxes.tolist(), self.get_cell_ranges(boxes).tolist()):
+            self.boxes[entity] = tuple(box)
+            cell_range = tuple(cell_range)
+            old_range = self.entity_cells[entity]
+            if cell_range != old_range:
+                self.remove_from_cells(entity, old_range)
+                self.add_to_cells(entity, cell_range)
+                self.entity_cells[entity] = cell_range
+
+    def add_to_cells(self, entity, cell_range):
+        x_lo, y_lo, x_hi, y_hi = cell_range
+        for x in range(x_lo, x_hi + 1):
+            for y in range(y_lo, y_hi + 1):
+                cell = self.cells.get((x, y))
+                if cell is None:
+                    self.cells[(x, y)] = {entity}
+                else:
+                    cell.add(entity)
+
+    def remove_from_cells(self, entity, cell_range):
+        x_lo, y_lo, x_hi, y_hi = cell_range
+        for x in range(x_lo, x_hi + 1):
+            for y in range(y_lo, y_hi + 1):
+                cell = self.cells[(x, y)]
+                cell.discard(entity)
+                if not cell:
+                    del self.cells[(x, y)]
+
+    def get_candidates(self, box):
+        """Get the set of entities listed in any hash cell that the box touches"""
+        x_lo, y_lo, x_hi, y_hi = (int(i) for i in self.get_cell_ranges(box))
+        candidates = set()
+        if (x_hi - x_lo + 1) * (y_hi - y_lo + 1) > len(self.cells):
+            # Large queries are cheaper to answer by walking the occupied cells
+            for (x, y), cell in self.cells.items():
+                if x_lo <= x <= x_hi and y_lo <= y <= y_hi:
+                    candidates.update(cell)
+            return candidates
+        for x in range(x_lo, x_hi + 1):
+            for y in range(y_lo, y_hi + 1):
+                cell = self.cells.get((x, y))
+                if cell is not None:
+                    candidates.update(cell)
+        return candidates
+
+    def query_box(self, box):
+        """
+        Find the entities whose bounding box overlaps an axis aligned box
+        :param box: (min_x, min_y, max_x, max_y) in meters
+        :return: list of entities sorted by id
+        """
+        min_x, min_y, max_x, max_y = box
+        found = []
+        for entity in self.get_candidates(box):
+            e_min_x, e_min_y, e_max_x, e_max_y = self.boxes[entity]
+            if e_min_x <= max_x and e_max_x >= min_x and e_min_y <= max_y and e_max_y >= min_y:
+                found.append(entity)
+        found.sort(key=lambda entity: entity.id)
+        return found
+
+    def query_radius(self, center, radius):
+        """
+        Find the entities whose bounding box comes within radius of a point
+        :return: list of entities sorted by id
+        """
+        radius_squared = radius * radius
+        found = []
+        for entity in self.get_candidates((center[0] - radius, center[1] - radius, center[0] + radius, center[1] + radius)):
+            min_x, min_y, max_x, max_y = self.boxes[entity]
+            dx = max(min_x - center[0], center[0] - max_x, 0)
+            dy = max(min_y - center[1], center[1] - max_y, 0)
+            if dx * dx + dy * dy <= radius_squared:
+                found.append(entity)
+        found.sort(key=lambda entity: entity.id)
+        return found
+
+    def find_collisions(self, center, radius):
+        """Find the entities whose actual shape overlaps a circle, such as an agent's footprint, using the hash as a broadphase"""
+        center = np.asarray(center, dtype=float)
+        return [entity for entity in self.query_radius(center, radius) if entity_overlaps_circle(entity, center, radius)]
+
+
 def create_dynamic_object(motion_class, shape_class):
     """Generate entity classes based on the shape and motion profile provided"""
 
@@ -204,22 +648,31 @@ def create_dynamic_object(motion_class, shape_class):
 class World:
     """The world is a collection of entities that exist and may move around"""
 
-    def __init__(self, descriptor_file, screen=None, world_scale=1, physics_limit=100):
+    def __init__(self, descriptor_file, screen=None, world_scale=1, physics_limit=100, use_entity_store=False):
         """
         Initialize the world
-        :param descriptor_file: Full path to JSON file describing the world entities
+        :param descriptor_file: Full path to JSON file describing the world entities, or the already loaded descriptor as a dict
         :param screen: pygame screen to draw on. If not provided, nothing will be drawn
         :param world_scale: scaling value used for drawing on the screen. Units are pixels/meter
         :param physics_limits: distance (in meters) from world origin to simulate physics. Objects that leave this region will be deleted. Used for world discritization. If not specified, it is set to 100 meters or 20% larger than the pygame screen
+        :param use_entity_store: if True, entity state is kept in an EntityStore and step updates all entities with vectorized operations
         """
 
-        self.entity_list = self.create_entities_from_file(descriptor_file)
-        self.scale_converter = ScaleConverter(screen, world_scale = world_scale, cell_resolution = 1)
+        if isinstance(descriptor_file, dict):
+            self.entity_list = self.create_entities_from_data(descriptor_file)
+        else:
+            self.entity_list = self.create_entities_from_file(descriptor_file)
+        self.entity_store = EntityStore(self.entity_list) if use_entity_store else None
+        self.world_scale = world_scale
+        self.occupancy_grid = None
+        self.spatial_hash = None
 
         # initialize animation window
         if screen:
             self.display_mode = 'Screen'
             self.screen = screen
+            self.window_size = screen.get_width()
+            self.scale_converter = ScaleConverter(screen, world_scale = world_scale, cell_resolution = 1)
             self.screen.fill(WHITE)
             self.physics_limit = self.get_physics_limit_from_screen(0.2)
             self.draw()
@@ -236,6 +689,10 @@ class World:
         """Open a JSON file an generate world entities from the file"""
         with open(file) as f:
             file_data = json.load(f)
+        return self.create_entities_from_data(file_data)
+
+    def create_entities_from_data(self, file_data):
+        """Generate world entities from a world descriptor that has already been loaded from JSON"""
         return [self.create_entity(entity_data) for entity_data in file_data['Entities']]
 
     def get_physics_limit_from_screen(self, buffer_fraction):
@@ -254,14 +711,41 @@ class World:
                          entity_data['Motion']['InitialPosition'])
 
     def step(self, dt):
-        """Perform a physics time step for each entity in the world"""
-        for entity in self.entity_list:
-            entity.update(dt)
-            cur_pos = entity.get_position()
-            if abs(cur_pos[0]) > self.physics_limit or \
-               abs(cur_pos[1]) > self.physics_limit:
-               self.entity_list.remove(entity)
-               print('Removed entity ' +str(entity.get_id())+ ' from world at pos: '+str(cur_pos))
+        """Perform a physics time step for each entity in the world and update the occupancy grid if one is being maintained"""
+        if self.entity_store is not None:
+            self.entity_store.step(dt)
+            removed = self.entity_store.cull_outside(self.physics_limit)
+            if removed:
+                self.entity_list = list(self.entity_store.entities)
+        else:
+            for entity in self.entity_list:
+                entity.update(dt)
+            removed = [entity for entity in self.entity_list if self.is_outside_physics_limit(entity.get_position())]
+            if removed:
+                self.entity_list = [entity for entity in self.entity_list if not self.is_outside_physics_limit(entity.get_position())]
+
+        for entity in removed:
+            if self.occupancy_grid is not None:
+                self.occupancy_grid.remove_entity(entity)
+            if self.spatial_hash is not None:
+                self.spatial_hash.remove(entity)
+            print('Removed entity ' +str(entity.get_id())+ ' from world at pos: '+str(entity.get_position()))
+        if self.occupancy_grid is not None:
+            self.occupancy_grid.update()
+        if self.spatial_hash is not None:
+            self.update_spatial_hash()
+
+    def update_spatial_hash(self):
+        """Refresh the spatial hash entries of moving entities, static entities never change cells"""
+        if self.entity_store is not None:
+            moving = self.entity_store.motion_codes == MOTION_CONST_VEL
+            entities = [entity for entity, is_moving in zip(self.entity_store.entities, moving) if is_moving]
+            self.spatial_hash.update(entities, self.entity_store.get_bounding_boxes()[moving])
+        else:
+            self.spatial_hash.update([entity for entity in self.entity_list if not isinstance(entity, Static)])
+
+    def is_outside_physics_limit(self, position):
+        return abs(position[0]) > self.physics_limit or abs(position[1]) > self.physics_limit
 
     def draw(self):
         """Draw the world"""
@@ -275,12 +759,41 @@ class World:
 
     def get_occupancy_grid(self, resolution):
         """Get a discritized representation of the world with the given resolution
-        Resolution parameter should be in meters/cell. Returns an object of type OccupancyGrid
+        Resolution parameter should be in meters/cell. Returns an object of type IncrementalOccupancyGrid
+        The grid is owned by the world and kept up to date by step, so repeated calls with the same resolution return the same object
         """
-        occ_grid = OccupancyGrid(2*self.physics_limit, resolution)
-        for entity in self.entity_list:
-            occ_grid.add_entity(entity)
-        return occ_grid
+        if self.occupancy_grid is None or self.occupancy_grid.resolution != resolution:
+            self.occupancy_grid = IncrementalOccupancyGrid(2*self.physics_limit, resolution)
+            for entity in self.entity_list:
+                self.occupancy_grid.add_entity(entity)
+        return self.occupancy_grid
+
+    def get_occupancy_prediction(self, resolution, horizon):
+        """
+        Predict grid occupancy over the next horizon seconds by extrapolating the moving entities with their current velocity
+        :param resolution: grid resolution in meters/cell
+        :param horizon: seconds to predict ahead
+        :return: OccupancyPrediction whose static obstacles are the static entities of the world occupancy grid
+        """
+        occupancy_grid = self.get_occupancy_grid(resolution)
+        static_grid = OccupancyGrid(occupancy_grid.size, resolution)
+        static_grid.grid = np.copy(occupancy_grid.static_grid)
+        moving_entities = [entity for entity in self.entity_list if not isinstance(entity, Static)]
+        return OccupancyPrediction(static_grid, moving_entities, horizon)
+
+    def get_spatial_hash(self, cell_size=5.0):
+        """Get a SpatialHash of the world entities with the given cell size in meters
+        The hash is owned by the world and kept up to date by step, so repeated calls with the same cell size return the same object
+        """
+        if self.spatial_hash is None or self.spatial_hash.cell_size != cell_size:
+            self.spatial_hash = SpatialHash(cell_size)
+            boxes = self.entity_store.get_bounding_boxes() if self.entity_store is not None else None
+            self.spatial_hash.insert_all(self.entity_list, boxes)
+        return self.spatial_hash
+
+    def find_collisions(self, position, radius, cell_size=5.0):
+        """Find the entities overlapping a circular footprint, such as the agent's, using the world's spatial hash"""
+        return self.get_spatial_hash(cell_size).find_collisions(position, radius)
 
 
 def occupancy_grid_from_numpy_array(grid, resolution = 1):
@@ -298,6 +811,82 @@ def occupancy_grid_from_numpy_array(grid, resolution = 1):
     return og
 
 
+# On disk occupancy grid format: a fixed size header followed by the raw one byte per cell boolean buffer in row major order
+GRID_FILE_MAGIC = b'OCCGRID1'
+GRID_FILE_FORMAT_VERSION = 1
+GRID_FILE_HEADER = np.dtype([('magic', 'S8'),
+                             ('format_version', '<u4'),
+                             ('n_rows', '<u4'),
+                             ('n_cols', '<u4'),
+                             ('size', '<f8'),
+                             ('resolution', '<f8'),
+                             ('grid_version', '<u8'),
+                             ('reserved', 'V20')])
+GRID_FILE_HEADER_SIZE = GRID_FILE_HEADER.itemsize
+
+
+def save_occupancy_grid(grid, file):
+    """
+    Write an occupancy grid to a file that load_occupancy_grid can memory map
+    :param grid: OccupancyGrid to save
+    :param file: path of the file to write
+    """
+    cells = np.ascontiguousarray(grid.grid, dtype=bool)
+    header = np.zeros(1, dtype=GRID_FILE_HEADER)
+    header['magic'] = GRID_FILE_MAGIC
+    header['format_version'] = GRID_FILE_FORMAT_VERSION
+    header['n_rows'], header['n_cols'] = cells.shape
+    header['size'] = grid.size
+    header['resolution'] = grid.resolution
+    header['grid_version'] = getattr(grid, 'version', 0)
+    with open(file, 'wb') as f:
+        f.write(header.tobytes())
+        f.write(cells.tobytes())
+
+
+def read_occupancy_grid_header(file):
+    """Read and check the header of an occupancy grid file, returning it as a dict"""
+    with open(file, 'rb') as f:
+        data = f.read(GRID_FILE_HEADER_SIZE)
+    if len(data) != GRID_FILE_HEADER_SIZE:
+        raise ValueError('File is too short to be an occupancy grid file')
+    header = np.frombuffer(data, dtype=GRID_FILE_HEADER)[0]
+    if header['magic'] != GRID_FILE_MAGIC:
+        raise ValueError('Not an occupancy grid file')
+    if header['format_version'] != GRID_FILE_FORMAT_VERSION:
+        raise ValueError('Unsupported occupancy grid file version ' + str(header['format_version']))
+    return {'n_rows': int(header['n_rows']),
+            'n_cols': int(header['n_cols']),
+            'size': float(header['size']),
+            'resolution': float(header['resolution']),
+            'grid_version': int(header['grid_version'])}
+
+
+def load_occupancy_grid(file, mode='r'):
+    """
+    Open an occupancy grid file without reading it into memory. The cells are a np.memmap, so processes that load the
+    same file share the operating system's page cache instead of each holding a copy
+    :param file: path of a file written by save_occupancy_grid
+    :param mode: np.memmap mode, 'r' for read only or 'r+' to write changes back to the file
+    :return: OccupancyGrid whose grid is the memory mapped cell buffer, see occupancy_grid_from_numpy_array
+    """
+    header = read_occupancy_grid_header(file)
+    cells = np.memmap(file, dtype=bool, mode=mode, offset=GRID_FILE_HEADER_SIZE, shape=(header['n_rows'], header['n_cols']))
+    return occupancy_grid_from_numpy_array(cells, header['resolution'])
+
+
+def convert_world_to_grid_file(descriptor, file, resolution, physics_limit=100):
+    """
+    Rasterize a world descriptor once and save the resulting occupancy grid
+    :param descriptor: World, or world JSON file path or loaded descriptor dict
+    :param file: path of the grid file to write
+    :param resolution: grid resolution in meters/cell
+    :param physics_limit: physics limit of the world when it is created from a descriptor
+    """
+    world = descriptor if isinstance(descriptor, World) else World(descriptor, physics_limit=physics_limit)
+    save_occupancy_grid(world.get_occupancy_grid(resolution), file)
+
+
 class OccupancyGrid:
     """Stores and provides world information as a 2d boolean numpy array"""
 
@@ -312,10 +901,51 @@ class OccupancyGrid:
         self.resolution = resolution
         self.n_cells = int(size/resolution)
         self.grid = np.zeros((self.n_cells,self.n_cells), dtype=np.bool)
+        self.distance_fields = {}
+        self.cost_layers = {}
+        self.cost_map = None
+        self.version = 0
 
     def add_entity(self, entity):
-        blocked_cells = entity.get_blocked_cells(0.9*self.resolution) #Scaling resolution is a bit of a hack to avoid rounding errors
-        self.fill_blocked_cells(blocked_cells)
+        """Mark every cell that shares some area with the entity's shape as blocked"""
+        window = self.get_cell_window(entity.get_bounding_box())
+        if window is not None:
+            self.rasterize_entity(entity, window, self.grid)
+            self.mark_dirty([window])
+
+    def rasterize_entity(self, entity, window, layer):
+        """Mark the cells of a grid sized boolean layer that overlap the entity, only touching cells inside window"""
+        rows, cols = window
+        x_lo, x_hi, y_lo, y_hi = self.get_cell_edges(rows, cols)
+        layer[rows, cols] |= entity.overlaps_cells(x_lo, x_hi, y_lo, y_hi)
+
+    def get_cell_window(self, bounds):
+        """
+        Get the block of cells covered by an axis aligned box
+        :param bounds: (min_x, min_y, max_x, max_y) of the box in meters
+        :return: (row slice, column slice) into the grid, or None if the box is entirely outside the grid
+        """
+        min_x, min_y, max_x, max_y = bounds
+        half_size = self.size / 2.0
+        col_start = max(int(np.floor((min_x + half_size) / self.resolution)), 0)
+        col_end = min(int(np.floor((max_x + half_size) / self.resolution)) + 1, self.n_cells)
+        row_start = max(int(np.floor((half_size - max_y) / self.resolution)), 0)
+        row_end = min(int(np.floor((half_size - min_y) / self.resolution)) + 1, self.n_cells)
+        if col_start >= col_end or row_start >= row_end:
+            return None
+        return slice(row_start, row_end), slice(col_start, col_end)
+
+    def get_cell_edges(self, rows, cols):
+        """
+        Get the world frame edges of a block of cells
+        :param rows: slice of grid rows
+        :param cols: slice of grid columns
+        :return: x_lo, x_hi as row vectors and y_lo, y_hi as column vectors, in meters, which broadcast to the block shape
+        """
+        half_size = self.size / 2.0
+        x_lo = np.arange(cols.start, cols.stop)[np.newaxis, :] * self.resolution - half_size
+        y_hi = half_size - np.arange(rows.start, rows.stop)[:, np.newaxis] * self.resolution
+        return x_lo, x_lo + self.resolution, y_hi - self.resolution, y_hi
 
     def fill_blocked_cells(self, blocked_cells):
         for cell in blocked_cells:
@@ -324,6 +954,14 @@ class OccupancyGrid:
                 self.grid[index[0], index[1]] = True
             except IndexError:
                 pass
+        self.version += 1
+
+    def mark_dirty(self, windows):
+        """
+        Bump the grid version after cells were written directly through the grid array, so caches keyed on it see the change
+        :param windows: (row slice, column slice) regions that changed
+        """
+        self.version += 1
 
     def is_blocked(self, index):
         return self.grid[index[0], index[1]]
@@ -345,8 +983,8 @@ class OccupancyGrid:
 
     def position_to_2d_index(self, position):
         index = np.array([0, 0])
-        index[1] = int(self.resolution * position[0] + self.size / 2)
-        index[0] = int(-1 * self.resolution * position[1] + self.size / 2)
+        index[1] = int(np.floor((position[0] + self.size / 2) / self.resolution))
+        index[0] = int(np.floor((self.size / 2 - position[1]) / self.resolution))
         return index
 
     def index_to_2d_position(self, index):
@@ -355,65 +993,744 @@ class OccupancyGrid:
         pos[0] = -1 * (index[1] - self.size / 2) / self.resolution
         return pos
 
+    def set_cost_layer(self, name, costs):
+        """
+        Add or replace a named layer of per cell traversal costs, such as terrain cost or a proximity penalty
+        Layers are summed into the cost map that weighted planners read. A cell with infinite cost is treated as blocked.
+        The layer is copied, so later changes to costs need another call
+        :param name: name of the layer
+        :param costs: array of non negative costs, one per cell
+        """
+        costs = np.array(costs, dtype=float)
+        if costs.shape != (self.n_cells, self.n_cells):
+            raise ValueError('Cost layer shape must match the grid shape')
+        if np.any(np.isnan(costs)) or np.any(costs < 0):
+            raise ValueError('Cost layer values must be non negative')
+        self.cost_layers[name] = costs
+        self.cost_map = None
+
+    def remove_cost_layer(self, name):
+        del self.cost_layers[name]
+        self.cost_map = None
+
+    def get_cost_map(self):
+        """
+        Get the sum of all cost layers, or None if the grid has no cost layers and every free cell costs the same
+        The sum is cached until a layer is set or removed, and is read only since every planner shares it
+        """
+        if not self.cost_layers:
+            return None
+        if self.cost_map is None:
+            layers = iter(self.cost_layers.values())
+            cost_map = np.array(next(layers))
+            for layer in layers:
+                cost_map += layer
+            cost_map.flags.writeable = False
+            self.cost_map = cost_map
+        return self.cost_map
+
+    def get_distance_field(self, max_distance=None):
+        """
+        Get the cached DistanceField of this grid, creating it on first use
+        :param max_distance: distances are capped at this many meters, which lets the field update only near changed cells. None keeps exact distances everywhere
+        """
+        if max_distance not in self.distance_fields:
+            self.distance_fields[max_distance] = DistanceField(self, max_distance)
+        return self.distance_fields[max_distance]
+
     def debug_draw(self):
         plt.imshow(self.grid, cmap='Greys', interpolation='nearest')
 
 
-class ScaleConverter:
-
-    def __init__(self, screen, world_scale = 1, cell_resolution = 1):
-        self.window_size = screen.get_width()
-        self.world_scale = world_scale
-        self.cell_resolution = cell_resolution
+def intersect_cell_windows(window_a, window_b):
+    """Get the overlap of two (row slice, column slice) cell windows, or None if they do not overlap"""
+    row_start = max(window_a[0].start, window_b[0].start)
+    row_end = min(window_a[0].stop, window_b[0].stop)
+    col_start = max(window_a[1].start, window_b[1].start)
+    col_end = min(window_a[1].stop, window_b[1].stop)
+    if row_start >= row_end or col_start >= col_end:
+        return None
+    return slice(row_start, row_end), slice(col_start, col_end)
+
+
+def merge_cell_windows(windows, block_size=32):
+    """
+    Merge overlapping (row slice, column slice) cell windows into their bounding windows until no two results overlap
+    Windows are bucketed into square blocks of cells, and each block lists the merged groups in it rather than every window,
+    so a window is only compared with the few groups near it even where windows pile up
+    :return: list of non overlapping windows covering every cell of the input windows
+    """
+    boxes = [(rows.start, rows.stop, cols.start, cols.stop) for rows, cols in windows]
+    while True:
+        parents = list(range(len(boxes)))
+        group_boxes = list(boxes)
+
+        def find(number):
+            while parents[number] != number:
+                parents[number] = parents[parents[number]]
+                number = parents[number]
+            return number
+
+        blocks = {}  # (block row, block col) -> groups with a window touching the block
+        for number, (row_start, row_end, col_start, col_end) in enumerate(boxes):
+            for block_row in range(row_start // block_size, (row_end - 1) // block_size + 1):
+                for block_col in range(col_start // block_size, (col_end - 1) // block_size + 1):
+                    key = (block_row, block_col)
+                    root = find(number)
+                    groups = set()
+                    for other in blocks.get(key, ()):
+                        other = find(other)
+                        if other == root or other in groups:
+                            continue
+                        other_box = group_boxes[other]
+                        if other_box[0] < row_end and row_start < other_box[1] and other_box[2] < col_end and col_start < other_box[3]:
+                            root_box = group_boxes[root]
+                            parents[other] = root
+                            group_boxes[root] = (min(root_box[0], other_box[0]), max(root_box[1], other_box[1]),
+                                                 min(root_box[2], other_box[2]), max(root_box[3], other_box[3]))
+                        else:
+                            groups.add(other)
+                    groups.add(root)
+                    blocks[key] = groups
+
+        merged = [group_boxes[number] for number in range(len(boxes)) if parents[number] == number]
+        if len(merged) == len(boxes):
+            return [(slice(row_start, row_end), slice(col_start, col_end)) for row_start, row_end, col_start, col_end in merged]
+        # The bounding window of a group can overlap windows that were never compared with it, so check again
+        boxes = merged
+
+
+class IncrementalOccupancyGrid(OccupancyGrid):
+    """Occupancy grid that bakes static entities into a base layer once and only redraws the cells that moving entities touch"""
 
-        print('World scale set to '+str(self.world_scale)+' pixels/meter')
-        print('Cell resolution set to ' +str(self.cell_resolution)+' meters/cell')
+    def __init__(self, size, resolution):
+        """
+        Creates an incrementally maintained occupancy grid
+        :param size: scalar value representing the length of the grid in meters on one size
+        :param resolution: scalar value representing the size mapping of meters to cells. Units are meters/cell
+        """
+        super(IncrementalOccupancyGrid, self).__init__(size, resolution)
+        self.static_grid = np.zeros_like(self.grid)
+        self.static_entities = {}
+        self.dynamic_entities = {}  # entity id -> [entity, last bounding box, last cell window]
+        # Moving entities indexed by their last bounding box, so redraw only visits the entities near a dirty window
+        self.dynamic_hash = SpatialHash(16 * resolution)
+        self.subscribers = []
+
+    def subscribe(self, callback):
+        """
+        Register a callback to be told about changed cells
+        :param callback: function called as callback(rows, cols) with the row and column slices of each dirty region
+        """
+        self.subscribers.append(callback)
 
-    def
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
 
-    def convert_length_from_pixels_to_meters(pixel_length, world_scale):
+    def add_entity(self, entity):
+        """Add an entity to the grid. Static entities go into the base layer, everything else is tracked and redrawn as it moves"""
+        bounds = entity.get_bounding_box()
+        window = self.get_cell_window(bounds)
+        if isinstance(entity, Static):
+            self.static_entities[entity.get_id()] = entity
+            if window is not None:
+                self.rasterize_entity(entity, window, self.static_grid)
+        else:
+            self.dynamic_entities[entity.get_id()] = [entity, bounds, window]
+            self.dynamic_hash.insert(entity, bounds)
+        if window is not None:
+            self.rasterize_entity(entity, window, self.grid)
+            self.mark_dirty([window])
+
+    def remove_entity(self, entity):
+        """Remove an entity from the grid and clear the cells it covered"""
+        if entity.get_id() in self.static_entities:
+            del self.static_entities[entity.get_id()]
+            window = self.get_cell_window(entity.get_bounding_box())
+            if window is not None:
+                rows, cols = window
+                self.static_grid[rows, cols] = False
+                for static_entity in self.static_entities.values():
+                    static_window = self.get_cell_window(static_entity.get_bounding_box())
+                    if static_window is None:
+                        continue
+                    overlap = intersect_cell_windows(window, static_window)
+                    if overlap is not None:
+                        self.rasterize_entity(static_entity, overlap, self.static_grid)
+                self.redraw([window])
+        elif entity.get_id() in self.dynamic_entities:
+            _, _, window = self.dynamic_entities.pop(entity.get_id())
+            self.dynamic_hash.remove(entity)
+            if window is not None:
+                self.redraw([window])
+
+    def update(self):
+        """Redraw the regions covered by moving entities before and after they moved. Call this after the entities have been stepped"""
+        dirty_windows = []
+        moved = []
+        for record in self.dynamic_entities.values():
+            entity, old_bounds, old_window = record
+            new_bounds = entity.get_bounding_box()
+            if new_bounds == old_bounds:
+                continue
+            new_window = self.get_cell_window(new_bounds)
+            record[1] = new_bounds
+            record[2] = new_window
+            moved.append(record)
+            dirty_windows.extend(window for window in (old_window, new_window) if window is not None)
+        if moved:
+            self.dynamic_hash.update([record[0] for record in moved], [record[1] for record in moved])
+        if dirty_windows:
+            self.redraw(dirty_windows)
+
+    def get_window_bounds(self, window):
+        """Get the (min_x, min_y, max_x, max_y) box in meters covered by a (row slice, column slice) cell window"""
+        rows, cols = window
+        half_size = self.size / 2.0
+        return (cols.start * self.resolution - half_size, half_size - rows.stop * self.resolution,
+                cols.stop * self.resolution - half_size, half_size - rows.start * self.resolution)
+
+    def redraw(self, windows):
+        """Reset the given cell windows to the static layer and draw the moving entities back over them
+        Overlapping windows are merged first, so no cell is redrawn twice, and each window only rasterizes the moving
+        entities the spatial hash finds near it"""
+        windows = merge_cell_windows(windows)
+        for rows, cols in windows:
+            self.grid[rows, cols] = self.static_grid[rows, cols]
+        for window in windows:
+            for entity in self.dynamic_hash.get_candidates(self.get_window_bounds(window)):
+                entity_window = self.dynamic_entities[entity.get_id()][2]
+                if entity_window is None:
+                    continue
+                overlap = intersect_cell_windows(window, entity_window)
+                if overlap is not None:
+                    self.rasterize_entity(entity, overlap, self.grid)
+        self.mark_dirty(windows)
+
+    def mark_dirty(self, windows):
+        """Bump the grid version and notify subscribers about each changed region"""
+        self.version += 1
+        for rows, cols in windows:
+            for callback in self.subscribers:
+                callback(rows, cols)
+
+
+class TiledOccupancyGrid(OccupancyGrid):
+    """Occupancy grid stored as square tiles of bit-packed cells (8 cells per byte).
+    Tiles are only allocated once a cell in them is blocked, so empty regions of very large maps cost nothing.
+    Tiles are never modified in place, a write packs a new array for the tile. Snapshots can therefore share every tile with
+    the grid they were taken from, and a tile is only copied when one side writes to it.
+    There is no dense grid array, so the grid planners, PlanCache and DistanceField cannot take this grid. Read cells with
+    is_blocked or get_window, or convert a map small enough to plan on with to_occupancy_grid"""
+
+    def __init__(self, size, resolution, tile_size=256):
         """
-        Convert an absolute length into meters from pixels, assumes a uniformly scaled, square world
-        :param pixel_length: length in pixels to convert
-        :param world_scale: scaling factor for the world
-        :return: length in meters
+        Creates a tiled occupancy grid
+        :param size: scalar value representing the length of the grid in meters on one size
+        :param resolution: scalar value representing the size mapping of meters to cells. Units are meters/cell
+        :param tile_size: width of the square tiles in cells, must be a multiple of 8
         """
-        return pixel_length / world_scale
+        if tile_size % 8 != 0:
+            raise ValueError('Tile size must be a multiple of 8')
+        self.size = size
+        self.resolution = resolution
+        self.n_cells = int(size/resolution)
+        self.tile_size = tile_size
+        self.tiles = {}  # (tile row, tile col) -> (tile_size, tile_size/8) uint8 array
+        self.distance_fields = {}
+        self.cost_layers = {}
+        self.cost_map = None
+        self.version = 0
+
+    @property
+    def grid(self):
+        """Raises a ValueError, since unpacking the whole map on every read would allocate one byte per cell"""
+        raise ValueError('TiledOccupancyGrid has no dense grid, read cells with is_blocked or get_window, '
+                         'or convert a small map with to_occupancy_grid')
+
+    def to_occupancy_grid(self):
+        """Get a dense OccupancyGrid copy of the whole map. This allocates one byte per cell"""
+        dense = OccupancyGrid(self.size, self.resolution)
+        dense.grid = self.get_window((slice(0, self.n_cells), slice(0, self.n_cells)))
+        return dense
+
+    @property
+    def nbytes(self):
+        """Memory used by the allocated tiles"""
+        return sum(tile.nbytes for tile in self.tiles.values())
 
-    def convert_length_from_meters_to_pixels(meter_length, world_scale):
+    def is_blocked(self, index):
+        row = int(index[0])
+        col = int(index[1])
+        tile = self.tiles.get((row // self.tile_size, col // self.tile_size))
+        if tile is None:
+            return False
+        local_col = col % self.tile_size
+        return bool((tile[row % self.tile_size, local_col >> 3] >> (7 - (local_col & 7))) & 1)
+
+    def get_tile_windows(self, window):
+        """Split a (row slice, column slice) window into (tile key, slices into the tile, slices into the window) pieces"""
+        rows, cols = window
+        tile_size = self.tile_size
+        pieces = []
+        for tile_row in range(rows.start // tile_size, (rows.stop - 1) // tile_size + 1):
+            row_start = max(rows.start, tile_row * tile_size)
+            row_end = min(rows.stop, (tile_row + 1) * tile_size)
+            for tile_col in range(cols.start // tile_size, (cols.stop - 1) // tile_size + 1):
+                col_start = max(cols.start, tile_col * tile_size)
+                col_end = min(cols.stop, (tile_col + 1) * tile_size)
+                pieces.append(((tile_row, tile_col),
+                               (slice(row_start - tile_row * tile_size, row_end - tile_row * tile_size),
+                                slice(col_start - tile_col * tile_size, col_end - tile_col * tile_size)),
+                               (slice(row_start - rows.start, row_end - rows.start),
+                                slice(col_start - cols.start, col_end - cols.start))))
+        return pieces
+
+    def get_window(self, window):
+        """Get a dense boolean copy of a (row slice, column slice) block of cells"""
+        rows, cols = window
+        block = np.zeros((rows.stop - rows.start, cols.stop - cols.start), dtype=bool)
+        for key, tile_slices, block_slices in self.get_tile_windows(window):
+            tile = self.tiles.get(key)
+            if tile is not None:
+                block[block_slices] = np.unpackbits(tile, axis=1).view(bool)[tile_slices]
+        return block
+
+    def set_window(self, window, values, combine=False):
         """
-        Convert and absolute length into pixels from meters, assumes a uniformly scaled, square world
-        :param meter_length: length in meters to convert
-        :param world_scale: scaling factor for the world
-        :return: length in pixels, note this will be rounded to an integer pixel value, possibly with loss of precision
+        Write a dense boolean block of cells into the grid
+        :param window: (row slice, column slice) of the cells to write
+        :param values: boolean array with the shape of the window
+        :param combine: if True, values are ORed into the existing cells instead of replacing them
         """
-        return int(meter_length * world_scale)
+        values = np.asarray(values, dtype=bool)
+        for key, tile_slices, block_slices in self.get_tile_windows(window):
+            piece = values[block_slices]
+            tile = self.tiles.get(key)
+            if tile is None:
+                if not piece.any():
+                    continue
+                cells = np.zeros((self.tile_size, self.tile_size), dtype=bool)
+            else:
+                cells = np.unpackbits(tile, axis=1).view(bool)
+            if combine:
+                cells[tile_slices] |= piece
+            else:
+                cells[tile_slices] = piece
+            if cells.any():
+                self.tiles[key] = np.packbits(cells, axis=1)
+            else:
+                self.tiles.pop(key, None)
+        self.version += 1
 
-    def pixels_to_world_frame(pixel_coords, window_size, world_scale):
+    def add_entity(self, entity):
+        """Mark every cell that shares some area with the entity's shape as blocked"""
+        window = self.get_cell_window(entity.get_bounding_box())
+        if window is None:
+            return
+        x_lo, x_hi, y_lo, y_hi = self.get_cell_edges(*window)
+        self.set_window(window, entity.overlaps_cells(x_lo, x_hi, y_lo, y_hi), combine=True)
+
+    def fill_blocked_cells(self, blocked_cells):
+        """Mark the cells containing the given positions as blocked, unpacking and packing each touched tile once"""
+        positions = np.asarray(blocked_cells, dtype=float).reshape(-1, 2)
+        cols = np.floor((positions[:, 0] + self.size / 2) / self.resolution).astype(np.int64)
+        rows = np.floor((self.size / 2 - positions[:, 1]) / self.resolution).astype(np.int64)
+        inside = (rows >= 0) & (rows < self.n_cells) & (cols >= 0) & (cols < self.n_cells)
+        rows = rows[inside]
+        cols = cols[inside]
+        tile_keys = (rows // self.tile_size) * (self.n_cells // self.tile_size + 1) + cols // self.tile_size
+        order = np.argsort(tile_keys, kind='stable')
+        for group in np.split(order, np.flatnonzero(np.diff(tile_keys[order])) + 1):
+            if len(group) == 0:
+                continue
+            row_start = rows[group[0]] // self.tile_size * self.tile_size
+            col_start = cols[group[0]] // self.tile_size * self.tile_size
+            window = (slice(row_start, min(row_start + self.tile_size, self.n_cells)),
+                      slice(col_start, min(col_start + self.tile_size, self.n_cells)))
+            block = np.zeros((window[0].stop - row_start, window[1].stop - col_start), dtype=bool)
+            block[rows[group] - row_start, cols[group] - col_start] = True
+            self.set_window(window, block, combine=True)
+
+    def snapshot(self):
+        """Get a copy-on-write copy of the grid. No cell data is copied until one of the two grids changes a shared tile"""
+        copy = TiledOccupancyGrid(self.size, self.resolution, self.tile_size)
+        copy.tiles = dict(self.tiles)
+        return copy
+
+    def get_grid(self):
+        """Get a copy-on-write snapshot of the grid instead of a dense copy"""
+        return self.snapshot()
+
+
+def column_distances(blocked):
+    """Distance in cells from each cell to the nearest blocked cell in the same column, using one sweep down and one sweep up"""
+    n_rows = blocked.shape[0]
+    distance = np.where(blocked, 0.0, np.inf)
+    for row in range(1, n_rows):
+        np.minimum(distance[row], distance[row - 1] + 1, out=distance[row])
+    for row in range(n_rows - 2, -1, -1):
+        np.minimum(distance[row], distance[row + 1] + 1, out=distance[row])
+    return distance
+
+
+def lower_envelope_transform(f):
+    """
+    One dimensional squared distance transform of every row of f (Felzenszwalb and Huttenlocher), processing all rows at once
+    :param f: (rows, n) array of squared distances along the other axis, with large finite values where there are none
+    :return: (rows, n) array of min over q' of (q - q')^2 + f[q']
+    """
+    n_lines, n = f.shape
+    lines = np.arange(n_lines)
+    positions = np.arange(n, dtype=float)
+    v = np.zeros((n_lines, n), dtype=np.int64)
+    z = np.full((n_lines, n + 1), np.inf)
+    z[:, 0] = -np.inf
+    k = np.zeros(n_lines, dtype=np.int64)
+
+    # Build the lower envelope of the parabolas rooted at each position
+    f_plus_q2 = f + positions * positions
+    for q in range(1, n):
+        while True:
+            vk = v[lines, k]
+            s = (f_plus_q2[:, q] - f_plus_q2[lines, vk]) / (2.0 * (q - vk))
+            pop = s <= z[lines, k]
+            if not pop.any():
+                break
+            k[pop] -= 1
+        k += 1
+        v[lines, k] = q
+        z[lines, k] = s
+        z[lines, k + 1] = np.inf
+
+    # Read the envelope back out at each position
+    result = np.empty_like(f)
+    k[:] = 0
+    for q in range(n):
+        while True:
+            advance = z[lines, k + 1] < q
+            if not advance.any():
+                break
+            k[advance] += 1
+        vk = v[lines, k]
+        result[:, q] = (q - vk) ** 2 + f[lines, vk]
+    return result
+
+
+def distance_transform(blocked):
+    """
+    Exact Euclidean distance transform in linear time using vectorized passes
+    :param blocked: 2d boolean array of blocked cells
+    :return: float array with the distance in cells from each cell center to the nearest blocked cell center, inf if nothing is blocked
+    """
+    blocked = np.asarray(blocked, dtype=bool)
+    if not blocked.any():
+        return np.full(blocked.shape, np.inf)
+    no_obstacle = 1e20
+    columns = column_distances(blocked)
+    squared = np.where(np.isinf(columns), no_obstacle, columns * columns)
+    squared = lower_envelope_transform(squared)
+    distance = np.sqrt(squared)
+    distance[squared >= no_obstacle / 2] = np.inf
+    return distance
+
+
+class DistanceField:
+    """Cached distance from every cell to the nearest blocked cell of an occupancy grid, with the configuration space
+    grids and clearance costs derived from it. When the grid changes only the cells within max_distance of the change are recomputed"""
+
+    def __init__(self, grid, max_distance=None):
         """
-        Coinvert pixel coordinates into world coordinates
-        :param pixel_coords: 2d pixel coordinates
-        :param window_size: size of display window in pixels
-        :param world_scale: scaling value of pixels/meter
-        :return: Numpy vector of world coordinates
+        Create a distance field for a grid, normally through OccupancyGrid.get_distance_field
+        :param grid: OccupancyGrid to measure distances in
+        :param max_distance: distances are capped at this many meters so changes only affect nearby cells. None keeps exact distances, and any change recomputes the whole field
         """
-        world_coords = np.array([0, 0])
-        world_coords[0] = (pixel_coords[0] - window_size / 2) / world_scale
-        world_coords[1] = -1 * (pixel_coords[1] - window_size / 2) / world_scale
-        return world_coords
-
-    def world_to_pixel_frame(world_coords, window_size, world_scale):
+        self.grid = grid
+        self.max_distance = max_distance
+        self.blocked = np.array(grid.grid, dtype=bool)
+        self.distance = self.compute(self.blocked)
+        self.pending_windows = []
+        self.inflated_grids = {}
+        self.version = 0
+        if hasattr(grid, 'subscribe'):
+            grid.subscribe(self.on_cells_changed)
+
+    def on_cells_changed(self, rows, cols):
+        """
+        Occupancy grid subscriber callback, records a dirty region to be checked on the next access
+        Once an inflated grid has been handed out the field is updated right away instead, so that planners subscribed to
+        the inflated grid hear about the change as soon as the source grid does
+        """
+        self.pending_windows.append((rows, cols))
+        if self.inflated_grids:
+            self.update()
+
+    def compute(self, blocked):
+        """Distances in meters for a block of cells, capped at max_distance"""
+        distance = distance_transform(blocked) * self.grid.resolution
+        if self.max_distance is not None:
+            np.minimum(distance, self.max_distance, out=distance)
+        return distance
+
+    def get_margin(self):
+        """Number of cells around a change whose capped distance can be affected by it"""
+        return int(np.ceil(self.max_distance / self.grid.resolution)) + 1
+
+    def update(self):
+        """Bring the field up to date with the grid, recomputing only around changed cells when distances are capped"""
+        current = self.grid.grid
+        if hasattr(self.grid, 'subscribe'):
+            changed_rows = []
+            changed_cols = []
+            for rows, cols in self.pending_windows:
+                d_rows, d_cols = np.nonzero(current[rows, cols] != self.blocked[rows, cols])
+                changed_rows.extend(d_rows + rows.start)
+                changed_cols.extend(d_cols + cols.start)
+        else:
+            changed_rows, changed_cols = np.nonzero(current != self.blocked)
+        self.pending_windows = []
+        if len(changed_rows) == 0:
+            return
+
+        n_rows, n_cols = self.blocked.shape
+        if self.max_distance is None:
+            self.blocked = np.array(current, dtype=bool)
+            self.distance = self.compute(self.blocked)
+            regions = [(slice(0, n_rows), slice(0, n_cols))]
+        else:
+            changed_rows = np.asarray(changed_rows, dtype=np.int64)
+            changed_cols = np.asarray(changed_cols, dtype=np.int64)
+            self.blocked[changed_rows, changed_cols] = current[changed_rows, changed_cols]
+
+            # Computing the capped distances of a region exactly needs every obstacle within a further margin around it
+            margin = self.get_margin()
+            regions = self.get_changed_regions(changed_rows, changed_cols)
+            for rows, cols in regions:
+                crop_row_start = max(rows.start - margin, 0)
+                crop_col_start = max(cols.start - margin, 0)
+                crop = self.blocked[crop_row_start:min(rows.stop + margin, n_rows), crop_col_start:min(cols.stop + margin, n_cols)]
+                crop_distance = self.compute(crop)
+                self.distance[rows, cols] = crop_distance[rows.start - crop_row_start:rows.stop - crop_row_start,
+                                                          cols.start - crop_col_start:cols.stop - crop_col_start]
+
+        self.version += 1
+        for robot_radius, inflated in self.inflated_grids.items():
+            for rows, cols in regions:
+                inflated.grid[rows, cols] = self.distance[rows, cols] <= robot_radius
+            inflated.mark_dirty(regions)
+
+    def get_changed_regions(self, changed_rows, changed_cols):
+        """
+        Group changed cells into non overlapping regions holding every cell whose capped distance they can affect
+        Changed cells are bucketed into blocks one margin wide and the changes in each block grow by the margin. Only regions
+        that then overlap are merged, so changes in different parts of the map are recomputed separately
+        :return: list of (row slice, column slice) regions
+        """
+        margin = self.get_margin()
+        n_rows, n_cols = self.blocked.shape
+        keys = (changed_rows // margin) * (n_cols // margin + 1) + changed_cols // margin
+        order = np.argsort(keys, kind='stable')
+        windows = []
+        for group in np.split(order, np.flatnonzero(np.diff(keys[order])) + 1):
+            rows = changed_rows[group]
+            cols = changed_cols[group]
+            windows.append((slice(max(int(rows.min()) - margin, 0), min(int(rows.max()) + margin + 1, n_rows)),
+                            slice(max(int(cols.min()) - margin, 0), min(int(cols.max()) + margin + 1, n_cols))))
+        return merge_cell_windows(windows)
+
+    def get_distance(self):
+        """Get the distance in meters from each cell to the nearest blocked cell, capped at max_distance"""
+        self.update()
+        return self.distance
+
+    def get_inflated_grid(self, robot_radius):
+        """
+        Get the configuration space grid for a round robot, where every cell within robot_radius meters of an obstacle is blocked
+        The same IncrementalOccupancyGrid is returned on every call and updated in place, notifying its subscribers of the regions that changed.
+        When the source grid is an IncrementalOccupancyGrid this happens as soon as it reports a change, for example in World.step.
+        A plain OccupancyGrid sends no notifications, so its inflated grid only catches up on the next call to this method or get_distance
+        """
+        if self.max_distance is not None and robot_radius >= self.max_distance:
+            raise ValueError('Robot radius must be smaller than the distance field max_distance')
+        self.update()
+        if robot_radius not in self.inflated_grids:
+            inflated = IncrementalOccupancyGrid(self.grid.size, self.grid.resolution)
+            inflated.grid[:] = self.distance <= robot_radius
+            self.inflated_grids[robot_radius] = inflated
+        return self.inflated_grids[robot_radius]
+
+    def get_clearance_cost(self, robot_radius, influence_distance, weight=1.0):
+        """
+        Get a cost layer that discourages passing close to obstacles
+        :param robot_radius: cells within this distance of an obstacle cost inf
+        :param influence_distance: cost falls linearly from weight at robot_radius to 0 at robot_radius + influence_distance
+        :param weight: cost right next to the inflated obstacles
+        :return: float array with one cost per cell
+        """
+        if self.max_distance is not None and robot_radius + influence_distance > self.max_distance:
+            raise ValueError('Robot radius plus influence distance must not exceed the distance field max_distance')
+        distance = self.get_distance()
+        cost = weight * np.clip(1.0 - (distance - robot_radius) / influence_distance, 0.0, 1.0)
+        cost[distance <= robot_radius] = np.inf
+        return cost
+
+
+def get_overlap_interval(box, velocity, target):
+    """
+    Find when a box moving with constant velocity overlaps a fixed box
+    :param box: (min_x, min_y, max_x, max_y) of the moving box at time 0, in meters
+    :param velocity: 2d velocity of the moving box in meters/second
+    :param target: (min_x, min_y, max_x, max_y) of the fixed box
+    :return: (start, end) times of the overlap, which may start before 0 or end at inf, or None if the boxes never overlap
+    """
+    start = -np.inf
+    end = np.inf
+    for axis in range(2):
+        lo = box[axis]
+        hi = box[axis + 2]
+        target_lo = target[axis]
+        target_hi = target[axis + 2]
+        v = velocity[axis]
+        if v == 0:
+            if hi <= target_lo or lo >= target_hi:
+                return None
+            continue
+        # Overlap along this axis while lo + v t < target_hi and hi + v t > target_lo
+        t0 = (target_lo - hi) / v
+        t1 = (target_hi - lo) / v
+        if t0 > t1:
+            t0, t1 = t1, t0
+        start = max(start, t0)
+        end = min(end, t1)
+    if start >= end:
+        return None
+    return float(start), float(end)
+
+
+class OccupancyPrediction:
+    """Predicted occupancy of grid cells over time, extrapolating constant velocity entities from their current state
+    For each cell it gives the safe intervals, the maximal time intervals during which no moving entity's bounding box covers
+    the cell. Intervals are computed lazily the first time a cell is asked for, using a SpatialHash of the swept boxes of the entities"""
+
+    def __init__(self, grid, moving_entities, horizon, hash_cell_size=5.0):
         """
-        Convert world coordinates to pixel coordiantes
-        :param world_coords: 2d world coordinates in meters
-        :param window_size: size of display window in pixels
-        :param world_scale: scaling value of pixels/meter
-        :return: Numpy vector of pixel coordinates, note this will be rounded to an integer pixel value, possibly with loss of precision
+        Predict occupancy from the current entity positions, with time 0 being now
+        :param grid: OccupancyGrid of the obstacles that never move, which also sets the cell geometry
+        :param moving_entities: entities to extrapolate with their current velocity
+        :param horizon: seconds to predict ahead. Entities only count if they reach a cell before the horizon
+        :param hash_cell_size: cell size in meters of the spatial hash over swept boxes
         """
-        pixel_coords = np.array([0, 0])
-        pixel_coords[0] = int(world_scale * world_coords[0] + window_size / 2)
-        pixel_coords[1] = int(-1 * world_scale * world_coords[1] + window_size / 2)
-        return pixel_coords
+        self.grid = grid
+        self.horizon = horizon
+        self.swept_hash = SpatialHash(hash_cell_size)
+        self.boxes = {}
+        self.velocities = {}
+        for entity in moving_entities:
+            box = np.array(entity.get_bounding_box(), dtype=float)
+            velocity = np.array(entity.vel, dtype=float)
+            shift = np.tile(velocity * horizon, 2)
+            self.boxes[entity] = box
+            self.velocities[entity] = velocity
+            self.swept_hash.insert(entity, np.concatenate((np.minimum(box, box + shift)[:2], np.maximum(box, box + shift)[2:])))
+        self.intervals = {}
+
+    @property
+    def shape(self):
+        return self.grid.grid.shape
+
+    def get_cell_box(self, row, col):
+        """Get the (min_x, min_y, max_x, max_y) bounds of a cell in meters"""
+        x_lo, x_hi, y_lo, y_hi = self.grid.get_cell_edges(slice(row, row + 1), slice(col, col + 1))
+        return x_lo.item(), y_lo.item(), x_hi.item(), y_hi.item()
+
+    def get_safe_intervals(self, row, col):
+        """
+        Get the safe intervals of a cell
+        :return: list of (start, end) times in increasing order, where the last end may be inf. Static obstacle cells have none
+        """
+        key = (row, col)
+        intervals = self.intervals.get(key)
+        if intervals is not None:
+            return intervals
+
+        intervals = []
+        if not self.grid.grid[row, col]:
+            cell_box = self.get_cell_box(row, col)
+            unsafe = []
+            for entity in self.swept_hash.query_box(cell_box):
+                overlap = get_overlap_interval(self.boxes[entity], self.velocities[entity], cell_box)
+                if overlap is not None and overlap[1] > 0 and overlap[0] < self.horizon:
+                    unsafe.append(overlap)
+            unsafe.sort()
+            start = 0.0
+            for unsafe_start, unsafe_end in unsafe:
+                if unsafe_start > start:
+                    intervals.append((start, unsafe_start))
+                start = max(start, unsafe_end)
+            if start < np.inf:
+                intervals.append((start, np.inf))
+        self.intervals[key] = intervals
+        return intervals
+
+    def is_safe(self, row, col, time):
+        """Check whether a cell is predicted to be free at a time"""
+        return any(start <= time <= end for start, end in self.get_safe_intervals(row, col))
+
+
+class ScaleConverter:
+
+    def __init__(self, screen, world_scale = 1, cell_resolution = 1):
+        self.window_size = screen.get_width()
+        self.world_scale = world_scale
+        self.cell_resolution = cell_resolution
+
+        print('World scale set to '+str(self.world_scale)+' pixels/meter')
+        print('Cell resolution set to ' +str(self.cell_resolution)+' meters/cell')
+
+
+def convert_length_from_pixels_to_meters(pixel_length, world_scale):
+    """
+    Convert an absolute length into meters from pixels, assumes a uniformly scaled, square world
+    :param pixel_length: length in pixels to convert
+    :param world_scale: scaling factor for the world
+    :return: length in meters
+    """
+    return pixel_length / world_scale
+
+def convert_length_from_meters_to_pixels(meter_length, world_scale):
+    """
+    Convert and absolute length into pixels from meters, assumes a uniformly scaled, square world
+    :param meter_length: length in meters to convert
+    :param world_scale: scaling factor for the world
+    :return: length in pixels, note this will be rounded to an integer pixel value, possibly with loss of precision
+    """
+    return int(meter_length * world_scale)
+
+def pixels_to_world_frame(pixel_coords, window_size, world_scale):
+    """
+    Coinvert pixel coordinates into world coordinates
+    :param pixel_coords: 2d pixel coordinates
+    :param window_size: size of display window in pixels
+    :param world_scale: scaling value of pixels/meter
+    :return: Numpy vector of world coordinates
+    """
+    world_coords = np.array([0, 0])
+    world_coords[0] = (pixel_coords[0] - window_size / 2) / world_scale
+    world_coords[1] = -1 * (pixel_coords[1] - window_size / 2) / world_scale
+    return world_coords
+
+def world_to_pixel_frame(world_coords, window_size, world_scale):
+    """
+    Convert world coordinates to pixel coordiantes
+    :param world_coords: 2d world coordinates in meters
+    :param window_size: size of display window in pixels
+    :param world_scale: scaling value of pixels/meter
+    :return: Numpy vector of pixel coordinates, note this will be rounded to an integer pixel value, possibly with loss of precision
+    """
+    pixel_coords = np.array([0, 0])
+    pixel_coords[0] = int(world_scale * world_coords[0] + window_size / 2)
+    pixel_coords[1] = int(-1 * world_scale * world_coords[1] + window_size / 2)
+    return pixel_coords
 
 
 
@@ -0,0 +1,68 @@
+import unittest
+import numpy as np
+import Agent
+
+
+class TestAgent(unittest.TestCase):
+
+    def test_step_IntegratesAcceleration(self):
+        agent = Agent.Agent()
+        agent.set_acc(np.array([1, 2]))
+        agent.step(0.5)
+        self.assertTrue(np.allclose([0.5, 1], agent.get_vel()))
+        self.assertTrue(np.allclose([0.25, 0.5], agent.get_pos()))
+
+    def test_step_LimitsJerk(self):
+        agent = Agent.Agent(max_jerk=50)
+        agent.set_acc([30, 40])
+        self.assertTrue(np.allclose([0, 0], agent.get_acc()))
+        agent.step(0.1)
+        self.assertTrue(np.allclose([3, 4], agent.get_acc()))
+        agent.step(0.05)
+        self.assertTrue(np.allclose([4.5, 6], agent.get_acc()))
+        self.assertTrue(np.allclose([30, 40], agent.acc_command))
+
+    def test_step_LimitsVelocityAndPosition(self):
+        agent = Agent.Agent(max_vel=2, max_jerk=None, pos_limit=1)
+        agent.set_acc([100, 0])
+        agent.step(1)
+        self.assertTrue(np.allclose([1, 0], agent.get_pos()))
+        self.assertTrue(np.allclose([0, 0], agent.get_vel()))
+        agent.set_acc([0, 1])
+        agent.step(0.5)
+        self.assertTrue(np.allclose([0, 0.5], agent.get_vel()))
+
+
+class TestAgentSwarm(unittest.TestCase):
+
+    def test_step_MatchesIndividualAgents(self):
+        rng = np.random.default_rng(2)
+        accelerations = rng.uniform(-20, 20, (30, 2))
+        agents = [Agent.Agent(max_vel=3, max_jerk=50, pos_limit=4) for _ in range(30)]
+        swarm_agents = [Agent.Agent() for _ in range(30)]
+        swarm = Agent.AgentSwarm(swarm_agents, capacity=4, max_vel=3, max_jerk=50, pos_limit=4)
+        for _ in range(20):
+            for agent, acc in zip(agents, accelerations):
+                agent.set_acc(acc)
+                agent.step(0.1)
+            swarm.set_accelerations(accelerations)
+            swarm.step(0.1)
+        self.assertTrue(np.allclose([agent.get_pos() for agent in agents], swarm.positions))
+        self.assertTrue(np.allclose([agent.get_vel() for agent in agents], swarm.velocities))
+        self.assertTrue(np.allclose([agent.get_acc() for agent in agents], swarm.accelerations))
+
+    def test_agentView_ReadsAndWritesSwarmRow(self):
+        agent = Agent.Agent()
+        agent.set_acc([1, 0])
+        agent.step(1)
+        swarm = Agent.AgentSwarm()
+        swarm.create_agents(np.zeros((3, 2)))
+        swarm.add_agent(agent)
+        self.assertTrue(np.allclose([1, 0], swarm.positions[3]))
+        agent.set_acc([0, 1])
+        agent.step(1)
+        self.assertTrue(np.allclose([2, 1], swarm.positions[3]))
+        self.assertTrue(np.allclose([0, 0], swarm.positions[:3]))
+        swarm.step(1)
+        self.assertTrue(np.allclose([3, 3], agent.get_pos()))
+        self.assertTrue(np.allclose([0, 0], swarm.velocities[:3]))
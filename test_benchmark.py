@@ -0,0 +1,49 @@
+import numpy as np
+import Benchmark
+import Planner
+import World
+from world_test_case import WorldTestCase
+
+TINY_SETTINGS = {'grid_resolutions': [1],
+                 'grid_entity_counts': [3],
+                 'object_step_entity_counts': [3],
+                 'store_step_entity_counts': [3],
+                 'moving_grid_entity_counts': [3],
+                 'astar_grid_sizes': [15],
+                 'mdp_grid_sizes': [15],
+                 'potential_field_agent_counts': [4],
+                 'agent_step_counts': [3],
+                 'repeats': 2}
+
+
+class TestBenchmark(WorldTestCase):
+
+    def test_makeMazeGrid_CornersAreConnected(self):
+        for size in [31, 64]:
+            occ_grid = World.occupancy_grid_from_numpy_array(Benchmark.make_maze_grid(size))
+            path, explored = Planner.AStarPlanner().create_plan([0, 0], [size - 1, size - 1], occ_grid)
+            self.assertTrue(path)
+
+    def test_makeClutteredGrid_CornersAreConnected(self):
+        occ_grid = World.occupancy_grid_from_numpy_array(Benchmark.make_cluttered_grid(256))
+        path, explored = Planner.AStarPlanner(record_explored=False).create_plan([0, 0], [255, 255], occ_grid)
+        self.assertTrue(path)
+
+    def test_runBenchmarks_MeasuresEveryCase(self):
+        results = Benchmark.run_benchmarks(TINY_SETTINGS)
+        self.assertEqual(14, len(results))
+        for result in results.values():
+            self.assertLessEqual(result['median'], result['p95'])
+            self.assertGreaterEqual(result['peak_memory'], 0)
+
+    def test_potentialFieldLoop_MatchesVectorized(self):
+        world = Benchmark.make_world(200, physics_limit=20)
+        planner = Planner.PotentialFieldPlanner(agent_radius=0.3)
+        positions, goals, velocities = Benchmark.make_agent_batch(50, 20)
+        expected = Benchmark.potential_field_loop(planner, positions, goals, world, velocities)
+        self.assertTrue(np.allclose(expected, planner.compute_accelerations(positions, goals, world, velocities)))
+
+    def test_compareToBaseline_FlagsSlowdownsBeyondTolerance(self):
+        baseline = {'a': {'median': 1.0}, 'b': {'median': 1.0}}
+        results = {'a': {'median': 1.1}, 'b': {'median': 1.5}, 'c': {'median': 9.0}}
+        self.assertEqual([('b', 1.0, 1.5)], Benchmark.compare_to_baseline(results, baseline, tolerance=0.2))
@@ -1,7 +1,15 @@
 import unittest
+import gc
+import math
+import os
+import shutil
+import tempfile
+import weakref
 import numpy as np
 import Planner
 import World
+import Agent
+from world_test_case import WorldTestCase
 
 
 class TestAStarPlanner(unittest.TestCase):
@@ -63,4 +71,808 @@ class TestAStarPlanner(unittest.TestCase):
         path, explored = p.create_plan(start, end, self.occ_grid)
         self.assertEqual(len(expected_path), len(path))
         path_match = [np.all(path[i] == expected_path[i]) for i in range(len(path))]
-        self.assertTrue(np.all(path_match))
\ No newline at end of file
+        self.assertTrue(np.all(path_match))
+
+    def test_createPlan_WhenGoalUnreachable_ReturnsEmptyPath(self):
+        grid = np.array([[0, 1, 0],
+                         [1, 1, 0],
+                         [0, 0, 0]], dtype=bool)
+        occ_grid = World.occupancy_grid_from_numpy_array(grid)
+        p = Planner.AStarPlanner()
+        path, explored = p.create_plan([0,0], [2,2], occ_grid)
+        self.assertFalse(path)
+        self.assertEqual(explored, [[0,0]])
+
+    def test_createPlan_WithoutExplored_ReturnsSamePath(self):
+        start = [4,0]
+        end = [0,4]
+        path, explored = Planner.AStarPlanner().create_plan(start, end, self.occ_grid)
+        fast_path, fast_explored = Planner.AStarPlanner(record_explored=False).create_plan(start, end, self.occ_grid)
+        self.assertEqual(path, fast_path)
+        self.assertTrue(explored)
+        self.assertFalse(fast_explored)
+
+    def test_createPlan_EightConnected(self):
+        start = [2,2]
+        end = [4,3]
+        expected_path = [[2,2],[3,1],[4,2],[4,3]]
+        p = Planner.AStarPlanner(connection_type='eight')
+        path, explored = p.create_plan(start, end, self.occ_grid)
+        self.assertEqual(expected_path, path)
+
+    def test_createPlan_WithCostLayer_AvoidsExpensiveCells(self):
+        occ_grid = World.occupancy_grid_from_numpy_array(np.zeros((5, 5), dtype=bool))
+        costs = np.zeros((5, 5))
+        costs[0:4, 2] = 10
+        occ_grid.set_cost_layer('terrain', costs)
+        path, explored = Planner.AStarPlanner().create_plan([0,0], [0,4], occ_grid)
+        self.assertIn([4,2], path)
+        self.assertEqual(13, len(path))
+
+    def test_createPlan_WithZeroCostLayer_MatchesBinaryPlan(self):
+        for connection_type in ['four', 'eight']:
+            p = Planner.AStarPlanner(connection_type=connection_type)
+            path, _ = p.create_plan([4,0], [0,4], self.occ_grid)
+            occ_grid = World.occupancy_grid_from_numpy_array(self.sample_grid_bool)
+            occ_grid.set_cost_layer('terrain', np.zeros((5, 5)))
+            weighted_path, _ = p.create_plan([4,0], [0,4], occ_grid)
+            self.assertAlmostEqual(path_cost(path), path_cost(weighted_path))
+
+    def test_createPlan_InfiniteCostCellsAreBlocked(self):
+        occ_grid = World.occupancy_grid_from_numpy_array(np.zeros((3, 3), dtype=bool))
+        costs = np.zeros((3, 3))
+        costs[:, 1] = np.inf
+        occ_grid.set_cost_layer('keep_out', costs)
+        path, explored = Planner.AStarPlanner().create_plan([0,0], [0,2], occ_grid)
+        self.assertFalse(path)
+        self.assertRaises(ValueError, Planner.JPSPlanner().create_plan, [0,0], [0,2], occ_grid)
+
+    def test_createPlan_WithTiledGrid_Raises(self):
+        tiled = World.TiledOccupancyGrid(32, 1, tile_size=8)
+        self.assertRaises(ValueError, Planner.AStarPlanner().create_plan, [0,0], [5,5], tiled)
+        path, explored = Planner.AStarPlanner().create_plan([0,0], [5,5], tiled.to_occupancy_grid())
+        self.assertTrue(path)
+
+
+def path_cost(path):
+    return sum(Planner.computeEuclideanDistance(p1, p2) for p1, p2 in zip(path[:-1], path[1:]))
+
+
+class TestDStarPlanner(WorldTestCase):
+
+    sample_grid = TestAStarPlanner.sample_grid
+
+    def create_grid(self):
+        return World.occupancy_grid_from_numpy_array(np.array(self.sample_grid, dtype=bool))
+
+    def test_createPlan_WhenStartBlocked_ReturnsEmptyPath(self):
+        path, explored = Planner.DStarPlanner().create_plan([1,1], [0,1], self.create_grid())
+        self.assertFalse(path)
+
+    def test_createPlan_WhenGoalUnreachable_ReturnsEmptyPath(self):
+        grid = np.array([[0, 1, 0],
+                         [1, 1, 0],
+                         [0, 0, 0]], dtype=bool)
+        occ_grid = World.occupancy_grid_from_numpy_array(grid)
+        path, explored = Planner.DStarPlanner().create_plan([0,0], [2,2], occ_grid)
+        self.assertFalse(path)
+
+    def test_createPlan_HardPath(self):
+        expected_path = [[4,0],[4,1],[4,2],[4,3],[4,4],[3,4],[2,4],[1,4],[0,4]]
+        path, explored = Planner.DStarPlanner().create_plan([4,0], [0,4], self.create_grid())
+        self.assertEqual(expected_path, path)
+
+    def test_createPlan_AfterGridChange_MatchesAStar(self):
+        occ_grid = self.create_grid()
+        p = Planner.DStarPlanner(connection_type='eight')
+        p.create_plan([4,0], [0,4], occ_grid)
+        occ_grid.grid[4,2] = True
+        occ_grid.grid[1,2] = False
+        path, explored = p.create_plan([4,1], [0,4], occ_grid)
+        expected_path, _ = Planner.AStarPlanner(connection_type='eight').create_plan([4,1], [0,4], occ_grid)
+        self.assertEqual(path[0], [4,1])
+        self.assertEqual(path[-1], [0,4])
+        self.assertFalse(any(occ_grid.grid[p[0], p[1]] for p in path))
+        self.assertAlmostEqual(path_cost(expected_path), path_cost(path))
+
+    def test_createPlan_WithIncrementalGrid_RepairsOnlyDirtyRegion(self):
+        occ_grid = World.IncrementalOccupancyGrid(20, 1)
+        occ_grid.grid[0:12, 9] = True
+        p = Planner.DStarPlanner()
+        path, explored = p.create_plan([10,2], [10,17], occ_grid)
+        self.assertTrue(path)
+        occ_grid.grid[0:3, 9] = False
+        occ_grid.grid[12:15, 9] = True
+        occ_grid.mark_dirty([(slice(0, 3), slice(9, 10)), (slice(12, 15), slice(9, 10))])
+        self.assertEqual(len(p.pending_windows), 2)
+        path, explored = p.create_plan([10,2], [10,17], occ_grid)
+        expected_path, _ = Planner.AStarPlanner().create_plan([10,2], [10,17], occ_grid)
+        self.assertAlmostEqual(path_cost(expected_path), path_cost(path))
+        self.assertFalse(p.pending_windows)
+
+    def test_close_UnsubscribesFromGrid(self):
+        occ_grid = World.IncrementalOccupancyGrid(10, 1)
+        p = Planner.DStarPlanner()
+        p.create_plan([0,0], [9,9], occ_grid)
+        self.assertEqual(1, len(occ_grid.subscribers))
+        p.close()
+        self.assertEqual([], occ_grid.subscribers)
+        path, explored = p.create_plan([0,0], [9,9], occ_grid)
+        self.assertEqual([9, 9], path[-1])
+        self.assertEqual(1, len(occ_grid.subscribers))
+
+    def test_createPlan_OnInflatedWorldGrid_ReplansAfterStep(self):
+        # A wall with a gap below it, which a box drives into during the step
+        entities = [{'Motion': {'Type': 'Static', 'InitialPosition': [0, 3], 'InitialVelocity': [0, 0]},
+                     'Shape': {'Type': 'Rectangle', 'Length': 2, 'Height': 14}},
+                    {'Motion': {'Type': 'ConstVel', 'InitialPosition': [-6, -7], 'InitialVelocity': [6, 0]},
+                     'Shape': {'Type': 'Rectangle', 'Length': 2, 'Height': 2}}]
+        world = World.World({'Entities': entities}, physics_limit=10)
+        inflated = world.get_occupancy_grid(1).get_distance_field(max_distance=3).get_inflated_grid(1.5)
+        p = Planner.DStarPlanner()
+        path, explored = p.create_plan([10,2], [10,17], inflated)
+        self.assertIn([15,9], path)
+        world.step(1.0)
+        self.assertTrue(inflated.grid[15, 9])
+        path, explored = p.create_plan([10,2], [10,17], inflated)
+        self.assertFalse(any(inflated.grid[row, col] for row, col in path))
+        expected_path, _ = Planner.AStarPlanner().create_plan([10,2], [10,17], inflated)
+        self.assertAlmostEqual(path_cost(expected_path), path_cost(path))
+
+    def test_planner_Dstar_ReturnsPlan(self):
+        p = Planner.Planner('Dstar')
+        path, explored = p.planner.create_plan([0,0], [1,4], self.create_grid())
+        self.assertEqual([[0,0],[0,1],[0,2],[0,3],[0,4],[1,4]], path)
+
+
+class TestBatchPlanner(unittest.TestCase):
+
+    occ_grid = TestAStarPlanner.occ_grid
+    starts = [[0,0], [2,2], [4,0], [1,1], [4,3], [0,0]]
+    ends = [[1,4], [4,3], [4,3], [4,3], [4,3], [4,4]]
+
+    def check_paths(self, paths, connection_type):
+        self.assertEqual(len(self.starts), len(paths))
+        for start, end, path in zip(self.starts, self.ends, paths):
+            expected_path, _ = Planner.AStarPlanner(connection_type).create_plan(start, end, self.occ_grid)
+            if len(expected_path) == 0:
+                self.assertEqual([], path)
+            elif start == end:
+                self.assertEqual([start], path)
+            else:
+                self.assertEqual(start, path[0])
+                self.assertEqual(end, path[-1])
+                self.assertAlmostEqual(path_cost(expected_path), path_cost(path))
+
+    def test_createPlans_MatchesAStarCosts(self):
+        for connection_type in ('four', 'eight'):
+            paths = Planner.BatchPlanner(connection_type).create_plans(self.starts, self.ends, self.occ_grid)
+            self.check_paths(paths, connection_type)
+
+    def test_createPlans_InProcessPool_MatchesAStarCosts(self):
+        paths = Planner.BatchPlanner(n_processes=2).create_plans(self.starts, self.ends, self.occ_grid)
+        self.check_paths(paths, 'four')
+
+    def test_createPlansDiscrete_ReturnsPaths(self):
+        paths = Planner.Planner('Astar').create_plans_discrete(self.starts, self.ends, self.occ_grid)
+        self.assertEqual(len(self.starts), len(paths))
+        self.assertEqual([[0,0],[0,1],[0,2],[0,3],[0,4],[1,4]], paths[0])
+
+    def test_createPlans_WithPlannerPool_MatchesAStarCosts(self):
+        with Planner.PlannerPool(2) as pool:
+            paths = Planner.BatchPlanner(pool=pool).create_plans(self.starts, self.ends, self.occ_grid)
+        self.check_paths(paths, 'four')
+
+
+class TestPlannerPool(unittest.TestCase):
+
+    def test_submit_ReturnsSamePathAsAStar(self):
+        occ_grid = TestAStarPlanner.occ_grid
+        expected_path, _ = Planner.AStarPlanner().create_plan([4,0], [0,4], occ_grid)
+        with Planner.PlannerPool(2) as pool:
+            futures = [pool.submit([4,0], [0,4], occ_grid) for _ in range(4)]
+            eight_future = pool.submit([2,2], [4,3], planner_type='Astar', connection_type='eight')
+            self.assertTrue(all(future.result() == expected_path for future in futures))
+            self.assertEqual([[2,2],[3,1],[4,2],[4,3]], eight_future.result())
+
+    def test_setGrid_OnlyCopiesWhenGridVersionChanges(self):
+        occ_grid = World.IncrementalOccupancyGrid(10, 1)
+        with Planner.PlannerPool(1) as pool:
+            pool.set_grid(occ_grid)
+            first_copy = pool.shared_grid
+            pool.set_grid(occ_grid)
+            self.assertIs(first_copy, pool.shared_grid)
+            occ_grid.grid[0:9, 5] = True
+            occ_grid.mark_dirty([(slice(0, 9), slice(5, 6))])
+            path = pool.submit([0,0], [0,9], occ_grid).result()
+            self.assertIsNot(first_copy, pool.shared_grid)
+            self.assertEqual([9,5], path[len(path)//2])
+
+    def test_planInWorker_ReusesPlannerPerGrid(self):
+        occ_grid = World.occupancy_grid_from_numpy_array(np.zeros((10, 10), dtype=bool))
+        with Planner.PlannerPool(1) as pool:
+            self.addCleanup(Planner.release_worker_grids)
+            pool.set_grid(occ_grid)
+            name = pool.shared_grid.segment.name
+            shape = pool.shared_grid.blocked.shape
+            path = Planner.plan_in_worker(name, shape, 'HPAstar', {'cluster_size': 5}, [0,0], [9,9])
+            self.assertEqual([9,9], path[-1])
+            planners = Planner.get_worker_state(name, shape)[2]
+            planner = next(iter(planners.values()))
+            Planner.plan_in_worker(name, shape, 'HPAstar', {'cluster_size': 5}, [9,0], [0,9])
+            self.assertIs(planner, next(iter(planners.values())))
+            Planner.plan_in_worker(name, shape, 'Dstar', {}, [9,0], [0,9])
+            self.assertEqual(2, len(planners))
+            Planner.release_worker_grids()
+
+    def test_submit_StatefulPlannersFollowGridChanges(self):
+        occ_grid = World.IncrementalOccupancyGrid(10, 1)
+        with Planner.PlannerPool(1) as pool:
+            for planner_type in ['Dstar', 'HPAstar']:
+                self.assertEqual([0,9], pool.submit([0,0], [0,9], occ_grid, planner_type=planner_type).result()[-1])
+            occ_grid.grid[0:9, 5] = True
+            occ_grid.mark_dirty([(slice(0, 9), slice(5, 6))])
+            for planner_type in ['Dstar', 'HPAstar']:
+                path = pool.submit([0,0], [0,9], occ_grid, planner_type=planner_type).result()
+                self.assertIn([9,5], path)
+
+
+class TestJPSPlanner(unittest.TestCase):
+
+    occ_grid = TestAStarPlanner.occ_grid
+
+    def test_createPlan_WhenEndBlocked_ReturnsEmptyPath(self):
+        path, explored = Planner.JPSPlanner().create_plan([0,1], [1,1], self.occ_grid)
+        self.assertFalse(path)
+
+    def test_createPlan_MatchesAStarCost(self):
+        for start, end in (([2,2], [4,3]), ([4,0], [0,4]), ([0,0], [1,4]), ([2,0], [2,4])):
+            expected_path, _ = Planner.AStarPlanner(connection_type='eight').create_plan(start, end, self.occ_grid)
+            path, explored = Planner.JPSPlanner().create_plan(start, end, self.occ_grid)
+            self.assertEqual(start, path[0])
+            self.assertEqual(end, path[-1])
+            self.assertAlmostEqual(path_cost(expected_path), path_cost(path))
+            self.assertFalse(any(self.occ_grid.is_blocked(p) for p in path))
+
+    def test_createPlan_OpenGrid_ExpandsFewerNodes(self):
+        grid = np.zeros((40, 40), dtype=bool)
+        grid[5:35, 20] = True
+        occ_grid = World.occupancy_grid_from_numpy_array(grid)
+        expected_path, astar_explored = Planner.AStarPlanner(connection_type='eight').create_plan([20,2], [22,37], occ_grid)
+        path, explored = Planner.JPSPlanner().create_plan([20,2], [22,37], occ_grid)
+        self.assertAlmostEqual(path_cost(expected_path), path_cost(path))
+        self.assertLess(10 * len(explored), len(astar_explored))
+
+    def test_init_FourConnected_Raises(self):
+        self.assertRaises(ValueError, Planner.JPSPlanner, 'four')
+
+    def test_planner_JPS_ReturnsPlan(self):
+        path, explored = Planner.Planner('JPS').create_plan_discrete([2,2], [4,3], self.occ_grid)
+        self.assertEqual([[2,2],[3,1],[4,2],[4,3]], path)
+
+
+class TestHPAStarPlanner(unittest.TestCase):
+
+    def create_grid(self):
+        grid = np.zeros((20, 20), dtype=bool)
+        grid[2:18, 9] = True
+        grid[10, 0:8] = True
+        return World.occupancy_grid_from_numpy_array(grid)
+
+    def check_path(self, path, start, end, occ_grid):
+        self.assertEqual(start, path[0])
+        self.assertEqual(end, path[-1])
+        for p1, p2 in zip(path[:-1], path[1:]):
+            self.assertEqual(1, max(abs(p1[0] - p2[0]), abs(p1[1] - p2[1])))
+            self.assertFalse(occ_grid.is_blocked(p2))
+
+    def test_createPlan_ReturnsValidNearOptimalPath(self):
+        occ_grid = self.create_grid()
+        path, explored = Planner.HPAStarPlanner(cluster_size=5).create_plan([15,2], [3,17], occ_grid)
+        self.check_path(path, [15,2], [3,17], occ_grid)
+        expected_path, _ = Planner.AStarPlanner(connection_type='eight').create_plan([15,2], [3,17], occ_grid)
+        self.assertLess(path_cost(path), 1.5 * path_cost(expected_path))
+
+    def test_createPlan_SameCluster_ReturnsPath(self):
+        occ_grid = self.create_grid()
+        path, explored = Planner.Planner('HPAstar').create_plan_discrete([0,0], [1,3], occ_grid)
+        self.check_path(path, [0,0], [1,3], occ_grid)
+
+    def test_createPlan_WhenGoalUnreachable_ReturnsEmptyPath(self):
+        occ_grid = self.create_grid()
+        occ_grid.grid[0:2, 9] = True
+        occ_grid.grid[18:20, 9] = True
+        path, explored = Planner.HPAStarPlanner(cluster_size=5).create_plan([15,2], [3,17], occ_grid)
+        self.assertFalse(path)
+
+    def test_createPlan_AfterGridChange_OnlyRebuildsDirtyClusters(self):
+        occ_grid = self.create_grid()
+        p = Planner.HPAStarPlanner(cluster_size=5)
+        p.create_plan([15,2], [3,17], occ_grid)
+        occ_grid.grid[0:2, 9] = True
+        occ_grid.grid[18:20, 9] = True
+        occ_grid.grid[12, 9] = False
+        path, explored = p.create_plan([15,2], [3,17], occ_grid)
+        self.check_path(path, [15,2], [3,17], occ_grid)
+        self.assertIn([12,9], path)
+        # The dirty clusters plus every cluster sharing a border or corner with one of them
+        self.assertEqual({(row, col) for row in range(4) for col in range(3)}, p.rebuilt_clusters)
+        fresh = Planner.HPAStarPlanner(cluster_size=5)
+        fresh.build(occ_grid)
+        self.assertEqual(fresh.transitions, p.transitions)
+        self.assertEqual({node: sorted(edges) for node, edges in fresh.crossings.items()},
+                         {node: sorted(edges) for node, edges in p.crossings.items()})
+
+        occ_grid.grid[0, 0] = True
+        p.create_plan([15,2], [3,17], occ_grid)
+        self.assertEqual({(0, 0), (0, 1), (1, 0), (1, 1)}, p.rebuilt_clusters)
+
+    def test_createPlansDiscrete_SharesAbstractGraph(self):
+        occ_grid = self.create_grid()
+        p = Planner.Planner('HPAstar')
+        starts = [[15,2], [0,0], [19,0]]
+        ends = [[3,17], [1,3], [0,19]]
+        paths = p.create_plans_discrete(starts, ends, occ_grid)
+        self.assertEqual(3, len(paths))
+        for path, start, end in zip(paths, starts, ends):
+            self.check_path(path, start, end, occ_grid)
+        self.assertIs(occ_grid, p.planner.grid)
+        self.assertRaises(ValueError, p.create_plans_discrete, starts, ends[:2], occ_grid)
+
+    def test_close_UnsubscribesFromGrid(self):
+        occ_grid = World.IncrementalOccupancyGrid(20, 1)
+        p = Planner.HPAStarPlanner(cluster_size=5)
+        p.create_plan([0,0], [19,19], occ_grid)
+        self.assertEqual(1, len(occ_grid.subscribers))
+        p.close()
+        self.assertEqual([], occ_grid.subscribers)
+        path, explored = p.create_plan([0,0], [19,19], occ_grid)
+        self.assertEqual([19, 19], path[-1])
+        self.assertEqual(1, len(occ_grid.subscribers))
+
+    def test_createPlan_DiagonalCrossings_FindsPath(self):
+        grid = np.ones((10, 10), dtype=bool)
+        grid[0:5, 4] = False
+        grid[4, 0:5] = False
+        grid[5, 5] = False
+        grid[5:10, 6] = False
+        occ_grid = World.occupancy_grid_from_numpy_array(grid)
+        path, explored = Planner.HPAStarPlanner(cluster_size=5).create_plan([0,4], [9,6], occ_grid)
+        self.check_path(path, [0,4], [9,6], occ_grid)
+        path, explored = Planner.HPAStarPlanner(cluster_size=5).create_plan([4,0], [9,6], occ_grid)
+        self.check_path(path, [4,0], [9,6], occ_grid)
+
+    def test_createPlan_RandomGrids_MatchesAStarReachability(self):
+        rng = np.random.default_rng(7)
+        for trial in range(60):
+            connection_type = ('four', 'eight')[trial % 2]
+            size = rng.integers(12, 31)
+            grid = rng.random((size, size)) < 0.35
+            occ_grid = World.occupancy_grid_from_numpy_array(grid)
+            free = np.argwhere(~grid)
+            start, end = (free[i].tolist() for i in rng.choice(len(free), size=2, replace=False))
+            hpa_path, _ = Planner.HPAStarPlanner(connection_type=connection_type, cluster_size=5).create_plan(start, end, occ_grid)
+            astar_path, _ = Planner.AStarPlanner(connection_type=connection_type).create_plan(start, end, occ_grid)
+            self.assertEqual(bool(len(astar_path)), bool(len(hpa_path)), (trial, start, end))
+
+
+class TestPlanCache(unittest.TestCase):
+
+    def test_createPlanDiscrete_RepeatedQuery_HitsCache(self):
+        cache = Planner.PlanCache()
+        p = Planner.Planner('Astar', plan_cache=cache)
+        path, explored = p.create_plan_discrete([4,0], [0,4], TestAStarPlanner.occ_grid)
+        cached_path, cached_explored = p.create_plan_discrete([4,0], [0,4], TestAStarPlanner.occ_grid)
+        self.assertEqual(path, cached_path)
+        self.assertEqual([], cached_explored)
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+    def test_createPlanDiscrete_PlainGridChanged_Misses(self):
+        cache = Planner.PlanCache()
+        p = Planner.Planner('Astar', plan_cache=cache)
+        occ_grid = World.occupancy_grid_from_numpy_array(np.zeros((5, 5), dtype=bool))
+        p.create_plan_discrete([0,0], [0,4], occ_grid)
+        occ_grid.grid[0,2] = True
+        occ_grid.mark_dirty([(slice(0, 1), slice(2, 3))])
+        path, explored = p.create_plan_discrete([0,0], [0,4], occ_grid)
+        self.assertNotIn([0,2], path)
+        self.assertEqual(0, cache.hits)
+
+    def test_createPlanDiscrete_CostLayerChanged_Misses(self):
+        cache = Planner.PlanCache()
+        p = Planner.Planner('Astar', plan_cache=cache)
+        occ_grid = World.occupancy_grid_from_numpy_array(np.zeros((5, 5), dtype=bool))
+        p.create_plan_discrete([0,0], [0,4], occ_grid)
+        costs = np.zeros((5, 5))
+        costs[0, 1:4] = 5
+        occ_grid.set_cost_layer('terrain', costs)
+        path, explored = p.create_plan_discrete([0,0], [0,4], occ_grid)
+        self.assertNotIn([0,2], path)
+        self.assertEqual(0, cache.hits)
+
+    def test_incrementalGridChange_KeepsUntouchedPaths(self):
+        cache = Planner.PlanCache()
+        p = Planner.Planner('Astar', plan_cache=cache)
+        occ_grid = World.IncrementalOccupancyGrid(6, 1)
+        top_path, _ = p.create_plan_discrete([0,0], [0,5], occ_grid)
+        bottom_path, _ = p.create_plan_discrete([5,0], [5,5], occ_grid)
+        occ_grid.grid[0,3] = True
+        occ_grid.mark_dirty([(slice(0, 1), slice(3, 4))])
+        new_top_path, _ = p.create_plan_discrete([0,0], [0,5], occ_grid)
+        cached_bottom_path, _ = p.create_plan_discrete([5,0], [5,5], occ_grid)
+        self.assertNotIn([0,3], new_top_path)
+        self.assertEqual(bottom_path, cached_bottom_path)
+        self.assertEqual((1, 1), (cache.hits, cache.invalidations))
+
+    def test_incrementalGridCollected_DropsItsPlans(self):
+        cache = Planner.PlanCache()
+        p = Planner.Planner('Astar', plan_cache=cache)
+        occ_grid = World.IncrementalOccupancyGrid(6, 1)
+        p.create_plan_discrete([0,0], [0,5], occ_grid)
+        grid_ref = weakref.ref(occ_grid)
+        del occ_grid
+        gc.collect()
+        self.assertIsNone(grid_ref())
+        self.assertEqual({}, cache.grids)
+        self.assertEqual(0, len(cache))
+        self.assertEqual(0, cache.n_path_cells)
+
+    def test_makeKey_PlainGridIsHashedOncePerVersion(self):
+        cache = Planner.PlanCache()
+        occ_grid = World.occupancy_grid_from_numpy_array(np.zeros((5, 5), dtype=bool))
+        key = cache.make_key(occ_grid, [0,0], [0,4], 'Astar', 'four')
+        digest = cache.digests[id(occ_grid)][3]
+        self.assertEqual(key, cache.make_key(occ_grid, [0,0], [0,4], 'Astar', 'four'))
+        self.assertIs(digest, cache.digests[id(occ_grid)][3])
+        occ_grid.grid[0,2] = True
+        occ_grid.mark_dirty([(slice(0, 1), slice(2, 3))])
+        self.assertNotEqual(key, cache.make_key(occ_grid, [0,0], [0,4], 'Astar', 'four'))
+
+    def test_close_UnsubscribesFromGrids(self):
+        cache = Planner.PlanCache()
+        p = Planner.Planner('Astar', plan_cache=cache)
+        occ_grid = World.IncrementalOccupancyGrid(6, 1)
+        p.create_plan_discrete([0,0], [0,5], occ_grid)
+        self.assertEqual(1, len(occ_grid.subscribers))
+        cache_ref = weakref.ref(cache)
+        cache.close()
+        self.assertEqual([], occ_grid.subscribers)
+        self.assertEqual(0, len(cache))
+        del cache, p
+        gc.collect()
+        self.assertIsNone(cache_ref())
+
+    def test_put_EvictsLeastRecentlyUsed(self):
+        cache = Planner.PlanCache(max_entries=2, max_path_cells=5)
+        cache.put('a', [[0,0],[0,1]])
+        cache.put('b', [[0,0],[1,0]])
+        cache.get('a')
+        cache.put('c', [[1,1],[1,2]])
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        cache.put('d', [[0,0],[0,1],[0,2],[0,3]])
+        self.assertEqual(['d'], list(cache.entries))
+
+
+class TestPlannerStats(unittest.TestCase):
+
+    occ_grid = TestAStarPlanner.occ_grid
+
+    def test_astar_RecordsCountersMatchingExplored(self):
+        expanded = []
+        stats = Planner.PlannerStats(on_expand=lambda row, col, cost: expanded.append([row, col]))
+        path, explored = Planner.AStarPlanner(stats=stats).create_plan([4,0], [0,4], self.occ_grid)
+        self.assertEqual(explored, expanded)
+        self.assertEqual(len(explored), stats.nodes_expanded)
+        self.assertEqual(stats.nodes_pushed, stats.heuristic_calls)
+        self.assertGreaterEqual(stats.nodes_pushed, stats.nodes_expanded)
+        self.assertGreater(stats.max_open_size, 0)
+        self.assertEqual({'setup', 'search', 'reconstruct'}, set(stats.phase_times))
+
+    def test_allPlanners_RecordStatsAndKeepPaths(self):
+        for planner_type in ('Astar', 'Dstar', 'JPS', 'HPAstar'):
+            stats = Planner.PlannerStats()
+            path, explored = Planner.Planner(planner_type, stats=stats).create_plan_discrete([4,0], [0,4], self.occ_grid)
+            plain_path, _ = Planner.Planner(planner_type).create_plan_discrete([4,0], [0,4], self.occ_grid)
+            self.assertEqual(plain_path, path)
+            self.assertEqual(1, stats.plans)
+            self.assertGreater(stats.nodes_expanded, 0)
+            self.assertGreater(stats.nodes_pushed, 0)
+
+    def test_reset_ClearsCounters(self):
+        stats = Planner.PlannerStats()
+        Planner.AStarPlanner(stats=stats).create_plan([4,0], [0,4], self.occ_grid)
+        stats.reset()
+        self.assertEqual(0, stats.nodes_expanded)
+        self.assertEqual({}, stats.phase_times)
+
+
+class TestSIPPPlanner(WorldTestCase):
+
+    def create_prediction(self, velocity):
+        # A 1x1 obstacle that starts in cell (0, 5) and moves with the given velocity
+        rectangle_class = World.create_dynamic_object(World.ConstVel, World.Rectangle)
+        obstacle = rectangle_class({'InitialVelocity': velocity}, {'Length': 1, 'Height': 1}, [0.5, 4.5])
+        return World.OccupancyPrediction(World.OccupancyGrid(10, 1), [obstacle], horizon=30)
+
+    def test_getSafeIntervals_ExcludesObstaclePassage(self):
+        prediction = self.create_prediction([0, -1])
+        self.assertEqual([(0.0, 3.0), (5.0, math.inf)], prediction.get_safe_intervals(4, 5))
+        self.assertEqual([(0.0, math.inf)], prediction.get_safe_intervals(4, 4))
+        self.assertFalse(prediction.is_safe(4, 5, 4))
+
+    def test_createPlan_WaitsForObstacleToPass(self):
+        prediction = self.create_prediction([0, -1])
+        path, explored = Planner.SIPPPlanner().create_plan([4,0], [4,9], prediction)
+        self.assertEqual([4, 4, 4.0], path[4])
+        self.assertEqual([4, 4, 5.0], path[5])
+        self.assertEqual([4, 9, 10.0], path[-1])
+        for (row, col, time), (next_row, next_col, next_time) in zip(path[:-1], path[1:]):
+            for t in np.linspace(time, next_time, 5):
+                self.assertTrue(prediction.is_safe(next_row, next_col, t) or (row, col) == (next_row, next_col))
+
+    def test_createPlan_WithoutConflicts_MatchesAStar(self):
+        prediction = self.create_prediction([0, 1])
+        path, explored = Planner.SIPPPlanner(connection_type='eight', move_time=0.5).create_plan([0,0], [9,9], prediction)
+        self.assertEqual(10, len(path))
+        self.assertAlmostEqual(9 * 0.5 * math.sqrt(2), path[-1][2])
+
+    def test_createPlan_WhenGoalNeverSafe_ReturnsEmptyPath(self):
+        prediction = self.create_prediction([0, 0])
+        path, explored = Planner.SIPPPlanner().create_plan([0,0], [0,5], prediction)
+        self.assertFalse(path)
+
+
+class TestRRTStarPlanner(WorldTestCase):
+
+    def create_entities(self):
+        rectangle_class = World.create_dynamic_object(World.Static, World.Rectangle)
+        circle_class = World.create_dynamic_object(World.Static, World.Circle)
+        triangle_class = World.create_dynamic_object(World.Static, World.Triangle)
+        return [rectangle_class({'InitialVelocity': [0, 0]}, {'Length': 2, 'Height': 16}, [0, -2]),
+                circle_class({'InitialVelocity': [0, 0]}, {'Radius': 2}, [-5, 5]),
+                triangle_class({'InitialVelocity': [0, 0]}, {'Length': 4, 'Height': 4}, [5, 5])]
+
+    def test_segmentsCollide_MatchesShapes(self):
+        obstacles = Planner.ShapeObstacles(self.create_entities())
+        p0 = np.array([[-3, 0], [-8, 5], [-8, 8], [3, 4], [3, 6.5], [-3, 9]])
+        p1 = np.array([[3, 0], [-2, 5], [-2, 8], [7, 4], [4, 6.5], [3, 9]])
+        self.assertEqual([True, True, False, True, False, False], obstacles.segments_collide(p0, p1).tolist())
+        self.assertEqual([True, False], obstacles.segments_collide([[0, 0], [0, 20]], [[0, 10]]).tolist())
+
+    def test_pointBucketIndex_MatchesBruteForce(self):
+        rng = np.random.default_rng(5)
+        points = rng.uniform(-20, 20, (300, 2))
+        index = Planner.PointBucketIndex(1.5)
+        for point in points:
+            index.add(point)
+        for query in rng.uniform(-40, 40, (50, 2)):
+            distances = np.linalg.norm(points - query, axis=1)
+            self.assertAlmostEqual(distances.min(), distances[index.nearest(query)])
+            self.assertEqual(sorted(np.nonzero(distances <= 3)[0].tolist()), sorted(index.within(query, 3).tolist()))
+
+    def test_createPlan_AvoidsObstacles(self):
+        entities = self.create_entities()
+        obstacles = Planner.ShapeObstacles(entities)
+        for rewire in [False, True]:
+            p = Planner.RRTStarPlanner(step_size=1.0, max_samples=3000, rewire=rewire, seed=3)
+            path, explored = p.create_plan([-8, -6], [8, -6], entities, (-12, -12, 12, 12))
+            self.assertEqual([-8, -6], path[0])
+            self.assertEqual([8, -6], path[-1])
+            self.assertFalse(obstacles.segments_collide(path[:-1], path[1:]).any())
+            if rewire:
+                self.assertLess(path_cost(path), rrt_cost)
+            rrt_cost = path_cost(path)
+
+    def test_createPlanContinuous_UsesWorldEntities(self):
+        world = World.World({'Entities': []}, physics_limit=10)
+        path, explored = Planner.Planner('RRTstar').create_plan_continuous([-5, -5], [5, 5], world)
+        self.assertEqual([[-5, -5], [5, 5]], [path[0], path[-1]])
+        self.assertRaises(ValueError, Planner.Planner('Astar').create_plan_continuous, [0, 0], [1, 1], world)
+
+
+class TestPotentialFieldPlanner(WorldTestCase):
+
+    def create_world(self, use_entity_store):
+        entities = [{'Motion': {'Type': 'Static', 'InitialPosition': [0, 0], 'InitialVelocity': [0, 0]},
+                     'Shape': {'Type': 'Circle', 'Radius': 1}},
+                    {'Motion': {'Type': 'Static', 'InitialPosition': [10, 0], 'InitialVelocity': [0, 0]},
+                     'Shape': {'Type': 'Rectangle', 'Length': 2, 'Height': 2}}]
+        return World.World({'Entities': entities}, physics_limit=20, use_entity_store=use_entity_store)
+
+    def test_computeAccelerations_RepelsWithinCutoff(self):
+        planner = Planner.PotentialFieldPlanner(attractive_gain=0, repulsive_gain=1, cutoff_distance=2, max_acc=100)
+        for use_entity_store in [False, True]:
+            world = self.create_world(use_entity_store)
+            positions = [[0, 2], [12, 0], [5, 0], [0, 0.5]]
+            acc = planner.compute_accelerations(positions, [0, 0], world)
+            # One meter from the circle surface and from the rectangle side
+            self.assertTrue(np.allclose([[0, 0.5], [0.5, 0], [0, 0]], acc[:3]))
+            self.assertGreater(acc[3, 1], 0)
+
+    def test_computeAccelerations_IsLimited(self):
+        planner = Planner.PotentialFieldPlanner(max_acc=2)
+        acc = planner.compute_accelerations([[-15, 15]], [15, -15], self.create_world(False), velocities=[[1, 0]])
+        self.assertAlmostEqual(2, np.linalg.norm(acc[0]))
+
+    def test_updateAgents_SetsAcceleration(self):
+        agents = [Agent.Agent(), Agent.Agent()]
+        Planner.PotentialFieldPlanner(attractive_gain=0.1, max_acc=100).update_agents(agents, [[3, 4], [-3, -4]], World.World({'Entities': []}))
+        self.assertTrue(np.allclose([0.3, 0.4], agents[0].acc_command))
+        self.assertTrue(np.allclose([-0.3, -0.4], agents[1].acc_command))
+
+    def test_updateSwarm_SetsAccelerations(self):
+        swarm = Agent.AgentSwarm()
+        swarm.create_agents([[0, 0], [1, 1]])
+        Planner.PotentialFieldPlanner(attractive_gain=0.5, max_acc=100).update_swarm(swarm, [2, 3], World.World({'Entities': []}))
+        self.assertTrue(np.allclose([[1, 1.5], [0.5, 1]], swarm.acc_commands))
+
+
+class TestMDPPlanner(unittest.TestCase):
+
+    def create_grid(self, size=20, seed=1):
+        blocked = np.random.default_rng(seed).random((size, size)) < 0.25
+        blocked[0, 0] = blocked[-1, -1] = False
+        return World.occupancy_grid_from_numpy_array(blocked)
+
+    def test_createPlan_WithoutSlip_MatchesAStarCost(self):
+        grid = self.create_grid()
+        for connection_type in ['four', 'eight']:
+            path, explored = Planner.MDPPlanner(connection_type).create_plan([0,0], [19,19], grid)
+            a_star_path, _ = Planner.AStarPlanner(connection_type).create_plan([0,0], [19,19], grid)
+            self.assertTrue(a_star_path)
+            self.assertEqual([0, 0], path[0])
+            self.assertEqual([19, 19], path[-1])
+            self.assertAlmostEqual(path_cost(a_star_path), path_cost(path))
+
+    def test_createPlan_WhenGoalUnreachable_ReturnsEmptyPath(self):
+        grid = World.occupancy_grid_from_numpy_array(np.array([[0, 1, 0],
+                                                               [1, 1, 0],
+                                                               [0, 0, 0]], dtype=bool))
+        planner = Planner.MDPPlanner(slip_probability=0.2)
+        path, explored = planner.create_plan([0,0], [2,2], grid)
+        self.assertFalse(path)
+        self.assertEqual(math.inf, planner.values[0, 0])
+
+    def test_solve_WithSlipInCorridor_WastesSlippedMoves(self):
+        # Slipping into the corridor walls leaves the agent in place, so each cell takes 1 / (1 - slip) moves on average
+        grid = np.ones((7, 7), dtype=bool)
+        grid[3, :] = False
+        occ_grid = World.occupancy_grid_from_numpy_array(grid)
+        planner = Planner.MDPPlanner(slip_probability=0.25)
+        values = planner.solve([3,6], occ_grid)
+        self.assertAlmostEqual(8.0, values[3, 0], places=4)
+        path, explored = planner.create_plan([3,0], [3,6], occ_grid)
+        self.assertEqual([[3, col] for col in range(7)], path)
+
+    def test_solve_WarmStartMatchesColdStart(self):
+        for slip_probability in [0.0, 0.2]:
+            planner = Planner.MDPPlanner('eight', slip_probability=slip_probability)
+            planner.solve([19,19], self.create_grid())
+            cold_iterations = planner.iterations
+            changed = self.create_grid()
+            changed.grid[10, 5:9] = 1
+            changed.grid[3, 3] = 0
+            values = planner.solve([19,19], changed)
+            self.assertLess(planner.iterations, cold_iterations)
+            expected = Planner.MDPPlanner('eight', slip_probability=slip_probability).solve([19,19], changed)
+            self.assertTrue(np.array_equal(np.isfinite(expected), np.isfinite(values)))
+            finite = np.isfinite(expected)
+            self.assertTrue(np.allclose(expected[finite], values[finite], atol=1e-4))
+
+    def test_solve_WarmStartAfterOpeningWall_ReachesNewCells(self):
+        grid = np.zeros((12, 12), dtype=bool)
+        grid[6, :] = True
+        planner = Planner.MDPPlanner(slip_probability=0.2)
+        self.assertEqual(math.inf, planner.solve([11,11], World.occupancy_grid_from_numpy_array(grid))[0, 0])
+        grid[6, 3] = False
+        opened = World.occupancy_grid_from_numpy_array(grid)
+        values = planner.solve([11,11], opened)
+        expected = Planner.MDPPlanner(slip_probability=0.2).solve([11,11], opened)
+        self.assertTrue(np.isfinite(values[~grid]).all())
+        self.assertTrue(np.allclose(expected[~grid], values[~grid], atol=1e-4))
+
+    def test_solve_WhenGridUnchanged_DoesNoSweeps(self):
+        planner = Planner.MDPPlanner()
+        planner.solve([19,19], self.create_grid())
+        planner.solve([19,19], self.create_grid())
+        self.assertEqual(0, planner.iterations)
+
+
+class TestLatticePlanner(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file = os.path.join(self.directory, 'primitives.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def create_planner(self, n_headings=8, **planner_args):
+        Planner.save_motion_primitives(Planner.create_motion_primitives(turning_radius=2.0, n_headings=n_headings), self.file)
+        return Planner.LatticePlanner(Planner.load_motion_primitives(self.file), **planner_args)
+
+    def assertFollowsPrimitives(self, planner, path, grid):
+        table = planner.primitives
+        for (row, col, heading), (next_row, next_col, next_heading) in zip(path[:-1], path[1:]):
+            self.assertIn((heading, next_row - row, next_col - col, next_heading), table.primitive_index)
+        for row, col, _ in table.get_poses(path):
+            self.assertFalse(grid.grid[int(math.floor(row + 0.5)), int(math.floor(col + 0.5))])
+
+    def test_createMotionPrimitives_TurnsRespectRadius(self):
+        primitives = Planner.create_motion_primitives(turning_radius=2.0, n_headings=4)['Primitives']
+        ends = [primitive['End'] for primitive in primitives if primitive['StartHeading'] == 0]
+        # Straight ahead, and quarter circle turns up (to lower rows) and down
+        self.assertEqual([[0, 1, 0], [-2, 2, 1], [2, 2, 3]], ends)
+        self.assertAlmostEqual(math.pi, primitives[1]['Cost'])
+
+    def test_motionPrimitiveTable_SweptCellsCoverFootprint(self):
+        data = {'Headings': 4, 'Primitives': [{'StartHeading': 0, 'End': [0, 3, 0]}]}
+        table = Planner.MotionPrimitiveTable(data)
+        self.assertEqual([[0, 0], [0, 1], [0, 2], [0, 3]], np.stack([table.swept_rows[0][0], table.swept_cols[0][0]], axis=1).tolist())
+        self.assertAlmostEqual(3.0, table.costs[0][0])
+        wide = Planner.MotionPrimitiveTable(data, footprint_radius=0.6)
+        # The rows above and below, plus one cell past each end, but not the corners
+        self.assertEqual(3 * 4 + 2, len(set(zip(wide.swept_rows[0][0].tolist(), wide.swept_cols[0][0].tolist()))))
+
+    def test_motionPrimitiveTable_RejectsBadPrimitives(self):
+        self.assertRaises(ValueError, Planner.MotionPrimitiveTable, {'Headings': 4, 'Primitives': [{'StartHeading': 4, 'End': [0, 1, 0]}]})
+        self.assertRaises(ValueError, Planner.MotionPrimitiveTable, {'Headings': 4, 'Primitives': [{'StartHeading': 0, 'End': [0, 0, 1]}]})
+        self.assertRaises(ValueError, Planner.MotionPrimitiveTable,
+                          {'Headings': 4, 'Primitives': [{'StartHeading': 0, 'End': [0, 2, 0], 'Poses': [[0, 0, 0], [0, 1, 0]]}]})
+
+    def test_createPlan_FollowsPrimitivesAroundObstacles(self):
+        blocked = np.random.default_rng(1).random((30, 30)) < 0.1
+        blocked[:3, :3] = blocked[-3:, -3:] = False
+        grid = World.occupancy_grid_from_numpy_array(blocked)
+        planner = self.create_planner()
+        path, explored = planner.create_plan([0,0,0], [29,29,0], grid)
+        self.assertEqual([0, 0, 0], path[0])
+        self.assertEqual([29, 29, 0], path[-1])
+        self.assertIn([0, 0, 0], explored)
+        self.assertFollowsPrimitives(planner, path, grid)
+
+    def test_createPlan_CannotTurnInPlace(self):
+        # A one cell wide corridor leaves no room to turn, although a grid planner would simply go back
+        blocked = np.ones((10, 10), dtype=bool)
+        blocked[5, :] = False
+        grid = World.occupancy_grid_from_numpy_array(blocked)
+        self.assertTrue(Planner.AStarPlanner().create_plan([5,5], [5,0], grid)[0])
+        planner = self.create_planner(n_headings=4)
+        path, explored = planner.create_plan([5,5,0], [5,0], grid)
+        self.assertFalse(path)
+        path, explored = planner.create_plan([5,5,0], [5,9], grid)
+        self.assertEqual([[5, col, 0] for col in range(5, 10)], path)
+
+    def test_createPlan_MatchesZeroHeuristicCost(self):
+        planner = self.create_planner()
+        dijkstra = self.create_planner(heuristic_weight=0.0)
+        table = planner.primitives
+        self.assertLess(table.heuristic_scale, 1.0)
+
+        def get_cost(path):
+            return sum(table.costs[heading][table.primitive_index[(heading, next_row - row, next_col - col, next_heading)]]
+                       for (row, col, heading), (next_row, next_col, next_heading) in zip(path[:-1], path[1:]))
+
+        rng = np.random.default_rng(24)
+        for trial in range(10):
+            blocked = rng.random((16, 16)) < 0.15
+            blocked[:2, :2] = blocked[-2:, -2:] = False
+            grid = World.occupancy_grid_from_numpy_array(blocked)
+            start = [0, 0, int(rng.integers(8))]
+            path, explored = planner.create_plan(start, [15,15], grid)
+            expected_path, _ = dijkstra.create_plan(start, [15,15], grid)
+            self.assertEqual(bool(expected_path), bool(path))
+            if path:
+                self.assertAlmostEqual(get_cost(expected_path), get_cost(path))
+
+    def test_createPlan_ReusesHeuristicTable(self):
+        grid = World.occupancy_grid_from_numpy_array(np.zeros((20, 20), dtype=bool))
+        planner = self.create_planner(heuristic_weight=1.5)
+        planner.create_plan([0,0,0], [15,15], grid)
+        table = planner.get_heuristic([15,15], grid)
+        path, explored = planner.create_plan([5,0,2], [15,15], grid)
+        self.assertIs(table, planner.get_heuristic([15,15], grid))
+        self.assertEqual(1, len(planner.heuristic_cache))
+        self.assertEqual([15, 15], path[-1][:2])
+        self.assertFollowsPrimitives(planner, path, grid)
@@ -0,0 +1,42 @@
+import os
+import numpy as np
+import Agent
+import Simulation
+import World
+from world_test_case import WorldTestCase
+
+SAMPLE_WORLD = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample_world.json')
+
+
+class TestSimulationRunner(WorldTestCase):
+
+    def test_run_FixedSteps_AdvancesWorldAndAgent(self):
+        agent = Agent.Agent()
+        agent.set_acc(np.array([1.0, 0.0]))
+        runner = Simulation.SimulationRunner(World.World(SAMPLE_WORLD), agent=agent, dt=0.1)
+        stats = runner.run(n_steps=10)
+        self.assertEqual(10, stats.steps)
+        self.assertAlmostEqual(1.0, stats.sim_time)
+        self.assertAlmostEqual(1.0, agent.get_vel()[0])
+        self.assertGreater(stats.steps_per_second, 0)
+
+    def test_run_UntilCondition_StopsWhenTrue(self):
+        runner = Simulation.SimulationRunner(World.World(SAMPLE_WORLD), dt=0.5)
+        stats = runner.run(until=lambda r: r.sim_time >= 2.0)
+        self.assertEqual(4, stats.steps)
+        stats = runner.run(until=lambda r: False, max_steps=3)
+        self.assertEqual(3, stats.steps)
+        self.assertEqual(7, runner.steps)
+
+    def test_run_WithoutStopCondition_Raises(self):
+        runner = Simulation.SimulationRunner(World.World(SAMPLE_WORLD))
+        self.assertRaises(ValueError, runner.run)
+
+    def test_run_WithGrid_KeepsGridUpToDate(self):
+        world = World.World(SAMPLE_WORLD, physics_limit=30)
+        runner = Simulation.SimulationRunner(world, dt=0.25, grid_resolution=1)
+        runner.run(n_steps=8)
+        rebuilt = World.OccupancyGrid(60, 1)
+        for entity in world.entity_list:
+            rebuilt.add_entity(entity)
+        self.assertTrue(np.array_equal(rebuilt.grid, world.get_occupancy_grid(1).grid))
@@ -0,0 +1,51 @@
+import csv
+import os
+import shutil
+import tempfile
+import Sweep
+from world_test_case import WorldTestCase
+
+
+class TestSweep(WorldTestCase):
+
+    def setUp(self):
+        super(TestSweep, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.results_file = os.path.join(self.directory, 'results.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read_results(self):
+        with open(self.results_file, newline='') as f:
+            return list(csv.DictReader(f))
+
+    def test_randomScenarios_AreReproducible(self):
+        first = list(Sweep.random_scenarios(3, seed=4, physics_limit=20))
+        second = list(Sweep.random_scenarios(3, seed=4, physics_limit=20))
+        self.assertEqual(first, second)
+        self.assertEqual(['seed_4', 'seed_5', 'seed_6'], [scenario['id'] for scenario in first])
+
+    def test_runEpisode_ReportsMetrics(self):
+        scenario = {'id': 'empty', 'world': {'Entities': []}, 'physics_limit': 5}
+        result = Sweep.run_episode(scenario)
+        self.assertEqual(set(Sweep.RESULT_COLUMNS), set(result))
+        self.assertEqual(1, result['success'])
+        self.assertEqual(0, result['collisions'])
+        self.assertEqual(result['steps'], result['path_length'])
+
+    def test_runSweep_ResumesAfterPartialRun(self):
+        scenarios = list(Sweep.random_scenarios(4, physics_limit=10, n_obstacles=(1, 3)))
+        Sweep.run_sweep(scenarios[:2], self.results_file, n_processes=1)
+        with open(self.results_file, 'a') as f:
+            f.write('seed_2,Ast')
+        n_run = Sweep.run_sweep(scenarios, self.results_file, n_processes=1)
+        self.assertEqual(2, n_run)
+        rows = self.read_results()
+        self.assertEqual(['seed_0', 'seed_1', 'seed_2', 'seed_3'], [row['scenario_id'] for row in rows])
+        self.assertEqual(0, Sweep.run_sweep(scenarios, self.results_file, n_processes=1))
+
+    def test_runSweep_InProcessPool_RecordsEveryScenario(self):
+        scenarios = list(Sweep.random_scenarios(3, physics_limit=10, n_obstacles=(1, 3)))
+        Sweep.run_sweep(scenarios, self.results_file, n_processes=2)
+        self.assertEqual({'seed_0', 'seed_1', 'seed_2'}, set(row['scenario_id'] for row in self.read_results()))
@@ -2,6 +2,10 @@ import unittest
 import numpy as np
 import World
 import pydoc
+import os
+import shutil
+import tempfile
+from world_test_case import WorldTestCase
 
 
 class TestDynamicObjects(unittest.TestCase):
@@ -112,3 +116,422 @@ class TestWorld(unittest.TestCase):
 
 
 
+class TestOccupancyGrid(unittest.TestCase):
+
+    def test_addEntity_Rectangle_BlocksOverlappedCells(self):
+        rectangle_class = World.create_dynamic_object(World.Static, World.Rectangle)
+        rectangle = rectangle_class({'InitialVelocity': [0, 0]}, {'Length': 2, 'Height': 1}, [1, 0.5])
+        og = World.OccupancyGrid(6, 1)
+        og.add_entity(rectangle)
+        expected = np.zeros((6, 6), dtype=bool)
+        expected[2, 3:5] = True
+        self.assertTrue(np.array_equal(og.grid, expected))
+
+    def test_addEntity_Circle_IsSymmetric(self):
+        circle_class = World.create_dynamic_object(World.Static, World.Circle)
+        circle = circle_class({'InitialVelocity': [0, 0]}, {'Radius': 2.5}, [0, 0])
+        og = World.OccupancyGrid(10, 0.5)
+        og.add_entity(circle)
+        self.assertTrue(np.array_equal(og.grid, og.grid[::-1, :]))
+        self.assertTrue(np.array_equal(og.grid, og.grid[:, ::-1]))
+        self.assertTrue(np.array_equal(og.grid, og.grid.T))
+        self.assertTrue(og.grid[og.position_to_2d_index([2.4, 0])[0], og.position_to_2d_index([2.4, 0])[1]])
+        self.assertFalse(og.grid[og.position_to_2d_index([2.4, 2.4])[0], og.position_to_2d_index([2.4, 2.4])[1]])
+
+    def test_addEntity_Triangle_BlocksOverlappedCells(self):
+        triangle_class = World.create_dynamic_object(World.Static, World.Triangle)
+        triangle = triangle_class({'InitialVelocity': [0, 0]}, {'Length': 4, 'Height': 2}, [0, 0])
+        og = World.OccupancyGrid(4, 1)
+        og.add_entity(triangle)
+        expected = np.array([[0, 0, 0, 0],
+                             [0, 1, 1, 0],
+                             [1, 1, 1, 1],
+                             [0, 0, 0, 0]], dtype=bool)
+        self.assertTrue(np.array_equal(og.grid, expected))
+
+    def test_addEntity_PartiallyOutsideGrid_ClipsToGrid(self):
+        rectangle_class = World.create_dynamic_object(World.Static, World.Rectangle)
+        rectangle = rectangle_class({'InitialVelocity': [0, 0]}, {'Length': 4, 'Height': 4}, [3, 3])
+        og = World.OccupancyGrid(4, 1)
+        og.add_entity(rectangle)
+        expected = np.zeros((4, 4), dtype=bool)
+        expected[0, 3] = True
+        self.assertTrue(np.array_equal(og.grid, expected))
+        far_away = rectangle_class({'InitialVelocity': [0, 0]}, {'Length': 1, 'Height': 1}, [20, 20])
+        og.add_entity(far_away)
+        self.assertTrue(np.array_equal(og.grid, expected))
+
+    def test_getCostMap_SumsLayers(self):
+        og = World.OccupancyGrid(4, 1)
+        self.assertIsNone(og.get_cost_map())
+        og.set_cost_layer('terrain', np.ones((4, 4)))
+        og.set_cost_layer('proximity', np.eye(4))
+        self.assertTrue(np.array_equal(np.ones((4, 4)) + np.eye(4), og.get_cost_map()))
+        og.remove_cost_layer('proximity')
+        self.assertTrue(np.array_equal(np.ones((4, 4)), og.get_cost_map()))
+        self.assertRaises(ValueError, og.set_cost_layer, 'bad', -np.ones((4, 4)))
+        self.assertRaises(ValueError, og.set_cost_layer, 'bad', np.ones((3, 4)))
+
+    def test_getCostMap_IsCachedUntilLayersChange(self):
+        og = World.OccupancyGrid(4, 1)
+        og.set_cost_layer('terrain', np.ones((4, 4)))
+        cost_map = og.get_cost_map()
+        self.assertIs(cost_map, og.get_cost_map())
+        self.assertFalse(cost_map.flags.writeable)
+        og.set_cost_layer('terrain', 2 * np.ones((4, 4)))
+        self.assertTrue(np.array_equal(2 * np.ones((4, 4)), og.get_cost_map()))
+
+
+class TestIncrementalOccupancyGrid(unittest.TestCase):
+
+    def create_entities(self):
+        static_class = World.create_dynamic_object(World.Static, World.Rectangle)
+        moving_class = World.create_dynamic_object(World.ConstVel, World.Circle)
+        static = static_class({'InitialVelocity': [0, 0]}, {'Length': 4, 'Height': 2}, [0, 0])
+        moving = moving_class({'InitialVelocity': [1.5, 0.5]}, {'Radius': 1.5}, [-4, 1])
+        return static, moving
+
+    def test_update_AfterMoving_MatchesFullRebuild(self):
+        static, moving = self.create_entities()
+        og = World.IncrementalOccupancyGrid(16, 0.5)
+        og.add_entity(static)
+        og.add_entity(moving)
+        for _ in range(5):
+            moving.update(1)
+            og.update()
+            rebuilt = World.OccupancyGrid(16, 0.5)
+            rebuilt.add_entity(static)
+            rebuilt.add_entity(moving)
+            self.assertTrue(np.array_equal(og.grid, rebuilt.grid))
+
+    def test_update_NotifiesSubscribersWithDirtyRegions(self):
+        static, moving = self.create_entities()
+        og = World.IncrementalOccupancyGrid(16, 1)
+        og.add_entity(static)
+        og.add_entity(moving)
+        dirty = []
+        og.subscribe(lambda rows, cols: dirty.append((rows, cols)))
+        version = og.version
+        og.update()
+        self.assertEqual(dirty, [])
+        self.assertEqual(og.version, version)
+        moving.update(1)
+        og.update()
+        # The windows before and after the move overlap, so they are reported as one merged region
+        self.assertEqual(len(dirty), 1)
+        self.assertEqual(og.version, version + 1)
+
+    def test_update_WithManyMovingEntities_MatchesFullRebuild(self):
+        rng = np.random.default_rng(3)
+        moving_class = World.create_dynamic_object(World.ConstVel, World.Circle)
+        static_class = World.create_dynamic_object(World.Static, World.Rectangle)
+        entities = [moving_class({'InitialVelocity': rng.uniform(-20, 20, 2).tolist()}, {'Radius': rng.uniform(0.3, 3)},
+                                 rng.uniform(-15, 15, 2).tolist()) for _ in range(60)]
+        entities += [static_class({'InitialVelocity': [0, 0]}, {'Length': 4, 'Height': 3}, rng.uniform(-15, 15, 2).tolist())
+                     for _ in range(5)]
+        og = World.IncrementalOccupancyGrid(40, 0.5)
+        for entity in entities:
+            og.add_entity(entity)
+        for _ in range(10):
+            for entity in entities:
+                entity.update(0.05)
+            og.update()
+            rebuilt = World.OccupancyGrid(40, 0.5)
+            for entity in entities:
+                rebuilt.add_entity(entity)
+            self.assertTrue(np.array_equal(og.grid, rebuilt.grid))
+
+    def test_removeEntity_ClearsCellsButKeepsStaticLayer(self):
+        static, moving = self.create_entities()
+        og = World.IncrementalOccupancyGrid(16, 1)
+        og.add_entity(static)
+        og.add_entity(moving)
+        og.remove_entity(moving)
+        self.assertTrue(np.array_equal(og.grid, og.static_grid))
+        og.remove_entity(static)
+        self.assertFalse(np.any(og.grid))
+
+
+class TestMergeCellWindows(unittest.TestCase):
+
+    def test_mergeCellWindows_CoversInputWithoutOverlaps(self):
+        rng = np.random.default_rng(5)
+        windows = []
+        for _ in range(200):
+            row, col = rng.integers(0, 90, 2)
+            height, width = rng.integers(1, 10, 2)
+            windows.append((slice(row, row + height), slice(col, col + width)))
+        merged = World.merge_cell_windows(windows, block_size=8)
+        covered = np.zeros((100, 100), dtype=int)
+        for window in merged:
+            covered[window] += 1
+        self.assertLessEqual(covered.max(), 1)
+        for window in windows:
+            self.assertTrue(np.all(covered[window] == 1))
+        self.assertLess(len(merged), len(windows))
+
+
+class TestEntityStore(unittest.TestCase):
+
+    def create_entities(self):
+        static_class = World.create_dynamic_object(World.Static, World.Rectangle)
+        moving_class = World.create_dynamic_object(World.ConstVel, World.Circle)
+        return [static_class({'InitialVelocity': [3, 3]}, {'Length': 4, 'Height': 2}, [0, 0]),
+                moving_class({'InitialVelocity': [1, 0]}, {'Radius': 1}, [8, 0]),
+                moving_class({'InitialVelocity': [0, -1]}, {'Radius': 2}, [0, 5])]
+
+    def test_step_MatchesPerObjectUpdate(self):
+        entities = self.create_entities()
+        expected = [e.pos + (e.vel if isinstance(e, World.ConstVel) else 0) * 0.5 for e in entities]
+        store = World.EntityStore(entities)
+        store.step(0.5)
+        for entity, pos in zip(entities, expected):
+            self.assertTrue(np.allclose(entity.get_position(), pos))
+
+    def test_entityViews_WriteThroughToStore(self):
+        entities = self.create_entities()
+        store = World.EntityStore(entities, capacity=1)
+        entities[1].update(2)
+        self.assertTrue(np.allclose(store.positions[1], [10, 0]))
+        self.assertEqual(list(store.ids), [e.get_id() for e in entities])
+
+    def test_getBoundingBoxes_MatchesEntities(self):
+        entities = self.create_entities()
+        store = World.EntityStore(entities)
+        boxes = store.get_bounding_boxes()
+        for entity, box in zip(entities, boxes):
+            self.assertTrue(np.allclose(entity.get_bounding_box(), box))
+
+    def test_cullOutside_RemovesAndReindexes(self):
+        entities = self.create_entities()
+        store = World.EntityStore(entities)
+        removed = store.cull_outside(6)
+        self.assertEqual(removed, [entities[1]])
+        self.assertEqual(store.entities, [entities[0], entities[2]])
+        self.assertTrue(np.allclose(entities[1].pos, [8, 0]))
+        store.step(1)
+        self.assertTrue(np.allclose(entities[2].pos, [0, 4]))
+        self.assertTrue(np.allclose(entities[1].pos, [8, 0]))
+
+
+class TestTiledOccupancyGrid(unittest.TestCase):
+
+    def create_entities(self):
+        rectangle_class = World.create_dynamic_object(World.Static, World.Rectangle)
+        circle_class = World.create_dynamic_object(World.Static, World.Circle)
+        return [rectangle_class({'InitialVelocity': [0, 0]}, {'Length': 6, 'Height': 2}, [-3, 4]),
+                circle_class({'InitialVelocity': [0, 0]}, {'Radius': 3.5}, [5, -5])]
+
+    def test_addEntity_MatchesDenseGrid(self):
+        dense = World.OccupancyGrid(30, 0.5)
+        tiled = World.TiledOccupancyGrid(30, 0.5, tile_size=16)
+        for entity in self.create_entities():
+            dense.add_entity(entity)
+            tiled.add_entity(entity)
+        self.assertTrue(np.array_equal(dense.grid, tiled.to_occupancy_grid().grid))
+        for index in np.argwhere(dense.grid)[::7]:
+            self.assertTrue(tiled.is_blocked(index))
+        self.assertFalse(tiled.is_blocked([0, 0]))
+        self.assertTrue(tiled.is_out_of_bounds([0, 60]))
+
+    def test_emptyTiles_AreNotAllocated(self):
+        tiled = World.TiledOccupancyGrid(1000, 0.1, tile_size=64)
+        self.assertEqual(0, tiled.nbytes)
+        tiled.set_window((slice(10, 12), slice(5000, 5003)), np.ones((2, 3), dtype=bool))
+        self.assertEqual(1, len(tiled.tiles))
+        self.assertEqual(64 * 64 // 8, tiled.nbytes)
+        tiled.set_window((slice(10, 12), slice(5000, 5003)), np.zeros((2, 3), dtype=bool))
+        self.assertEqual(0, len(tiled.tiles))
+
+    def test_snapshot_IsCopyOnWrite(self):
+        tiled = World.TiledOccupancyGrid(32, 1, tile_size=8)
+        tiled.set_window((slice(0, 4), slice(0, 4)), np.ones((4, 4), dtype=bool))
+        snapshot = tiled.get_grid()
+        self.assertIs(tiled.tiles[(0, 0)], snapshot.tiles[(0, 0)])
+        tiled.set_window((slice(4, 6), slice(4, 6)), np.ones((2, 2), dtype=bool))
+        self.assertTrue(tiled.is_blocked([5, 5]))
+        self.assertFalse(snapshot.is_blocked([5, 5]))
+        self.assertTrue(snapshot.is_blocked([3, 3]))
+
+    def test_mutators_WriteTilesOrRaise(self):
+        dense = World.OccupancyGrid(30, 0.5)
+        tiled = World.TiledOccupancyGrid(30, 0.5, tile_size=16)
+        cells = np.append(np.random.default_rng(4).uniform(-15, 15, (200, 2)), [[40, 0]], axis=0)
+        dense.fill_blocked_cells(cells)
+        tiled.fill_blocked_cells(cells)
+        self.assertTrue(np.array_equal(dense.grid, tiled.to_occupancy_grid().grid))
+        tiled.fill_blocked_cells([])
+        self.assertTrue(np.array_equal(dense.grid, tiled.to_occupancy_grid().grid))
+        with self.assertRaises(ValueError):
+            tiled.grid[0, 0] = True
+        entity = self.create_entities()[0]
+        with self.assertRaises(ValueError):
+            tiled.rasterize_entity(entity, tiled.get_cell_window(entity.get_bounding_box()), tiled.grid)
+        tiled.set_cost_layer('terrain', np.ones((60, 60)))
+        self.assertRaises(ValueError, tiled.set_cost_layer, 'terrain', np.ones((59, 60)))
+
+
+class TestOccupancyGridFile(WorldTestCase):
+
+    def setUp(self):
+        super(TestOccupancyGridFile, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.file = os.path.join(self.directory, 'grid.occ')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_loadOccupancyGrid_RoundTripsAsMemmap(self):
+        cells = np.random.default_rng(0).random((40, 40)) < 0.3
+        World.save_occupancy_grid(World.occupancy_grid_from_numpy_array(cells, 0.5), self.file)
+        loaded = World.load_occupancy_grid(self.file)
+        self.assertIsInstance(loaded.grid, np.memmap)
+        self.assertTrue(np.array_equal(cells, loaded.grid))
+        self.assertEqual(0.5, loaded.resolution)
+        self.assertEqual(40, loaded.n_cells)
+
+    def test_convertWorldToGridFile_MatchesWorldGrid(self):
+        world_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample_world.json')
+        world = World.World(world_file, physics_limit=20)
+        World.convert_world_to_grid_file(world, self.file, 1)
+        header = World.read_occupancy_grid_header(self.file)
+        self.assertEqual(world.get_occupancy_grid(1).version, header['grid_version'])
+        self.assertTrue(np.array_equal(world.get_occupancy_grid(1).grid, World.load_occupancy_grid(self.file).grid))
+
+    def test_loadOccupancyGrid_RejectsOtherFiles(self):
+        with open(self.file, 'wb') as f:
+            f.write(b'not a grid' * 10)
+        self.assertRaises(ValueError, World.load_occupancy_grid, self.file)
+
+
+class TestDistanceField(unittest.TestCase):
+
+    def brute_force_distance(self, blocked):
+        obstacles = np.argwhere(blocked)
+        rows, cols = np.indices(blocked.shape)
+        return np.sqrt((rows[..., None] - obstacles[:, 0]) ** 2 + (cols[..., None] - obstacles[:, 1]) ** 2).min(axis=-1)
+
+    def test_distanceTransform_MatchesBruteForce(self):
+        rng = np.random.default_rng(3)
+        for _ in range(10):
+            blocked = rng.random((rng.integers(1, 25), rng.integers(1, 25))) < 0.15
+            blocked[0, 0] = True
+            self.assertTrue(np.allclose(self.brute_force_distance(blocked), World.distance_transform(blocked)))
+
+    def test_distanceTransform_NoObstacles(self):
+        self.assertTrue(np.isinf(World.distance_transform(np.zeros((4, 5), dtype=bool))).all())
+
+    def test_update_MatchesFullRecompute(self):
+        grid = World.IncrementalOccupancyGrid(40, 1)
+        grid.grid[5:8, 5:8] = True
+        grid.grid[30, 10:20] = True
+        field = grid.get_distance_field(max_distance=4)
+        inflated = field.get_inflated_grid(1.5)
+        changed = []
+        inflated.subscribe(lambda rows, cols: changed.append((rows, cols)))
+
+        grid.grid[5:8, 5:8] = False
+        grid.grid[20:22, 20:22] = True
+        grid.mark_dirty([(slice(5, 8), slice(5, 8)), (slice(20, 22), slice(20, 22))])
+        expected = np.minimum(self.brute_force_distance(grid.grid), 4)
+        self.assertTrue(np.allclose(expected, field.get_distance()))
+        self.assertTrue(np.array_equal(expected <= 1.5, inflated.grid))
+        # The inflated grid is updated as each dirty region is reported
+        self.assertEqual(2, len(changed))
+        self.assertIs(inflated, field.get_inflated_grid(1.5))
+
+    def test_update_FarApartChanges_RecomputeSeparateRegions(self):
+        grid = World.IncrementalOccupancyGrid(200, 1)
+        grid.grid[100, 100] = True
+        field = grid.get_distance_field(max_distance=3)
+        crop_shapes = []
+        compute = field.compute
+        field.compute = lambda blocked: crop_shapes.append(blocked.shape) or compute(blocked)
+
+        grid.grid[10, 10] = True
+        grid.grid[190, 185:188] = True
+        grid.mark_dirty([(slice(10, 11), slice(10, 11))])
+        grid.mark_dirty([(slice(190, 191), slice(185, 188))])
+        expected = np.minimum(self.brute_force_distance(grid.grid), 3)
+        self.assertTrue(np.allclose(expected, field.get_distance()))
+        # Each change only needs its margin of 4 cells, plus 4 more of obstacles, on each side
+        self.assertEqual(sorted([(17, 17), (17, 19)]), sorted(crop_shapes))
+
+    def test_update_PlainGridRecomputesOnChange(self):
+        grid = World.OccupancyGrid(10, 0.5)
+        grid.grid[0, 0] = True
+        field = grid.get_distance_field()
+        self.assertAlmostEqual(0.5 * np.sqrt(2), field.get_distance()[1, 1])
+        grid.grid[2, 2] = True
+        self.assertAlmostEqual(0.5 * np.sqrt(2), field.get_distance()[3, 3])
+        self.assertIs(field, grid.get_distance_field())
+
+    def test_getClearanceCost(self):
+        grid = World.OccupancyGrid(10, 1)
+        grid.grid[0, :] = True
+        cost = grid.get_distance_field(max_distance=5).get_clearance_cost(1, 2, weight=4)
+        self.assertTrue(np.isinf(cost[1, 3]))
+        self.assertAlmostEqual(2, cost[2, 3])
+        self.assertAlmostEqual(0, cost[3, 3])
+        self.assertRaises(ValueError, grid.get_distance_field(max_distance=5).get_clearance_cost, 4, 2)
+
+
+class TestSpatialHash(WorldTestCase):
+
+    def create_world(self, use_entity_store):
+        rng = np.random.default_rng(7)
+        entities = []
+        for i in range(200):
+            motion = {'Type': 'ConstVel' if i % 2 else 'Static',
+                      'InitialPosition': rng.uniform(-40, 40, 2).tolist(),
+                      'InitialVelocity': rng.uniform(-20, 20, 2).tolist()}
+            shape = [{'Type': 'Circle', 'Radius': 1.5}, {'Type': 'Rectangle', 'Length': 3, 'Height': 2},
+                     {'Type': 'Triangle', 'Length': 4, 'Height': 3}][i % 3]
+            entities.append({'Motion': motion, 'Shape': shape})
+        return World.World({'Entities': entities}, physics_limit=50, use_entity_store=use_entity_store)
+
+    def brute_force_radius(self, world, center, radius):
+        found = []
+        for entity in world.entity_list:
+            min_x, min_y, max_x, max_y = entity.get_bounding_box()
+            dx = max(min_x - center[0], center[0] - max_x, 0)
+            dy = max(min_y - center[1], center[1] - max_y, 0)
+            if dx * dx + dy * dy <= radius * radius:
+                found.append(entity)
+        return sorted(found, key=lambda entity: entity.id)
+
+    def test_queryRadius_MatchesBruteForceAfterSteps(self):
+        for use_entity_store in [False, True]:
+            world = self.create_world(use_entity_store)
+            spatial_hash = world.get_spatial_hash(4)
+            for _ in range(5):
+                world.step(0.2)
+                self.assertEqual(len(world.entity_list), len(spatial_hash))
+                for center in [(0, 0), (20, -15), (-33, 8)]:
+                    self.assertEqual(self.brute_force_radius(world, center, 6), spatial_hash.query_radius(center, 6))
+            self.assertIs(spatial_hash, world.get_spatial_hash(4))
+
+    def test_queryBox_FindsOverlappingBoxes(self):
+        rectangle_class = World.create_dynamic_object(World.Static, World.Rectangle)
+        inside = rectangle_class({'InitialVelocity': [0, 0]}, {'Length': 2, 'Height': 2}, [1, 1])
+        outside = rectangle_class({'InitialVelocity': [0, 0]}, {'Length': 2, 'Height': 2}, [30, 1])
+        spatial_hash = World.SpatialHash(5)
+        spatial_hash.insert_all([inside, outside])
+        self.assertEqual([inside], spatial_hash.query_box((-1, -1, 0.5, 0.5)))
+        self.assertEqual([inside, outside], spatial_hash.query_box((-100, -100, 100, 100)))
+        spatial_hash.remove(inside)
+        self.assertEqual([], spatial_hash.query_box((-1, -1, 0.5, 0.5)))
+        self.assertEqual({}, {cell: entities for cell, entities in spatial_hash.cells.items() if inside in entities})
+
+    def test_findCollisions_UsesExactShapes(self):
+        triangle_class = World.create_dynamic_object(World.Static, World.Triangle)
+        circle_class = World.create_dynamic_object(World.Static, World.Circle)
+        triangle = triangle_class({'InitialVelocity': [0, 0]}, {'Length': 4, 'Height': 4}, [0, 0])
+        circle = circle_class({'InitialVelocity': [0, 0]}, {'Radius': 1}, [10, 0])
+        spatial_hash = World.SpatialHash(2)
+        spatial_hash.insert_all([triangle, circle])
+        # Inside the bounding box of the triangle but outside the triangle itself
+        self.assertEqual([], spatial_hash.find_collisions([-1.8, 1.8], 0.2))
+        self.assertEqual([triangle], spatial_hash.find_collisions([0, 0], 0.1))
+        self.assertEqual([circle], spatial_hash.find_collisions([11.5, 0], 0.6))
+        self.assertEqual([], spatial_hash.find_collisions([11.5, 1.5], 0.6))
@@ -0,0 +1,11 @@
+import unittest
+import World
+
+
+class WorldTestCase(unittest.TestCase):
+    """Base class for tests that create world entities
+    Entity ids come from a global counter that other tests check, so every test leaves it as it found it"""
+
+    def setUp(self):
+        id_number = World.ID_NUMBER
+        self.addCleanup(setattr, World, 'ID_NUMBER', id_number)